@@ -31,6 +31,9 @@ setup = SetupIamUser(
                     "dynamodb:GetItem",
                     "dynamodb:Query",
                     "dynamodb:UpdateItem",
+                    "dynamodb:BatchGetItem",
+                    "dynamodb:BatchWriteItem",
+                    "dynamodb:ConditionCheckItem",
                 ],
                 "Resource": [
                     f"arn:aws:dynamodb:{bsm.aws_region}:{bsm.aws_account_id}:table/sakura_*_status_tracking",
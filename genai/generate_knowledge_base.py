@@ -6,9 +6,22 @@ Generate the AI knowledge base for the project.
 .. code-block:: bash
 
     pip install "docpack>=0.1.2,<1.0.0"
+    python genai/generate_knowledge_base.py          # incremental
+    python genai/generate_knowledge_base.py --full   # rebuild everything
+
+The rebuild is incremental. ``tmp/manifest.json`` records the sha256 of every
+source file and the XML documents generated from it. On the next run only new
+or changed source files go through ``GitHubPipeline.fetch()``, documents of
+removed files are deleted, and if nothing changed the run stops right after
+hashing. The documents are streamed into ``all_in_one_knowledge_base.txt``
+one at a time, so memory use doesn't grow with the size of the repo.
 """
 
+import sys
+import json
 import shutil
+import fnmatch
+import hashlib
 from pathlib import Path
 
 from sakura_gather.paths import (
@@ -20,56 +33,167 @@ from docpack.api import GitHubPipeline
 dir_here = Path(__file__).absolute().parent
 dir_tmp = dir_here / "tmp"
 dir_tmp_docs = dir_tmp / "docs"
-shutil.rmtree(dir_tmp, ignore_errors=True)
-dir_tmp.mkdir()
-
-gh_pipeline = GitHubPipeline(
-    domain="github.com",
-    account="angoraking",
-    repo=f"{PACKAGE_NAME}-project",
-    branch="main",
-    dir_repo=dir_project_root,
-    include=[
-        f"{PACKAGE_NAME}/**/*.py",
-        "tests/**/*.py",
-        "docs/source/**/index.rst",
-        "docs/source/**/*.py",
-        "bin/**/*.py",
-        "bin/README.rst",
-        ".github/workflows/*.yml",
-        "README.rst",
-        "Makefile",
-        "poetry.toml",
-        "pyproject.toml",
-        ".coveragerc",
-        "codecov.yml",
-        ".readthedocs.yml",
-        "release-history.rst",
-    ],
-    exclude=[
-        f"{PACKAGE_NAME}/tests/**",
-        f"{PACKAGE_NAME}/tests/**/*.*",
-        f"{PACKAGE_NAME}/vendor/**",
-        f"{PACKAGE_NAME}/vendor/**/*.*",
-        f"tests/all.py",
-        f"tests/**/all.py",
-        f"docs/source/index.rst",
-        f"docs/source/release-history.rst",
-        f"docs/source/conf.py",
-        ".venv/**/*.*",
-        ".poetry/**/*.*",
-        "build/**/*.*",
-        "dist/**/*.*",
-        "htmlcov/**/*.*",
-        "tmp/**/*.*",
-        ".pytest_cache/**/*.*",
-        ".cache/**/*.*",
-        ".coverage",
-    ],
-    dir_out=dir_tmp_docs,
-)
-gh_pipeline.fetch()
-
+dir_tmp_staging = dir_tmp / "staging"
+path_manifest = dir_tmp / "manifest.json"
 filename = "all_in_one_knowledge_base.txt"
-lines = [path.read_text() for path in dir_tmp_docs.glob("*.xml")]
-dir_tmp.joinpath(filename).write_text("\n".join(lines), encoding="utf-8")
+path_knowledge_base = dir_tmp / filename
+
+include = [
+    f"{PACKAGE_NAME}/**/*.py",
+    "tests/**/*.py",
+    "docs/source/**/index.rst",
+    "docs/source/**/*.py",
+    "bin/**/*.py",
+    "bin/README.rst",
+    ".github/workflows/*.yml",
+    "README.rst",
+    "Makefile",
+    "poetry.toml",
+    "pyproject.toml",
+    ".coveragerc",
+    "codecov.yml",
+    ".readthedocs.yml",
+    "release-history.rst",
+]
+exclude = [
+    f"{PACKAGE_NAME}/tests/**",
+    f"{PACKAGE_NAME}/tests/**/*.*",
+    f"{PACKAGE_NAME}/vendor/**",
+    f"{PACKAGE_NAME}/vendor/**/*.*",
+    f"tests/all.py",
+    f"tests/**/all.py",
+    f"docs/source/index.rst",
+    f"docs/source/release-history.rst",
+    f"docs/source/conf.py",
+    ".venv/**/*.*",
+    ".poetry/**/*.*",
+    "build/**/*.*",
+    "dist/**/*.*",
+    "htmlcov/**/*.*",
+    "tmp/**/*.*",
+    ".pytest_cache/**/*.*",
+    ".cache/**/*.*",
+    ".coverage",
+]
+
+
+def new_pipeline(include: list[str], dir_out: Path) -> GitHubPipeline:
+    return GitHubPipeline(
+        domain="github.com",
+        account="angoraking",
+        repo=f"{PACKAGE_NAME}-project",
+        branch="main",
+        dir_repo=dir_project_root,
+        include=include,
+        exclude=exclude,
+        dir_out=dir_out,
+    )
+
+
+def list_source_files() -> list[str]:
+    """
+    Relative paths of the source files that go into the knowledge base.
+    """
+    paths = set()
+    for pattern in include:
+        for path in dir_project_root.glob(pattern):
+            if path.is_file():
+                relpath = path.relative_to(dir_project_root).as_posix()
+                if not any(fnmatch.fnmatch(relpath, p) for p in exclude):
+                    paths.add(relpath)
+    return sorted(paths)
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest() -> dict[str, dict]:
+    """
+    Source relative path -> ``{"sha256": ..., "docs": [xml file names]}``.
+    """
+    if path_manifest.exists():
+        return json.loads(path_manifest.read_text(encoding="utf-8"))
+    return dict()
+
+
+def save_manifest(manifest: dict[str, dict]):
+    path_tmp = path_manifest.with_suffix(".json.tmp")
+    path_tmp.write_text(json.dumps(manifest, indent=4), encoding="utf-8")
+    path_tmp.replace(path_manifest)
+
+
+def generate_docs(relpath: str) -> list[str]:
+    """
+    Run the pipeline for one source file and move its documents into
+    ``dir_tmp_docs``.
+
+    :return: names of the generated documents.
+    """
+    shutil.rmtree(dir_tmp_staging, ignore_errors=True)
+    dir_tmp_staging.mkdir(parents=True)
+    new_pipeline(include=[relpath], dir_out=dir_tmp_staging).fetch()
+    names = list()
+    for path in sorted(dir_tmp_staging.glob("*.xml")):
+        path.replace(dir_tmp_docs / path.name)
+        names.append(path.name)
+    return names
+
+
+def write_knowledge_base(manifest: dict[str, dict]):
+    """
+    Stream the documents into the knowledge base file, one at a time.
+    """
+    path_tmp = path_knowledge_base.with_suffix(".txt.tmp")
+    with path_tmp.open("wb") as f_out:
+        first = True
+        for relpath in sorted(manifest):
+            for name in manifest[relpath]["docs"]:
+                if not first:
+                    f_out.write(b"\n")
+                first = False
+                with dir_tmp_docs.joinpath(name).open("rb") as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+    path_tmp.replace(path_knowledge_base)
+
+
+def build(full: bool = False):
+    if full:
+        shutil.rmtree(dir_tmp, ignore_errors=True)
+    dir_tmp_docs.mkdir(parents=True, exist_ok=True)
+
+    old_manifest = load_manifest()
+    new_manifest = dict()
+    changed = list()
+    for relpath in list_source_files():
+        sha256 = sha256_file(dir_project_root / relpath)
+        old = old_manifest.get(relpath)
+        if old is not None and old["sha256"] == sha256:
+            new_manifest[relpath] = old
+        else:
+            new_manifest[relpath] = {"sha256": sha256, "docs": []}
+            changed.append(relpath)
+    removed = sorted(set(old_manifest) - set(new_manifest))
+
+    if not changed and not removed and path_knowledge_base.exists():
+        print("nothing changed")
+        return
+
+    for relpath in removed + changed:
+        for name in old_manifest.get(relpath, {}).get("docs", []):
+            dir_tmp_docs.joinpath(name).unlink(missing_ok=True)
+    for relpath in changed:
+        new_manifest[relpath]["docs"] = generate_docs(relpath)
+    shutil.rmtree(dir_tmp_staging, ignore_errors=True)
+
+    write_knowledge_base(new_manifest)
+    save_manifest(new_manifest)
+    print(f"{len(changed)} changed, {len(removed)} removed, {len(new_manifest)} total")
+
+
+if __name__ == "__main__":
+    build(full="--full" in sys.argv[1:])
@@ -1,2 +1,147 @@
 # -*- coding: utf-8 -*-
 
+"""
+Public API of ``sakura_gather``.
+
+Attributes are loaded lazily (:pep:`562`): ``import sakura_gather.api`` only
+imports this module, and boto3, aiohttp, pyarrow, smart_open or the
+``sakura_site_msav`` project are imported the first time an attribute that
+needs them is accessed.
+
+.. code-block:: python
+
+    import sakura_gather.api as sakura_gather
+
+    project = sakura_gather.new_project(lang_code_list=["cn"])  # imports boto3 now
+"""
+
+import typing as T
+import importlib
+
+# public name -> (module, attribute)
+_LAZY_ATTRS: dict[str, tuple[str, str]] = {
+    # project
+    "new_project": ("sakura_gather.project", "new_project"),
+    "new_bsm_dev": ("sakura_gather.project", "new_bsm_dev"),
+    "DEFAULT_LANG_CODE_LIST": ("sakura_gather.project", "DEFAULT_LANG_CODE_LIST"),
+    "RoundRobinManager": (
+        "sakura_site_msav.project.s04_2_crawl_website_mixin",
+        "RoundRobinManager",
+    ),
+    "SessionRegistry": ("sakura_gather.sessions", "SessionRegistry"),
+    "get_default_registry": ("sakura_gather.sessions", "get_default_registry"),
+    # daemon
+    "DaemonConfig": ("sakura_gather.daemon", "DaemonConfig"),
+    "CycleSummary": ("sakura_gather.daemon", "CycleSummary"),
+    "CrawlDaemon": ("sakura_gather.daemon", "CrawlDaemon"),
+    "FairShareScheduler": ("sakura_gather.fair_share", "FairShareScheduler"),
+    # fetch
+    "TokenBucket": ("sakura_gather.rate_limit", "TokenBucket"),
+    "DistributedTokenBucket": (
+        "sakura_gather.distributed_rate_limit",
+        "DistributedTokenBucket",
+    ),
+    "DynamoDBBucketStore": (
+        "sakura_gather.distributed_rate_limit",
+        "DynamoDBBucketStore",
+    ),
+    "RetryPolicy": ("sakura_gather.fetcher", "RetryPolicy"),
+    "FetchResult": ("sakura_gather.fetcher", "FetchResult"),
+    "AsyncFetcher": ("sakura_gather.fetcher", "AsyncFetcher"),
+    "download_pages": ("sakura_gather.fetcher", "download_pages"),
+    "AdaptiveBatchController": ("sakura_gather.batch_size", "AdaptiveBatchController"),
+    "PageCache": ("sakura_gather.page_cache", "PageCache"),
+    "fetch_with_cache": ("sakura_gather.page_cache", "fetch_with_cache"),
+    "RecordingTransport": ("sakura_gather.cassette", "RecordingTransport"),
+    "ReplayTransport": ("sakura_gather.cassette", "ReplayTransport"),
+    "CrawlPipeline": ("sakura_gather.pipeline", "CrawlPipeline"),
+    "Frontier": ("sakura_gather.frontier", "Frontier"),
+    "ScalableBloomFilter": ("sakura_gather.frontier", "ScalableBloomFilter"),
+    # status tracking and scheduling
+    "LeaseLostError": ("sakura_gather.exc", "LeaseLostError"),
+    "BatchedStatusTracker": ("sakura_gather.status_tracking", "BatchedStatusTracker"),
+    "Shard": ("sakura_gather.scheduler", "Shard"),
+    "make_shards": ("sakura_gather.scheduler", "make_shards"),
+    "InMemoryShardStore": ("sakura_gather.scheduler", "InMemoryShardStore"),
+    "DynamoDBShardStore": ("sakura_gather.scheduler", "DynamoDBShardStore"),
+    "WorkStealingScheduler": ("sakura_gather.scheduler", "WorkStealingScheduler"),
+    "NodeIdDispenser": ("sakura_gather.node_id", "NodeIdDispenser"),
+    "CheckpointStore": ("sakura_gather.checkpoint", "CheckpointStore"),
+    "run_micro_batches": ("sakura_gather.checkpoint", "run_micro_batches"),
+    "iter_html_db_entries": ("sakura_gather.html_db_stream", "iter_entries"),
+    "iter_html_db_chunks": ("sakura_gather.html_db_stream", "iter_chunks"),
+    # snapshot
+    "RecordStore": ("sakura_gather.records", "RecordStore"),
+    "Target": ("sakura_gather.uploader", "Target"),
+    "FanOutUploader": ("sakura_gather.uploader", "FanOutUploader"),
+    "write_snapshot": ("sakura_gather.parquet_snapshot", "write_snapshot"),
+    "read_snapshot": ("sakura_gather.parquet_snapshot", "read_snapshot"),
+    "convert_jsonl_snapshot": (
+        "sakura_gather.parquet_snapshot",
+        "convert_jsonl_snapshot",
+    ),
+    "FingerprintIndex": ("sakura_gather.snapshot_diff", "FingerprintIndex"),
+    "SnapshotDiff": ("sakura_gather.snapshot_diff", "SnapshotDiff"),
+    "diff_snapshot": ("sakura_gather.snapshot_diff", "diff"),
+    "DictionaryStore": ("sakura_gather.codec", "DictionaryStore"),
+    "PageCodec": ("sakura_gather.codec", "PageCodec"),
+    "SearchIndex": ("sakura_gather.search_index", "SearchIndex"),
+    # tracing
+    "configure_tracing": ("sakura_gather.tracing", "configure_tracing"),
+    "span": ("sakura_gather.tracing", "span"),
+    "traced": ("sakura_gather.tracing", "traced"),
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name: str) -> T.Any:
+    try:
+        module_name, attr = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), attr)
+    # cache it, so the next access doesn't go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
+
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .project import new_project, new_bsm_dev, DEFAULT_LANG_CODE_LIST
+    from .sessions import SessionRegistry, get_default_registry
+    from .daemon import DaemonConfig, CycleSummary, CrawlDaemon
+    from .fair_share import FairShareScheduler
+    from .rate_limit import TokenBucket
+    from .distributed_rate_limit import DistributedTokenBucket, DynamoDBBucketStore
+    from .fetcher import RetryPolicy, FetchResult, AsyncFetcher, download_pages
+    from .batch_size import AdaptiveBatchController
+    from .page_cache import PageCache, fetch_with_cache
+    from .cassette import RecordingTransport, ReplayTransport
+    from .pipeline import CrawlPipeline
+    from .frontier import Frontier, ScalableBloomFilter
+    from .exc import LeaseLostError
+    from .status_tracking import BatchedStatusTracker
+    from .scheduler import (
+        Shard,
+        make_shards,
+        InMemoryShardStore,
+        DynamoDBShardStore,
+        WorkStealingScheduler,
+    )
+    from .records import RecordStore
+    from .node_id import NodeIdDispenser
+    from .checkpoint import CheckpointStore, run_micro_batches
+    from .html_db_stream import (
+        iter_entries as iter_html_db_entries,
+        iter_chunks as iter_html_db_chunks,
+    )
+    from .uploader import Target, FanOutUploader
+    from .parquet_snapshot import write_snapshot, read_snapshot, convert_jsonl_snapshot
+    from .snapshot_diff import FingerprintIndex, SnapshotDiff, diff as diff_snapshot
+    from .codec import DictionaryStore, PageCodec
+    from .search_index import SearchIndex
+    from .tracing import configure_tracing, span, traced
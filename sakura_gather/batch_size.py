@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive ``big_batch_size`` / ``micro_batch_size`` for the detail crawl.
+
+Hand-tuned constants are too small when the site is fast and too large when
+it throttles us. :class:`AdaptiveBatchController` uses an AIMD policy
+(additive increase, multiplicative decrease), the same idea TCP uses for its
+congestion window:
+
+- every request outcome is recorded with :meth:`AdaptiveBatchController.record`,
+- after each micro batch, :meth:`AdaptiveBatchController.update` looks at the
+  observations since the last update. A throttle response (``429`` / ``5xx``),
+  including one a retry got past, a high error rate or a high median latency
+  shrinks both sizes by ``decrease_factor``, otherwise both grow by their
+  additive step.
+
+Every size change is logged.
+
+.. code-block:: python
+
+    controller = AdaptiveBatchController(big_batch_size=10, micro_batch_size=3)
+    while True:
+        for url in next_micro_batch(controller.micro_batch_size):
+            res = fetch(url)
+            controller.record_fetch_result(res)
+        controller.update()
+"""
+
+import typing as T
+import logging
+import statistics
+import dataclasses
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .fetcher import FetchResult
+
+logger = logging.getLogger(__name__)
+
+
+def is_throttle_status(status: int | None) -> bool:
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+
+@dataclasses.dataclass
+class BatchSizeChange:
+    """
+    A record of one size change, for logging and inspection.
+    """
+
+    reason: str
+    big_batch_size_before: int
+    big_batch_size_after: int
+    micro_batch_size_before: int
+    micro_batch_size_after: int
+
+    def to_message(self) -> str:
+        return (
+            f"batch size changed ({self.reason}): "
+            f"big_batch_size {self.big_batch_size_before} -> {self.big_batch_size_after}, "
+            f"micro_batch_size {self.micro_batch_size_before} -> {self.micro_batch_size_after}"
+        )
+
+
+class AdaptiveBatchController:
+    """
+    :param big_batch_size: initial big batch size.
+    :param micro_batch_size: initial micro batch size.
+    :param min_big_batch_size: lower bound of the big batch size.
+    :param max_big_batch_size: upper bound of the big batch size.
+    :param min_micro_batch_size: lower bound of the micro batch size.
+    :param max_micro_batch_size: upper bound of the micro batch size.
+    :param big_batch_step: additive increase of the big batch size.
+    :param micro_batch_step: additive increase of the micro batch size.
+    :param decrease_factor: multiplicative decrease factor, in ``(0, 1)``.
+    :param target_latency: median latency in seconds above which the site is
+        considered overloaded.
+    :param max_error_rate: error rate above which the sizes are decreased.
+    :param min_observations: don't adjust on fewer observations than this.
+    """
+
+    def __init__(
+        self,
+        big_batch_size: int = 10,
+        micro_batch_size: int = 3,
+        min_big_batch_size: int = 1,
+        max_big_batch_size: int = 1000,
+        min_micro_batch_size: int = 1,
+        max_micro_batch_size: int = 100,
+        big_batch_step: int = 2,
+        micro_batch_step: int = 1,
+        decrease_factor: float = 0.5,
+        target_latency: float = 5.0,
+        max_error_rate: float = 0.1,
+        min_observations: int = 1,
+    ):
+        if not (0 < decrease_factor < 1):
+            raise ValueError("decrease_factor has to be in (0, 1)")
+        self.min_big_batch_size = min_big_batch_size
+        self.max_big_batch_size = max_big_batch_size
+        self.min_micro_batch_size = min_micro_batch_size
+        self.max_micro_batch_size = max_micro_batch_size
+        self.big_batch_step = big_batch_step
+        self.micro_batch_step = micro_batch_step
+        self.decrease_factor = decrease_factor
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.min_observations = min_observations
+        self.big_batch_size = 0
+        self.micro_batch_size = 0
+        self._set_sizes(big_batch_size, micro_batch_size)
+        self.history: list[BatchSizeChange] = list()
+        self._latencies: list[float] = list()
+        self._n_error = 0
+        self._n_throttle = 0
+
+    def _set_sizes(self, big_batch_size: int, micro_batch_size: int):
+        micro_batch_size = max(
+            self.min_micro_batch_size,
+            min(self.max_micro_batch_size, micro_batch_size),
+        )
+        big_batch_size = max(
+            self.min_big_batch_size,
+            min(self.max_big_batch_size, big_batch_size),
+        )
+        # a big batch is made of micro batches
+        self.micro_batch_size = micro_batch_size
+        self.big_batch_size = max(big_batch_size, micro_batch_size)
+
+    @property
+    def n_observation(self) -> int:
+        return len(self._latencies)
+
+    def record(
+        self,
+        latency: float,
+        status: int | None,
+        error: bool = False,
+        n_attempt: int = 1,
+    ):
+        """
+        Record the outcome of one request.
+
+        :param latency: seconds the request took.
+        :param status: HTTP status code, ``None`` if no response was received.
+        :param error: whether the request failed for any other reason.
+        :param n_attempt: attempts made, a retried request was throttled or
+            failed before, even if the last attempt succeeded.
+        """
+        self._latencies.append(latency)
+        if is_throttle_status(status) or n_attempt > 1:
+            self._n_throttle += 1
+        if error or status is None or status >= 400:
+            self._n_error += 1
+
+    def record_fetch_result(self, result: "FetchResult"):
+        """
+        Record a :class:`~sakura_gather.fetcher.FetchResult`. The latency is
+        the one of the last attempt, without the backoff sleeps before it.
+        """
+        self.record(
+            latency=result.last_elapsed,
+            status=result.status,
+            error=result.error is not None,
+            n_attempt=result.n_attempt,
+        )
+
+    def _reset_window(self):
+        self._latencies.clear()
+        self._n_error = 0
+        self._n_throttle = 0
+
+    def _get_decrease_reason(self) -> str | None:
+        if self._n_throttle:
+            return f"{self._n_throttle} throttled or retried requests"
+        error_rate = self._n_error / self.n_observation
+        if error_rate > self.max_error_rate:
+            return f"error rate {error_rate:.1%}"
+        median_latency = statistics.median(self._latencies)
+        if median_latency > self.target_latency:
+            return f"median latency {median_latency:.2f}s"
+        return None
+
+    def update(self) -> BatchSizeChange | None:
+        """
+        Adjust the sizes based on the observations since the last update,
+        then start a new observation window.
+
+        :return: the change, or ``None`` if the sizes didn't change.
+        """
+        if self.n_observation < self.min_observations:
+            return None
+        reason = self._get_decrease_reason()
+        self._reset_window()
+        big_before, micro_before = self.big_batch_size, self.micro_batch_size
+        if reason is None:
+            reason = "healthy"
+            self._set_sizes(
+                big_before + self.big_batch_step,
+                micro_before + self.micro_batch_step,
+            )
+        else:
+            self._set_sizes(
+                int(big_before * self.decrease_factor),
+                int(micro_before * self.decrease_factor),
+            )
+        if (self.big_batch_size, self.micro_batch_size) == (big_before, micro_before):
+            return None
+        change = BatchSizeChange(
+            reason=reason,
+            big_batch_size_before=big_before,
+            big_batch_size_after=self.big_batch_size,
+            micro_batch_size_before=micro_before,
+            micro_batch_size_after=self.micro_batch_size,
+        )
+        self.history.append(change)
+        logger.info(change.to_message())
+        return change
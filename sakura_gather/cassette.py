@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+"""
+Record / replay HTTP cassettes, for deterministic offline crawl benchmarks.
+
+A crawl against the live site measures the network as much as the code.
+:class:`RecordingTransport` wraps a real
+:class:`~sakura_gather.fetcher.Transport` and writes every response it sees
+into a cassette, :class:`ReplayTransport` serves them back from the cassette
+with no network, so fetch, parse and storage changes can be A/B benchmarked
+on exactly the same bytes.
+
+A cassette is one zip file:
+
+- ``bodies/<sha256>``: response bodies, deflate compressed, identical bodies
+  are stored once.
+- ``index.json``: for every request key, the list of recorded responses in
+  order, each with status, headers, body entry and measured latency. The
+  index is loaded on open, bodies are read on demand.
+
+A request that raised in the real transport, e.g. a timeout or a connection
+reset, is recorded as an error with the exception type and message, and the
+replay raises it again after the recorded latency: builtin exceptions like
+:class:`TimeoutError` or :class:`ConnectionResetError` as themselves, others
+as :class:`RecordedTransportError`.
+
+The zip file is only readable once it is closed, the index and the zip
+directory are written by :meth:`RecordingTransport.close`, also when the
+recording is interrupted by an error, as long as the transport is closed,
+e.g. by ``async with AsyncFetcher(...)``.
+
+The request key is the method, the url and the conditional request headers
+(``If-None-Match``, ``If-Modified-Since``), since those change the response.
+A key requested several times while recording, e.g. a ``503`` then a ``200``
+on retry, is replayed in the same order, after the last recorded response
+the last one is served again.
+
+Replay latency is either the recorded latency of each response or a fixed
+value, times ``1 + uniform(-jitter, jitter)``. The jitter of a response
+depends only on the seed, the request key and how often the key was served,
+not on the order concurrent requests arrive in, so two replays with the same
+seed sleep exactly the same.
+
+.. code-block:: python
+
+    # once, online
+    async with AsyncFetcher(transport=RecordingTransport(path_cassette)) as f:
+        await f.fetch_many(urls)
+
+    # any number of times, offline
+    transport = ReplayTransport(path_cassette, latency=0.05, jitter=0.2, seed=1)
+    results = download_pages(urls, transport=transport)
+"""
+
+import typing as T
+import json
+import builtins
+import time
+import random
+import asyncio
+import hashlib
+import zipfile
+import threading
+import dataclasses
+from pathlib import Path
+
+from .fetcher import Response, Transport, AiohttpTransport
+
+INDEX = "index.json"
+KEY_HEADERS = ("if-none-match", "if-modified-since")
+
+
+class CassetteMissError(KeyError):
+    """
+    Raised on replay when a request was never recorded.
+    """
+
+
+class RecordedTransportError(Exception):
+    """
+    Raised on replay for a recorded exception that is not a builtin one.
+    """
+
+    def __init__(self, error_type: str, message: str):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+
+def get_request_key(
+    method: str,
+    url: str,
+    headers: dict[str, str] | None = None,
+) -> str:
+    key = f"{method.upper()} {url}"
+    for name, value in sorted((headers or dict()).items()):
+        if name.lower() in KEY_HEADERS:
+            key += f"\n{name.lower()}: {value}"
+    return key
+
+
+@dataclasses.dataclass
+class Interaction:
+    """
+    One recorded response, or one recorded exception if ``error_type`` is
+    set.
+    """
+
+    status: int
+    headers: dict[str, str]
+    body: str  # the zip entry of the body
+    latency: float
+    error_type: str | None = None
+    error_message: str | None = None
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return dataclasses.asdict(self)
+
+    def to_exception(self) -> Exception:
+        module, _, name = self.error_type.rpartition(".")
+        error_class = getattr(builtins, name, None) if module == "builtins" else None
+        if isinstance(error_class, type) and issubclass(error_class, Exception):
+            try:
+                return error_class(self.error_message)
+            except Exception:  # pragma: no cover
+                pass
+        return RecordedTransportError(self.error_type, self.error_message)
+
+
+def get_error_type(error: Exception) -> str:
+    return f"{type(error).__module__}.{type(error).__qualname__}"
+
+
+class RecordingTransport:
+    """
+    Forward requests to ``transport`` and record the responses in a new
+    cassette, written to ``path`` on :meth:`close`.
+
+    :param transport: the real transport, an :class:`AiohttpTransport` by
+        default.
+    :param compresslevel: deflate level of the bodies.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        transport: Transport | None = None,
+        compresslevel: int = 6,
+    ):
+        self.path = Path(path)
+        self.transport = AiohttpTransport() if transport is None else transport
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(
+            self.path,
+            "w",
+            compression=zipfile.ZIP_DEFLATED,
+            compresslevel=compresslevel,
+        )
+        self._index: dict[str, list[dict[str, T.Any]]] = dict()
+        self._bodies: set[str] = set()
+        self._lock = threading.Lock()
+        self.n_request = 0
+
+    def _record(self, key: str, res: Response, latency: float):
+        name = "bodies/" + hashlib.sha256(res.body).hexdigest()
+        with self._lock:
+            if name not in self._bodies:
+                self._zip.writestr(name, res.body)
+                self._bodies.add(name)
+            interaction = Interaction(
+                status=res.status,
+                headers=dict(res.headers),
+                body=name,
+                latency=latency,
+            )
+            self._index.setdefault(key, []).append(interaction.to_dict())
+            self.n_request += 1
+
+    def _record_error(self, key: str, error: Exception, latency: float):
+        interaction = Interaction(
+            status=0,
+            headers=dict(),
+            body="",
+            latency=latency,
+            error_type=get_error_type(error),
+            error_message=str(error),
+        )
+        with self._lock:
+            self._index.setdefault(key, []).append(interaction.to_dict())
+            self.n_request += 1
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str] | None = None,
+    ) -> Response:
+        key = get_request_key(method, url, headers)
+        start = time.perf_counter()
+        try:
+            res = await self.transport.request(method, url, headers=headers)
+        except Exception as e:
+            self._record_error(key, e, time.perf_counter() - start)
+            raise
+        self._record(key, res, time.perf_counter() - start)
+        return res
+
+    async def close(self):
+        try:
+            await self.transport.close()
+        finally:
+            with self._lock:
+                if self._zip.fp is not None:
+                    self._zip.writestr(INDEX, json.dumps(self._index))
+                    self._zip.close()
+
+
+class ReplayTransport:
+    """
+    Serve responses from a cassette, no network.
+
+    :param latency: ``"recorded"`` to sleep the recorded latency of each
+        response, or a fixed number of seconds.
+    :param jitter: relative jitter, each sleep is multiplied by
+        ``1 + uniform(-jitter, jitter)``.
+    :param seed: seed of the jitter, for reproducible runs.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        latency: T.Union[float, str] = "recorded",
+        jitter: float = 0.0,
+        seed: int = 0,
+    ):
+        if not (latency == "recorded" or isinstance(latency, (int, float))):
+            raise ValueError(f"latency has to be 'recorded' or seconds: {latency!r}")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter has to be in [0, 1]")
+        self.path = Path(path)
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self._zip = zipfile.ZipFile(self.path)
+        self._index: dict[str, list[Interaction]] = {
+            key: [Interaction(**d) for d in interactions]
+            for key, interactions in json.loads(self._zip.read(INDEX)).items()
+        }
+        self._n_served: dict[str, int] = dict()
+        self._lock = threading.Lock()
+        self.n_request = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_urls(self, method: str = "GET") -> list[str]:
+        """
+        The distinct urls recorded for ``method``, in recording order.
+        """
+        prefix = f"{method.upper()} "
+        urls = dict()
+        for key in self._index:
+            if key.startswith(prefix):
+                urls[key[len(prefix) :].split("\n", 1)[0]] = None
+        return list(urls)
+
+    def _next(self, key: str) -> tuple[Interaction, bytes, float]:
+        with self._lock:
+            interactions = self._index.get(key)
+            if interactions is None:
+                raise CassetteMissError(key)
+            i = self._n_served.get(key, 0)
+            self._n_served[key] = i + 1
+            interaction = interactions[min(i, len(interactions) - 1)]
+            if interaction.error_type is None:
+                body = self._zip.read(interaction.body)
+            else:
+                body = b""
+            if self.latency == "recorded":
+                delay = interaction.latency
+            else:
+                delay = float(self.latency)
+            if self.jitter:
+                rng = random.Random(f"{self.seed}\n{key}\n{i}")
+                delay *= 1 + rng.uniform(-self.jitter, self.jitter)
+            self.n_request += 1
+        return interaction, body, delay
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str] | None = None,
+    ) -> Response:
+        interaction, body, delay = self._next(get_request_key(method, url, headers))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if interaction.error_type is not None:
+            raise interaction.to_exception()
+        return Response(
+            status=interaction.status,
+            headers=dict(interaction.headers),
+            body=body,
+        )
+
+    def rewind(self):
+        """
+        Start serving every key from its first recorded response again.
+        """
+        with self._lock:
+            self._n_served.clear()
+
+    async def close(self):
+        with self._lock:
+            self._zip.close()
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+"""
+Crash safe micro-batch checkpoints.
+
+A work unit, e.g. one HTML database of one lang code, is processed as a
+sequence of micro-batches over its items. After a micro-batch is done, a
+commit marker for its item range ``[start, end)`` is written:
+
+1. locally, atomically: write a temp file, ``fsync``, ``os.replace``,
+   ``fsync`` the directory, so a marker is either complete or absent;
+2. mirrored to S3, so a fresh CI runner without the local disk still knows
+   what was done.
+
+Markers are idempotent: committing a range that is already committed is a
+no-op. They record item ranges, not batch numbers, so a restart may use a
+different micro-batch size. :meth:`CheckpointStore.get_resume_offset` is the
+end of the contiguous committed prefix, :func:`run_micro_batches` starts
+there and also skips any committed range after it.
+
+Layout, locally and under the S3 prefix::
+
+    ${unit_id}/batch-0000000000-0000000100.json
+    ${unit_id}/batch-0000000100-0000000200.json
+    ${unit_id}/done.json
+
+.. code-block:: python
+
+    store = CheckpointStore(
+        dir_checkpoint,
+        s3_client=registry.s3,
+        s3uri="s3://bucket/checkpoints/",
+    )
+    run_micro_batches(
+        store,
+        unit_id=f"{lang_code}/{html_db_id}",
+        items=video_ids,
+        micro_batch_size=100,
+        process_func=crawl_video_details,
+    )
+"""
+
+import typing as T
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import dataclasses
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DONE = "done.json"
+
+
+def split_s3_uri(s3uri: str) -> tuple[str, str]:
+    """
+    ``"s3://bucket/a/b/"`` -> ``("bucket", "a/b/")``.
+    """
+    if not s3uri.startswith("s3://"):
+        raise ValueError(f"not a s3 uri: {s3uri!r}")
+    bucket, _, key = s3uri[5:].partition("/")
+    return bucket, key
+
+
+def get_marker_name(start: int, end: int) -> str:
+    return f"batch-{start:010d}-{end:010d}.json"
+
+
+def parse_marker_name(name: str) -> tuple[int, int] | None:
+    if not (name.startswith("batch-") and name.endswith(".json")):
+        return None
+    start, _, end = name[len("batch-") : -len(".json")].partition("-")
+    return int(start), int(end)
+
+
+def merge_ranges(ranges: T.Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Merge overlapping or adjacent ranges.
+    """
+    merged: list[list[int]] = list()
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def get_ranges(names: T.Iterable[str]) -> list[tuple[int, int]]:
+    """
+    Merged item ranges of the given marker names.
+    """
+    return merge_ranges(
+        parsed for parsed in map(parse_marker_name, names) if parsed is not None
+    )
+
+
+def get_prefix_end(ranges: list[tuple[int, int]]) -> int:
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1]
+    return 0
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Write a file so that it's either complete or absent, even on power loss.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path_tmp = path.with_name(
+        f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    with path_tmp.open("wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path_tmp, path)
+    fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@dataclasses.dataclass
+class CommitMarker:
+    unit_id: str
+    start: int
+    end: int
+    n_item: int
+    committed_at: float
+    metadata: dict[str, T.Any] = dataclasses.field(default_factory=dict)
+
+    def to_json(self) -> bytes:
+        return json.dumps(dataclasses.asdict(self), sort_keys=True).encode("utf-8")
+
+
+class CheckpointStore:
+    """
+    :param dir_checkpoint: local directory of the markers.
+    :param s3_client: boto3 s3 client for the mirror, ``None`` to keep the
+        markers local only.
+    :param s3uri: the S3 prefix of the mirror, e.g. ``s3://bucket/checkpoints/``.
+    """
+
+    def __init__(
+        self,
+        dir_checkpoint: Path,
+        s3_client=None,
+        s3uri: str | None = None,
+    ):
+        self.dir_checkpoint = Path(dir_checkpoint)
+        self.s3_client = s3_client
+        if (s3_client is None) != (s3uri is None):
+            raise ValueError("s3_client and s3uri must be given together")
+        if s3uri is not None:
+            self.bucket, prefix = split_s3_uri(s3uri)
+            if prefix and not prefix.endswith("/"):
+                prefix += "/"
+            self.prefix = prefix
+        self.n_s3_put = 0
+
+    def _get_local_dir(self, unit_id: str) -> Path:
+        return self.dir_checkpoint / unit_id
+
+    def _get_s3_key(self, unit_id: str, name: str) -> str:
+        return f"{self.prefix}{unit_id}/{name}"
+
+    def _put_s3(self, unit_id: str, name: str, data: bytes):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._get_s3_key(unit_id, name),
+            Body=data,
+            ContentType="application/json",
+        )
+        self.n_s3_put += 1
+
+    def _exists_s3(self, unit_id: str, name: str) -> bool:
+        key = self._get_s3_key(unit_id, name)
+        res = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=key)
+        return any(obj["Key"] == key for obj in res.get("Contents", []))
+
+    def _list_s3(self, unit_id: str) -> list[str]:
+        names = list()
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        prefix = self._get_s3_key(unit_id, "")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                names.append(obj["Key"][len(prefix) :])
+        return names
+
+    def list_markers(self, unit_id: str) -> set[str]:
+        """
+        Names of the markers of a unit, local and mirrored. Markers found
+        only in S3 are restored locally, markers found only locally, e.g.
+        when the upload of a commit failed, are uploaded.
+        """
+        dir_unit = self._get_local_dir(unit_id)
+        local = {
+            path.name
+            for path in dir_unit.glob("*.json")
+            if not path.name.startswith(".")
+        }
+        if self.s3_client is None:
+            return local
+        remote = set(self._list_s3(unit_id))
+        for name in remote - local:
+            data = self.s3_client.get_object(
+                Bucket=self.bucket,
+                Key=self._get_s3_key(unit_id, name),
+            )["Body"].read()
+            write_atomic(dir_unit / name, data)
+        for name in local - remote:
+            self._put_s3(unit_id, name, (dir_unit / name).read_bytes())
+        return local | remote
+
+    def get_committed_ranges(self, unit_id: str) -> list[tuple[int, int]]:
+        """
+        Merged ``[start, end)`` item ranges already committed.
+        """
+        return get_ranges(self.list_markers(unit_id))
+
+    def get_resume_offset(self, unit_id: str) -> int:
+        """
+        End of the contiguous committed prefix, the first item to process.
+        """
+        return get_prefix_end(self.get_committed_ranges(unit_id))
+
+    def commit(
+        self,
+        unit_id: str,
+        start: int,
+        end: int,
+        metadata: dict[str, T.Any] | None = None,
+    ) -> bool:
+        """
+        Mark the items ``[start, end)`` of the unit as done.
+
+        :return: ``False`` if the range was already committed. The marker is
+            still uploaded if it is missing in S3, a retry after a failed
+            upload completes the commit.
+        """
+        name = get_marker_name(start, end)
+        path = self._get_local_dir(unit_id) / name
+        if path.exists():
+            if self.s3_client is not None and not self._exists_s3(unit_id, name):
+                self._put_s3(unit_id, name, path.read_bytes())
+            return False
+        marker = CommitMarker(
+            unit_id=unit_id,
+            start=start,
+            end=end,
+            n_item=end - start,
+            committed_at=time.time(),
+            metadata=metadata or dict(),
+        )
+        data = marker.to_json()
+        write_atomic(path, data)
+        if self.s3_client is not None:
+            self._put_s3(unit_id, name, data)
+        return True
+
+    def mark_done(self, unit_id: str, n_item: int):
+        data = json.dumps(
+            {"unit_id": unit_id, "n_item": n_item, "done_at": time.time()}
+        ).encode("utf-8")
+        write_atomic(self._get_local_dir(unit_id) / DONE, data)
+        if self.s3_client is not None:
+            self._put_s3(unit_id, DONE, data)
+
+    def is_done(self, unit_id: str) -> bool:
+        return DONE in self.list_markers(unit_id)
+
+    def get_done_n_item(self, unit_id: str) -> int | None:
+        """
+        Number of items of a unit marked done, ``None`` if it isn't done.
+        Call :meth:`list_markers` first to restore a marker found only in S3.
+        """
+        path = self._get_local_dir(unit_id) / DONE
+        if not path.exists():
+            return None
+        return json.loads(path.read_bytes())["n_item"]
+
+
+@dataclasses.dataclass
+class MicroBatchResult:
+    n_batch: int = 0
+    n_skipped_batch: int = 0
+    n_item: int = 0
+    resume_offset: int = 0
+
+
+def run_micro_batches(
+    store: CheckpointStore,
+    unit_id: str,
+    items: T.Iterable[T.Any],
+    micro_batch_size: int,
+    process_func: T.Callable[[T.Sequence[T.Any]], T.Any],
+) -> MicroBatchResult:
+    """
+    Process ``items`` in micro-batches, committing each one, and resuming
+    after the last committed one. ``items`` must be in the same order on
+    every run.
+
+    ``items`` may be a lazy iterator, e.g. a streamed HTML database, it is
+    consumed one micro-batch at a time, the committed prefix is read past
+    without being processed.
+
+    :param process_func: processes one micro-batch, must be safe to call
+        again on a batch that failed halfway.
+    """
+    result = MicroBatchResult()
+    names = store.list_markers(unit_id)
+    if DONE in names:
+        if isinstance(items, T.Sized):
+            result.resume_offset = len(items)
+        else:
+            result.resume_offset = store.get_done_n_item(unit_id) or 0
+        return result
+    committed = get_ranges(names)
+    result.resume_offset = get_prefix_end(committed)
+    if result.resume_offset:
+        logger.info(f"resume {unit_id} at item {result.resume_offset}")
+
+    def is_committed(start: int, end: int) -> bool:
+        return any(s <= start and end <= e for s, e in committed)
+
+    if isinstance(items, T.Sequence):
+        batches = (
+            items[i : i + micro_batch_size]
+            for i in range(result.resume_offset, len(items), micro_batch_size)
+        )
+    else:
+        iterator = iter(items)
+        # read past the committed prefix
+        for _ in itertools.islice(iterator, result.resume_offset):
+            pass
+        batches = iter(
+            lambda: list(itertools.islice(iterator, micro_batch_size)), []
+        )
+
+    start = result.resume_offset
+    for batch in batches:
+        end = start + len(batch)
+        if is_committed(start, end):
+            result.n_skipped_batch += 1
+        else:
+            process_func(batch)
+            store.commit(unit_id, start, end)
+            result.n_batch += 1
+            result.n_item += end - start
+        start = end
+    store.mark_done(unit_id, start)
+    return result
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command line entry point. Usage::
+
+    sakura_gather --lang-code cn --concurrency 4
+    sakura_gather --lang-code cn --lang-code en --lang-weight cn=2 --concurrency 8
+    sakura_gather --lang-code cn --trace-path trace.jsonl --trace-sample-rate 0.1
+    sakura_gather --lang-code cn --node-id-table sakura_status_tracking --n-node 64
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from .daemon import DaemonConfig, CrawlDaemon
+from .tracing import (
+    configure_tracing,
+    get_tracer,
+    load_spans,
+    summarize,
+    format_summary,
+)
+
+
+def parse_lang_weight(value: str) -> tuple[str, float]:
+    lang_code, _, weight = value.partition("=")
+    try:
+        return lang_code, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expect lang_code=weight, got {value!r}")
+
+
+def main(args: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="sakura_gather",
+        description="Crawl video details continuously in a long-running process.",
+    )
+    parser.add_argument("--lang-code", action="append", dest="lang_code_list")
+    parser.add_argument(
+        "--lang-weight",
+        action="append",
+        type=parse_lang_weight,
+        dest="lang_weight_list",
+        default=[],
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--cycle-interval", type=float, default=0.0)
+    parser.add_argument("--max-cycles", type=int, default=None)
+    parser.add_argument("--drain-timeout", type=float, default=300.0)
+    parser.add_argument("--reset-lock", action="store_true")
+    # hand out node ids from a sharded, block allocated counter in this table
+    # instead of the single RoundRobinManager counter
+    parser.add_argument("--node-id-table", default=None)
+    parser.add_argument("--n-node", type=int, default=None)
+    parser.add_argument("--node-id-block-size", type=int, default=16)
+    parser.add_argument("--trace-path", default=None)
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0)
+    parser.add_argument("--trace-format", choices=["jsonl", "otlp"], default="jsonl")
+    ns = parser.parse_args(args)
+    if ns.node_id_table is not None and ns.n_node is None:
+        parser.error("--node-id-table requires --n-node")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(threadName)s %(levelname)s %(message)s",
+    )
+
+    from sakura_site_msav.project.s04_2_crawl_website_mixin import RoundRobinManager
+    from .project import new_project, new_bsm_dev, DEFAULT_LANG_CODE_LIST
+    from .sessions import SessionRegistry
+
+    lang_code_list = ns.lang_code_list or list(DEFAULT_LANG_CODE_LIST)
+    project = new_project(lang_code_list=lang_code_list)
+    bsm_dev = new_bsm_dev()
+    with bsm_dev.awscli():
+        # clients and the caller identity are created once and shared by
+        # every work unit
+        registry = SessionRegistry.from_bsm(project.bsm)
+        print(registry.who_am_i(masked=True))
+
+    def crawl_func(lang_code: str, node_id: int) -> int | None:
+        n_item = project.crawl_all_video_details_in_one_html_database(
+            lang_code=lang_code,
+            node_id=node_id,
+            reset_lock=ns.reset_lock,
+        )
+        # only a number is an item count, anything else leaves the count
+        # unknown and the cycle summary without a throughput
+        return n_item if isinstance(n_item, int) else None
+
+    def next_node_id_func() -> int:
+        return RoundRobinManager.get_next_node_id(bsm=project.bsm)
+
+    if ns.node_id_table is not None:
+        from .node_id import NodeIdDispenser
+
+        next_node_id_func = NodeIdDispenser(
+            registry.dynamodb,
+            table_name=ns.node_id_table,
+            n_node=ns.n_node,
+            block_size=ns.node_id_block_size,
+        )
+
+    daemon = CrawlDaemon(
+        crawl_func=crawl_func,
+        next_node_id_func=next_node_id_func,
+        config=DaemonConfig(
+            lang_code_list=lang_code_list,
+            concurrency=ns.concurrency,
+            cycle_interval=ns.cycle_interval,
+            max_cycles=ns.max_cycles,
+            drain_timeout=ns.drain_timeout,
+            lang_weights=dict(ns.lang_weight_list) or None,
+        ),
+    )
+    daemon.install_signal_handlers()
+    configure_tracing(
+        path=ns.trace_path,
+        sample_rate=ns.trace_sample_rate,
+        format=ns.trace_format,
+    )
+    try:
+        daemon.run_forever()
+    finally:
+        get_tracer().close()
+        if (
+            ns.trace_path is not None
+            and ns.trace_format == "jsonl"
+            and Path(ns.trace_path).exists()
+        ):
+            print(format_summary(summarize(load_spans(ns.trace_path))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Trained-dictionary zstd codec for raw HTML pages.
+
+Detail pages of one site share one template, so most of a page is the same
+boilerplate. Generic compression of a single page can't exploit that, a zstd
+dictionary trained on a sample of pages can: the boilerplate becomes
+back-references into the dictionary.
+
+Dictionaries are trained per lang code and versioned next to the snapshot::
+
+    ${dir_snapshot}/zstd-dict/manifest.json     lang_code -> current dict id
+    ${dir_snapshot}/zstd-dict/1234567890.zdict  dictionary, named by its id
+
+Every compressed frame carries the id of its dictionary in the frame header,
+so a page is always decompressed with the dictionary it was compressed with,
+even after a newer one is trained.
+
+.. code-block:: python
+
+    codec = PageCodec(DictionaryStore(dir_snapshot))
+    codec.train("cn", sample_pages)
+    blob = codec.compress("cn", html)
+    assert codec.decompress(blob) == html
+    with open(path, "rb") as fin, open(path_out, "wb") as fout:
+        codec.decompress_stream(fin, fout)
+
+Requires ``zstandard``, install it with ``pip install sakura_gather[compress]``.
+"""
+
+import typing as T
+import io
+import json
+import threading
+from pathlib import Path
+
+import zstandard
+
+DEFAULT_DICT_SIZE = 112_640  # the zstd CLI default, 110 KB
+DEFAULT_LEVEL = 9
+DIR_NAME = "zstd-dict"
+FRAME_HEADER_MAX_SIZE = 18  # ZSTD_FRAMEHEADERSIZE_MAX
+
+
+def train_dictionary(
+    samples: T.Iterable[bytes],
+    dict_size: int = DEFAULT_DICT_SIZE,
+    level: int = DEFAULT_LEVEL,
+) -> zstandard.ZstdCompressionDict:
+    """
+    Train a dictionary on sample pages, a few hundred to a few thousand
+    pages is enough.
+    """
+    return zstandard.train_dictionary(dict_size, list(samples), level=level)
+
+
+class DictionaryStore:
+    """
+    The versioned dictionaries of a snapshot.
+    """
+
+    def __init__(self, dir_snapshot: Path):
+        self.dir_dict = Path(dir_snapshot) / DIR_NAME
+        self.path_manifest = self.dir_dict / "manifest.json"
+        self._lock = threading.Lock()
+
+    def _get_path(self, dict_id: int) -> Path:
+        return self.dir_dict / f"{dict_id}.zdict"
+
+    def load_manifest(self) -> dict[str, T.Any]:
+        """
+        ``{"current": {lang_code: dict_id}, "history": {lang_code: [dict_id]}}``
+        """
+        if self.path_manifest.exists():
+            return json.loads(self.path_manifest.read_text(encoding="utf-8"))
+        return {"current": {}, "history": {}}
+
+    def save(self, lang_code: str, dictionary: zstandard.ZstdCompressionDict) -> int:
+        """
+        Store a dictionary and make it the current one of the lang code.
+
+        :return: the dictionary id.
+        """
+        dict_id = dictionary.dict_id()
+        with self._lock:
+            self.dir_dict.mkdir(parents=True, exist_ok=True)
+            self._get_path(dict_id).write_bytes(dictionary.as_bytes())
+            manifest = self.load_manifest()
+            manifest["current"][lang_code] = dict_id
+            history = manifest["history"].setdefault(lang_code, [])
+            if dict_id not in history:
+                history.append(dict_id)
+            path_tmp = self.path_manifest.with_suffix(".json.tmp")
+            path_tmp.write_text(json.dumps(manifest, indent=4), encoding="utf-8")
+            path_tmp.replace(self.path_manifest)
+        return dict_id
+
+    def get_current_id(self, lang_code: str) -> int | None:
+        return self.load_manifest()["current"].get(lang_code)
+
+    def load(self, dict_id: int) -> zstandard.ZstdCompressionDict:
+        return zstandard.ZstdCompressionDict(self._get_path(dict_id).read_bytes())
+
+
+class PageCodec:
+    """
+    Compress pages with the current dictionary of their lang code, and
+    decompress any page with the dictionary recorded in its frame.
+
+    Lang codes without a trained dictionary are compressed without one.
+    Compressor and decompressor objects are cached per thread, they are not
+    thread safe.
+
+    :param level: zstd compression level, decompression speed doesn't depend
+        on it.
+    """
+
+    def __init__(
+        self,
+        store: DictionaryStore,
+        level: int = DEFAULT_LEVEL,
+    ):
+        self.store = store
+        self.level = level
+        self._dicts: dict[int, zstandard.ZstdCompressionDict] = dict()
+        self._current: dict[str, int | None] = dict()
+        self._local = threading.local()
+
+    def train(
+        self,
+        lang_code: str,
+        samples: T.Iterable[bytes],
+        dict_size: int = DEFAULT_DICT_SIZE,
+    ) -> int:
+        """
+        Train, store and switch to a new dictionary for the lang code.
+
+        :return: the new dictionary id.
+        """
+        dictionary = train_dictionary(samples, dict_size=dict_size, level=self.level)
+        dict_id = self.store.save(lang_code, dictionary)
+        self._dicts[dict_id] = dictionary
+        self._current[lang_code] = dict_id
+        return dict_id
+
+    def _get_dict(self, dict_id: int) -> zstandard.ZstdCompressionDict:
+        dictionary = self._dicts.get(dict_id)
+        if dictionary is None:
+            dictionary = self.store.load(dict_id)
+            # precompute the tables once instead of on every frame
+            dictionary.precompute_compress(level=self.level)
+            self._dicts[dict_id] = dictionary
+        return dictionary
+
+    def _get_current_id(self, lang_code: str) -> int | None:
+        if lang_code not in self._current:
+            self._current[lang_code] = self.store.get_current_id(lang_code)
+        return self._current[lang_code]
+
+    def get_compressor(self, lang_code: str) -> zstandard.ZstdCompressor:
+        compressors = self._local.__dict__.setdefault("compressors", dict())
+        dict_id = self._get_current_id(lang_code)
+        compressor = compressors.get(dict_id)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(
+                level=self.level,
+                dict_data=None if dict_id is None else self._get_dict(dict_id),
+                write_content_size=True,
+                write_dict_id=True,
+            )
+            compressors[dict_id] = compressor
+        return compressor
+
+    def get_decompressor(self, dict_id: int) -> zstandard.ZstdDecompressor:
+        decompressors = self._local.__dict__.setdefault("decompressors", dict())
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=self._get_dict(dict_id) if dict_id else None,
+            )
+            decompressors[dict_id] = decompressor
+        return decompressor
+
+    def compress(self, lang_code: str, data: bytes) -> bytes:
+        return self.get_compressor(lang_code).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        return self.get_decompressor(dict_id).decompress(data)
+
+    def compress_stream(
+        self,
+        lang_code: str,
+        fin: T.BinaryIO,
+        fout: T.BinaryIO,
+    ) -> tuple[int, int]:
+        """
+        :return: number of bytes read and written.
+        """
+        return self.get_compressor(lang_code).copy_stream(fin, fout)
+
+    def open_reader(self, fin: T.BinaryIO) -> T.BinaryIO:
+        """
+        A file object that decompresses ``fin`` while it's read, the
+        dictionary is picked from the first frame header.
+        """
+        header = fin.read(FRAME_HEADER_MAX_SIZE)
+        dict_id = zstandard.get_frame_parameters(header).dict_id
+        return self.get_decompressor(dict_id).stream_reader(
+            _Chain(header, fin), read_across_frames=True
+        )
+
+    def decompress_stream(self, fin: T.BinaryIO, fout: T.BinaryIO) -> int:
+        """
+        :return: number of decompressed bytes written.
+        """
+        n_byte = 0
+        with self.open_reader(fin) as reader:
+            while True:
+                chunk = reader.read(1024 * 1024)
+                if not chunk:
+                    break
+                fout.write(chunk)
+                n_byte += len(chunk)
+        return n_byte
+
+
+class _Chain(io.RawIOBase):
+    """
+    Read ``head`` first, then the rest of ``fin``.
+    """
+
+    def __init__(self, head: bytes, fin: T.BinaryIO):
+        self._head = memoryview(head)
+        self._fin = fin
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._head:
+            n = min(len(buffer), len(self._head))
+            buffer[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._fin.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
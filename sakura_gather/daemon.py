@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+"""
+Long-running crawl daemon.
+
+The hourly one-shot ``run.py`` pays interpreter startup, dependency import,
+credential setup and lock acquisition on every invocation. The
+:class:`CrawlDaemon` keeps a single process (and therefore the ``Project``,
+the boto sessions and the HTTP connections) alive and loops over
+``(lang_code, node_id)`` work units continuously.
+
+All lang codes of ``lang_code_list`` are crawled in one process by one
+shared worker pool, so they share the HTTP pools, the caches and the
+DynamoDB batching. A :class:`~sakura_gather.fair_share.FairShareScheduler`
+interleaves their work units fairly, by measured worker time and optional
+weights, instead of running the languages one after another.
+
+Example:
+
+.. code-block:: python
+
+    daemon = CrawlDaemon(
+        crawl_func=lambda lang_code, node_id: project.crawl_all_video_details_in_one_html_database(
+            lang_code=lang_code,
+            node_id=node_id,
+        ),
+        next_node_id_func=lambda: RoundRobinManager.get_next_node_id(bsm=project.bsm),
+        config=DaemonConfig(lang_code_list=["cn"], concurrency=4),
+    )
+    daemon.install_signal_handlers()
+    daemon.run_forever()
+"""
+
+import typing as T
+import time
+import signal
+import logging
+import threading
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from .tracing import span
+from .fair_share import FairShareScheduler
+
+logger = logging.getLogger(__name__)
+
+CrawlFunc = T.Callable[[str, int], T.Optional[int]]
+"""
+``crawl_func(lang_code, node_id) -> n_item``. The return value is the number
+of items processed, ``None`` means unknown, the cycle summary then reports no
+throughput.
+"""
+
+NextNodeIdFunc = T.Callable[[], int]
+
+
+@dataclasses.dataclass
+class DaemonConfig:
+    """
+    :param lang_code_list: the lang codes to crawl in every cycle.
+    :param concurrency: number of work units running at the same time. A
+        cycle runs ``concurrency`` work units per lang code in total, split
+        between the lang codes by ``lang_weights``.
+    :param cycle_interval: minimal seconds between the start of two cycles.
+    :param max_cycles: stop after this many cycles, ``None`` means forever.
+    :param drain_timeout: seconds to wait for in-flight work units on stop.
+    :param lang_weights: relative share of worker time of each lang code, 1
+        if not given.
+    """
+
+    lang_code_list: list[str]
+    concurrency: int = 1
+    cycle_interval: float = 0.0
+    max_cycles: int | None = None
+    drain_timeout: float = 300.0
+    lang_weights: dict[str, float] | None = None
+
+    def __post_init__(self):
+        if not self.lang_code_list:
+            raise ValueError("lang_code_list cannot be empty")
+        if self.concurrency < 1:
+            raise ValueError("concurrency has to be at least 1")
+
+
+@dataclasses.dataclass
+class CycleSummary:
+    """
+    Throughput summary of one daemon cycle.
+
+    :param n_item: items reported by the succeeded work units.
+    :param n_unknown: succeeded work units that didn't report their number
+        of items, ``n_item`` is then a lower bound.
+    """
+
+    cycle: int
+    n_succeeded: int = 0
+    n_failed: int = 0
+    n_item: int = 0
+    n_unknown: int = 0
+    start_time: float = 0.0
+    end_time: float = 0.0
+    n_item_by_lang: dict[str, int] = dataclasses.field(default_factory=dict)
+
+    @property
+    def elapsed(self) -> float:
+        return self.end_time - self.start_time
+
+    @property
+    def items_per_second(self) -> float | None:
+        """
+        ``None`` if a work unit didn't report its number of items.
+        """
+        if self.n_unknown:
+            return None
+        if self.elapsed <= 0:
+            return 0.0
+        return self.n_item / self.elapsed
+
+    def to_message(self) -> str:
+        if self.n_unknown:
+            items = (
+                f"{self.n_item} items reported in {self.elapsed:.2f}s, "
+                f"{self.n_unknown} work units without an item count"
+            )
+        else:
+            items = (
+                f"{self.n_item} items in {self.elapsed:.2f}s "
+                f"({self.items_per_second:.2f} items/s)"
+            )
+        return (
+            f"cycle {self.cycle}: "
+            f"{self.n_succeeded} succeeded, {self.n_failed} failed, {items}"
+            + "".join(
+                f", {lang_code} = {n_item}"
+                for lang_code, n_item in self.n_item_by_lang.items()
+            )
+        )
+
+
+class CrawlDaemon:
+    """
+    Run ``crawl_func`` for every lang code, ``concurrency`` node ids at a time,
+    cycle after cycle until :meth:`request_stop` is called.
+
+    The worker thread pool lives as long as the daemon, so anything captured
+    by ``crawl_func`` (project, boto clients, HTTP pools) stays warm between
+    cycles.
+    """
+
+    def __init__(
+        self,
+        crawl_func: CrawlFunc,
+        next_node_id_func: NextNodeIdFunc,
+        config: DaemonConfig,
+    ):
+        self.crawl_func = crawl_func
+        self.next_node_id_func = next_node_id_func
+        self.config = config
+        self._stop_event = threading.Event()
+        self._executor: ThreadPoolExecutor | None = None
+        self._poll_interval = 1.0
+        # lives as long as the daemon, so fairness carries over cycles
+        self.fair_share = FairShareScheduler(
+            config.lang_code_list,
+            weights=config.lang_weights,
+        )
+
+    @property
+    def is_stopping(self) -> bool:
+        return self._stop_event.is_set()
+
+    def request_stop(self, *args):
+        """
+        Ask the daemon to stop. No new work unit is scheduled after this call,
+        in-flight work units are allowed to finish. Can be used as a signal
+        handler.
+        """
+        if not self._stop_event.is_set():
+            logger.info("stop requested, draining in-flight work ...")
+        self._stop_event.set()
+
+    def install_signal_handlers(self):
+        """
+        Drain gracefully on ``SIGTERM`` and ``SIGINT``. Must be called from
+        the main thread.
+        """
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+    def _run_one(self, lang_code: str) -> tuple[int | None, float]:
+        """
+        :return: the number of processed items, ``None`` if unknown, and the
+            elapsed seconds.
+        """
+        start = time.perf_counter()
+        n_item = self._crawl_one(lang_code)
+        return n_item, time.perf_counter() - start
+
+    def _crawl_one(self, lang_code: str) -> int | None:
+        with span("work_unit", lang_code=lang_code):
+            with span("node_selection"):
+                node_id = self.next_node_id_func()
+            logger.info(f"crawl lang_code = {lang_code!r}, node_id = {node_id}")
+            with span("crawl", node_id=str(node_id)):
+                return self.crawl_func(lang_code, node_id)
+
+    def run_cycle(self, cycle: int) -> CycleSummary:
+        """
+        Run ``concurrency`` work units per lang code and wait for all of them
+        to finish. A free worker goes to the lang code with the smallest
+        weighted share of worker time, so a lang code with twice the weight
+        gets about twice the worker time of the cycle.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.config.concurrency,
+                thread_name_prefix="crawl",
+            )
+        summary = CycleSummary(
+            cycle=cycle,
+            start_time=time.time(),
+            n_item_by_lang={lang_code: 0 for lang_code in self.config.lang_code_list},
+        )
+        n_remaining = self.config.concurrency * len(self.config.lang_code_list)
+        inflight: dict[Future, str] = dict()
+        drain_deadline: float | None = None
+        while True:
+            while (
+                not self.is_stopping
+                and n_remaining > 0
+                and len(inflight) < self.config.concurrency
+            ):
+                lang_code = self.fair_share.acquire()
+                n_remaining -= 1
+                inflight[self._executor.submit(self._run_one, lang_code)] = lang_code
+            if not inflight:
+                break
+            done, _ = wait(
+                list(inflight),
+                timeout=self._poll_interval,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                lang_code = inflight.pop(future)
+                try:
+                    n_item, elapsed = future.result()
+                    self.fair_share.release(lang_code, elapsed)
+                    if n_item is None:
+                        summary.n_unknown += 1
+                    else:
+                        summary.n_item += n_item
+                        summary.n_item_by_lang[lang_code] += n_item
+                    summary.n_succeeded += 1
+                except Exception as e:
+                    # the failure cost is unknown, charge the expected cost
+                    self.fair_share.release(
+                        lang_code, self.fair_share.expected_cost[lang_code]
+                    )
+                    logger.exception(f"work unit failed: {e!r}")
+                    summary.n_failed += 1
+            if self.is_stopping:
+                if drain_deadline is None:
+                    drain_deadline = time.time() + self.config.drain_timeout
+                elif time.time() >= drain_deadline:
+                    logger.warning(
+                        f"drain timeout, {len(inflight)} work units still running"
+                    )
+                    break
+        summary.n_failed += len(inflight)
+        summary.end_time = time.time()
+        logger.info(summary.to_message())
+        return summary
+
+    def run_forever(self) -> list[CycleSummary]:
+        """
+        Run cycles until stop is requested or ``max_cycles`` is reached.
+
+        :return: the summary of every completed cycle.
+        """
+        summaries = list()
+        cycle = 0
+        try:
+            while not self.is_stopping:
+                if (
+                    self.config.max_cycles is not None
+                    and cycle >= self.config.max_cycles
+                ):
+                    break
+                cycle += 1
+                summary = self.run_cycle(cycle)
+                summaries.append(summary)
+                wait_seconds = self.config.cycle_interval - summary.elapsed
+                if wait_seconds > 0:
+                    self._stop_event.wait(wait_seconds)
+        finally:
+            if self._executor is not None:
+                # after a drain timeout, don't block on the stragglers
+                self._executor.shutdown(
+                    wait=not self.is_stopping,
+                    cancel_futures=True,
+                )
+                self._executor = None
+        return summaries
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cluster wide rate limit, shared by all crawl nodes.
+
+A :class:`~sakura_gather.rate_limit.TokenBucket` limits one process, so the
+load on the target site grows with the number of nodes.
+:class:`DistributedTokenBucket` limits all of them together with one token
+bucket in the status tracking table: ``rate`` tokens are added per second, up
+to ``capacity`` tokens can be saved for bursts.
+
+The bucket is one item, ``rate-limit#{name}``, with the attributes
+``tokens``, ``last_refill`` and ``version``. A node refills and takes in one
+conditional write:
+
+.. code-block:: text
+
+    read   tokens, last_refill, version
+    level  = min(capacity, tokens + (now - last_refill) * rate)
+    take   k = min(n, floor(level))
+    SET tokens = level - k, last_refill = now, version = version + 1
+        IF version = :version
+
+If another node wrote the bucket in between, the condition fails and the node
+reads again, so no grant is ever computed from a stale level.
+
+A node doesn't go to DynamoDB for every request, it pre-fetches a batch of
+``prefetch`` tokens. Pre-fetched tokens are only valid for ``hold`` seconds
+after the grant, they are dropped unused after that, so a node can't save
+tokens and spend them later on top of the bucket. In any span of ``t``
+seconds the whole cluster sends at most
+
+.. code-block:: text
+
+    capacity + rate * (t + hold)
+
+requests, at any moment, not only within aligned windows. Adding nodes raises
+the aggregate throughput until ``rate`` is reached, then the rate holds.
+
+The refill is computed from the wall clock of the node that writes, keep the
+clocks in sync (NTP). A node whose clock is behind ``last_refill`` adds no
+tokens and doesn't move ``last_refill`` back, so a skew can delay grants but
+never add tokens. Bucket items carry an ``expire_at`` attribute for DynamoDB
+TTL, an idle bucket expires and starts full again.
+
+.. code-block:: python
+
+    limiter = DistributedTokenBucket(
+        DynamoDBBucketStore(registry.dynamodb, table_name="sakura_status_tracking"),
+        name="target-site",
+        rate=50,  # requests per second, for the whole cluster
+    )
+    fetcher = AsyncFetcher(rate_limiter=limiter, rate_per_host=10)
+"""
+
+import typing as T
+import math
+import time
+import asyncio
+import threading
+import collections
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_dynamodb.client import DynamoDBClient
+
+
+def refill(
+    tokens: float,
+    last_refill: float,
+    now: float,
+    rate: float,
+    capacity: float,
+) -> tuple[float, float]:
+    """
+    :return: the level of the bucket at ``now`` and the new ``last_refill``,
+        which never goes back in time.
+    """
+    if now <= last_refill:
+        return tokens, last_refill
+    return min(capacity, tokens + (now - last_refill) * rate), now
+
+
+class BucketStore(T.Protocol):
+    """
+    Where the shared buckets live.
+    """
+
+    def take(
+        self,
+        key: str,
+        n: int,
+        rate: float,
+        capacity: float,
+        now: float,
+    ) -> tuple[int, float]:
+        """
+        Refill the bucket ``key`` up to ``now`` and take up to ``n`` whole
+        tokens of it. A bucket that doesn't exist yet is full.
+
+        :return: number of granted tokens, ``0`` if the bucket has less than
+            one token, and the level of the bucket after the take.
+        """
+        ...
+
+
+class InMemoryBucketStore:
+    """
+    :class:`BucketStore` for tests and for several limiters in one process.
+    """
+
+    def __init__(self):
+        self.buckets: dict[str, tuple[float, float]] = dict()
+        self.n_request = 0
+        self._lock = threading.Lock()
+
+    def take(self, key, n, rate, capacity, now):
+        with self._lock:
+            self.n_request += 1
+            tokens, last_refill = self.buckets.get(key, (capacity, now))
+            level, last_refill = refill(tokens, last_refill, now, rate, capacity)
+            granted = max(0, min(n, math.floor(level)))
+            self.buckets[key] = (level - granted, last_refill)
+            return granted, level - granted
+
+
+class DynamoDBBucketStore:
+    """
+    :class:`BucketStore` backed by the status tracking table, one item per
+    bucket. A take is one consistent read and one conditional write, plus one
+    more of each per concurrent writer it lost against.
+
+    :param key_name: the table's hash key.
+    :param ttl: seconds an idle bucket item is kept, via ``expire_at``.
+    """
+
+    def __init__(
+        self,
+        client: "DynamoDBClient",
+        table_name: str,
+        key_name: str = "id",
+        ttl: int = 24 * 3600,
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.key_name = key_name
+        self.ttl = ttl
+        self.n_request = 0
+        self.n_conflict = 0
+
+    def _get(self, key: str) -> dict | None:
+        self.n_request += 1
+        res = self.client.get_item(
+            TableName=self.table_name,
+            Key={self.key_name: {"S": key}},
+            ConsistentRead=True,
+        )
+        return res.get("Item")
+
+    def _put(
+        self,
+        key: str,
+        tokens: float,
+        last_refill: float,
+        version: int,
+    ) -> bool:
+        self.n_request += 1
+        # round the level down, never add a fraction of a token, the time
+        # round-trips exactly
+        values = {
+            ":tokens": {"N": f"{math.floor(tokens * 1e6) / 1e6:.6f}"},
+            ":last_refill": {"N": repr(last_refill)},
+            ":expire": {"N": str(int(last_refill) + self.ttl)},
+            ":version": {"N": str(version + 1)},
+        }
+        # the version, not last_refill, tells if another node wrote in
+        # between, two nodes may write the same last_refill
+        if version == 0:
+            condition = "attribute_not_exists(version)"
+        else:
+            condition = "version = :old"
+            values[":old"] = {"N": str(version)}
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={self.key_name: {"S": key}},
+                UpdateExpression=(
+                    "SET tokens = :tokens, last_refill = :last_refill, "
+                    "version = :version, expire_at = :expire"
+                ),
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            self.n_conflict += 1
+            return False
+
+    def take(self, key, n, rate, capacity, now):
+        while True:
+            item = self._get(key)
+            if item is None or "version" not in item:
+                tokens, last_refill, version = capacity, now, 0
+            else:
+                tokens = float(item["tokens"]["N"])
+                last_refill = float(item["last_refill"]["N"])
+                version = int(item["version"]["N"])
+            level, last_refill = refill(tokens, last_refill, now, rate, capacity)
+            granted = max(0, min(n, math.floor(level)))
+            if granted == 0:
+                # nothing to take, nothing to write
+                return 0, level
+            if self._put(key, level - granted, last_refill, version):
+                return granted, level - granted
+
+
+class DistributedTokenBucket:
+    """
+    :param store: the shared :class:`BucketStore`.
+    :param name: the limited resource, e.g. the target site, limiters with
+        the same name share the bucket.
+    :param rate: tokens per second across all nodes.
+    :param capacity: max number of tokens the bucket saves for bursts,
+        defaults to a tenth of a second worth of tokens.
+    :param prefetch: tokens fetched per store request, more means fewer
+        store requests but more tokens dropped unused. Defaults to a quarter
+        of the capacity.
+    :param hold: seconds a pre-fetched token stays valid on the node, see
+        the module docs for the bound it gives.
+    :param clock: wall clock, shared by all nodes.
+    """
+
+    def __init__(
+        self,
+        store: BucketStore,
+        name: str,
+        rate: float,
+        capacity: int | None = None,
+        prefetch: int | None = None,
+        hold: float = 0.1,
+        clock: T.Callable[[], float] = time.time,
+    ):
+        if rate <= 0:
+            raise ValueError("rate has to be positive")
+        if hold <= 0:
+            raise ValueError("hold has to be positive")
+        self.capacity = max(1, int(rate * 0.1)) if capacity is None else capacity
+        if self.capacity < 1:
+            raise ValueError("capacity has to be at least 1 token")
+        self.store = store
+        self.name = name
+        self.rate = rate
+        self.prefetch = max(1, self.capacity // 4) if prefetch is None else prefetch
+        self.hold = hold
+        self.clock = clock
+        # [expire at, number of tokens] per grant, oldest first
+        self._batches: collections.deque[list] = collections.deque()
+        self._lock = threading.Lock()
+        self._wait = 0.0
+        self.n_granted = 0
+        self.n_dropped = 0
+
+    @property
+    def key(self) -> str:
+        return f"rate-limit#{self.name}"
+
+    def _n_local(self, now: float) -> int:
+        """
+        Drop the expired pre-fetched tokens, return the number left.
+        """
+        while self._batches and self._batches[0][0] <= now:
+            self.n_dropped += self._batches.popleft()[1]
+        return sum(count for _, count in self._batches)
+
+    def _take_local(self, n: int):
+        while n:
+            batch = self._batches[0]
+            k = min(n, batch[1])
+            batch[1] -= k
+            n -= k
+            if batch[1] == 0:
+                self._batches.popleft()
+
+    def try_acquire(self, n: int = 1) -> bool:
+        """
+        Take ``n`` tokens, from the local tokens or with one store request.
+        """
+        if n > self.capacity:
+            raise ValueError(
+                f"can't take {n} tokens, the capacity is {self.capacity}"
+            )
+        with self._lock:
+            n_local = self._n_local(self.clock())
+            if n_local >= n:
+                self._take_local(n)
+                return True
+            n_ask = max(n - n_local, self.prefetch)
+        # no lock during the store request, other threads and the event
+        # loop keep taking local tokens meanwhile
+        now = self.clock()
+        granted, level = self.store.take(
+            self.key, n_ask, self.rate, self.capacity, now=now
+        )
+        with self._lock:
+            self.n_granted += granted
+            if granted:
+                # valid from when the bucket gave them, not when they arrived
+                self._batches.append([now + self.hold, granted])
+            n_local = self._n_local(self.clock())
+            if n_local >= n:
+                self._take_local(n)
+                return True
+            # until the bucket has the missing tokens again
+            self._wait = max(0.0, (n - n_local - level) / self.rate)
+            return False
+
+    def get_wait(self) -> float:
+        """
+        Seconds until the bucket has refilled the tokens the last failed
+        :meth:`try_acquire` missed.
+        """
+        return max(self._wait, 0.001)
+
+    def acquire(self, n: int = 1):
+        """
+        Block the current thread until ``n`` tokens are granted.
+        """
+        while not self.try_acquire(n):
+            time.sleep(self.get_wait())
+
+    async def acquire_async(self, n: int = 1):
+        """
+        Coroutine version of :meth:`acquire`, store requests run in a worker
+        thread.
+        """
+        while True:
+            with self._lock:
+                if self._n_local(self.clock()) >= n:
+                    self._take_local(n)
+                    return
+            if await asyncio.to_thread(self.try_acquire, n):
+                return
+            await asyncio.sleep(self.get_wait())
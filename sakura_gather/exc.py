@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+"""
+Exceptions shared across modules.
+"""
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when a write guarded by a lease owner is rejected because the
+    lease is now held by someone else or has expired.
+    """
+
+    def __init__(self, keys: list):
+        self.keys = keys
+        super().__init__(f"lease lost on {len(keys)} items: {keys[:10]}")
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+Weighted fair share between lang codes.
+
+When several languages are crawled by one shared worker pool, a plain FIFO
+queue runs all work units of the first language before the second one gets
+a worker. :class:`FairShareScheduler` instead hands the next free worker to
+the key with the smallest weighted usage, where usage is the measured cost
+(e.g. seconds) of its finished work units plus the expected cost of its
+running ones. A language whose pages are slow therefore gets fewer turns, and
+a language with weight 2 gets twice the worker time of one with weight 1.
+
+.. code-block:: python
+
+    fair = FairShareScheduler(["cn", "en"], weights={"cn": 2})
+    lang_code = fair.acquire(candidates=["cn", "en"])
+    ...  # run the work unit
+    fair.release(lang_code, cost=elapsed)
+"""
+
+import typing as T
+import threading
+from collections import deque
+
+
+class FairShareScheduler:
+    """
+    :param keys: the keys to share between, ties are broken in this order.
+    :param weights: relative share of each key, 1 if not given.
+    :param smoothing: weight of the latest cost in the moving average used as
+        the expected cost of the next work unit.
+    """
+
+    def __init__(
+        self,
+        keys: T.Iterable[str],
+        weights: dict[str, float] | None = None,
+        smoothing: float = 0.3,
+    ):
+        self.keys = list(keys)
+        weights = weights or dict()
+        for key, weight in weights.items():
+            if key not in self.keys:
+                raise ValueError(f"unknown key {key!r}")
+            if weight <= 0:
+                raise ValueError(f"weight of {key!r} has to be positive")
+        self.weights = {key: float(weights.get(key, 1.0)) for key in self.keys}
+        self.smoothing = smoothing
+        self.usage = {key: 0.0 for key in self.keys}
+        self.expected_cost = {key: 1.0 for key in self.keys}
+        self.n_acquire = {key: 0 for key in self.keys}
+        self._charged: dict[str, deque] = {key: deque() for key in self.keys}
+        self._last = -1
+        self._lock = threading.Lock()
+
+    def get_share(self, key: str) -> float:
+        return self.usage[key] / self.weights[key]
+
+    def acquire(self, candidates: T.Iterable[str] | None = None) -> str:
+        """
+        Pick the candidate with the smallest weighted usage and charge it the
+        expected cost of one work unit.
+        """
+        with self._lock:
+            candidates = set(self.keys if candidates is None else candidates)
+            if not candidates:
+                raise ValueError("no candidate")
+            n = len(self.keys)
+            # scan in round-robin order after the last pick, so ties rotate
+            order = [self.keys[(self._last + 1 + i) % n] for i in range(n)]
+            key = min(
+                (k for k in order if k in candidates),
+                key=self.get_share,
+            )
+            self._last = self.keys.index(key)
+            charge = self.expected_cost[key]
+            self.usage[key] += charge
+            self._charged[key].append(charge)
+            self.n_acquire[key] += 1
+            return key
+
+    def release(self, key: str, cost: float):
+        """
+        Replace the expected cost charged by :meth:`acquire` with the
+        measured one.
+        """
+        with self._lock:
+            charged = self._charged[key].popleft() if self._charged[key] else 0.0
+            self.usage[key] += cost - charged
+            self.expected_cost[key] = (
+                1 - self.smoothing
+            ) * self.expected_cost[key] + self.smoothing * cost
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio based HTTP fetch engine for video detail pages.
+
+The synchronous micro-batch crawl leaves the worker idle while it waits on
+the network. :class:`AsyncFetcher` keeps many requests in flight over a
+shared keep-alive connection pool, while staying polite to the target site:
+
+- a global and a per-host concurrency limit,
+- a per-host :class:`~sakura_gather.rate_limit.TokenBucket`,
+- retry with exponential backoff and full jitter, ``Retry-After`` is honored.
+
+Use :func:`download_pages` as the page-download stage of the detail crawl:
+
+.. code-block:: python
+
+    results = download_pages(urls, rate_per_host=5)
+    for res in results:
+        if res.ok:
+            parse(res.body)
+
+The default transport is backed by ``aiohttp``, install it with
+``pip install sakura_gather[fetch]``.
+"""
+
+import typing as T
+import time
+import random
+import asyncio
+import dataclasses
+from urllib.parse import urlsplit
+
+from .rate_limit import TokenBucket
+from .tracing import span
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import aiohttp
+
+RETRY_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+
+
+@dataclasses.dataclass
+class Response:
+    """
+    The minimal response a :class:`Transport` returns.
+    """
+
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+
+class Transport(T.Protocol):
+    """
+    Anything that can send one HTTP request. Implementations must be safe to
+    call from many coroutines concurrently.
+    """
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str] | None = None,
+    ) -> Response: ...
+
+    async def close(self): ...
+
+
+class RateLimiter(T.Protocol):
+    """
+    Anything that can make a coroutine wait for its turn, e.g. a
+    :class:`~sakura_gather.rate_limit.TokenBucket`.
+    """
+
+    async def acquire_async(self, n: int = 1): ...
+
+
+class AiohttpTransport:
+    """
+    :class:`Transport` backed by an ``aiohttp.ClientSession`` with a pooled
+    keep-alive connector.
+
+    :param pool_size: max number of open connections in total.
+    :param pool_size_per_host: max number of open connections per host.
+    :param timeout: total timeout in seconds for one request.
+    :param keepalive_timeout: seconds to keep an idle connection open.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 100,
+        pool_size_per_host: int = 10,
+        timeout: float = 30.0,
+        keepalive_timeout: float = 30.0,
+        headers: dict[str, str] | None = None,
+    ):
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = headers
+        self._session: T.Optional["aiohttp.ClientSession"] = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str] | None = None,
+    ) -> Response:
+        session = self._get_session()
+        async with session.request(method, url, headers=headers) as res:
+            body = await res.read()
+            return Response(
+                status=res.status,
+                headers=dict(res.headers),
+                body=body,
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    :param max_attempts: total number of attempts, including the first one.
+    :param base_delay: delay cap of the first retry in seconds.
+    :param max_delay: upper bound of any delay in seconds.
+    :param retry_status_codes: HTTP status codes that are worth retrying.
+    """
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retry_status_codes: frozenset[int] = RETRY_STATUS_CODES
+
+    def get_delay(
+        self,
+        attempt: int,
+        retry_after: float | None = None,
+    ) -> float:
+        """
+        :param attempt: the 1-based number of the attempt that just failed.
+        :param retry_after: the server suggested delay, if any.
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+def parse_retry_after(headers: dict[str, str]) -> float | None:
+    """
+    Parse the delay-seconds form of the ``Retry-After`` header.
+    """
+    for key, value in headers.items():
+        if key.lower() == "retry-after":
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return None
+    return None
+
+
+@dataclasses.dataclass
+class FetchResult:
+    """
+    The outcome of fetching one url, after all retries.
+
+    :param status: last HTTP status code, ``None`` if no response was received.
+    :param elapsed: seconds from the first attempt to the end of the last,
+        including the waits for the limiters and the backoff sleeps.
+    :param last_elapsed: seconds the last attempt spent in the transport.
+    :param transport_elapsed: seconds all attempts spent in the transport,
+        the waits for the limiters and the backoff sleeps are not counted.
+    :param error: the last exception, if the last attempt raised.
+    """
+
+    url: str
+    status: int | None = None
+    headers: dict[str, str] = dataclasses.field(default_factory=dict)
+    body: bytes = b""
+    n_attempt: int = 0
+    elapsed: float = 0.0
+    last_elapsed: float = 0.0
+    transport_elapsed: float = 0.0
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and 200 <= self.status < 300
+
+    @property
+    def not_modified(self) -> bool:
+        """
+        ``True`` if the server answered a conditional request with ``304``.
+        """
+        return self.status == 304
+
+
+class AsyncFetcher:
+    """
+    Fetch many urls concurrently with bounded, rate limited, per-host
+    concurrency.
+
+    :param transport: the :class:`Transport` to use, defaults to
+        :class:`AiohttpTransport`.
+    :param max_concurrency: max number of in-flight requests in total.
+    :param max_concurrency_per_host: max number of in-flight requests per host.
+    :param rate_per_host: max requests per second per host, ``None`` means
+        unlimited.
+    :param burst_per_host: token bucket capacity per host.
+    :param retry_policy: see :class:`RetryPolicy`.
+    :param rate_limiter: an extra limiter every request waits for, e.g. a
+        :class:`~sakura_gather.distributed_rate_limit.DistributedTokenBucket`
+        shared by all nodes.
+    """
+
+    def __init__(
+        self,
+        transport: Transport | None = None,
+        max_concurrency: int = 32,
+        max_concurrency_per_host: int = 8,
+        rate_per_host: float | None = None,
+        burst_per_host: float | None = None,
+        retry_policy: RetryPolicy | None = None,
+        rate_limiter: T.Optional["RateLimiter"] = None,
+    ):
+        if transport is None:
+            transport = AiohttpTransport(
+                pool_size=max_concurrency,
+                pool_size_per_host=max_concurrency_per_host,
+            )
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.rate_per_host = rate_per_host
+        self.burst_per_host = burst_per_host
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self._semaphore: asyncio.Semaphore | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = dict()
+        self._host_buckets: dict[str, TokenBucket] = dict()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _get_host_semaphore(self, host: str) -> asyncio.Semaphore:
+        try:
+            return self._host_semaphores[host]
+        except KeyError:
+            sem = asyncio.Semaphore(self.max_concurrency_per_host)
+            self._host_semaphores[host] = sem
+            return sem
+
+    def get_host_bucket(self, host: str) -> TokenBucket | None:
+        if self.rate_per_host is None:
+            return None
+        try:
+            return self._host_buckets[host]
+        except KeyError:
+            bucket = TokenBucket(
+                rate=self.rate_per_host,
+                capacity=self.burst_per_host,
+            )
+            self._host_buckets[host] = bucket
+            return bucket
+
+    async def _send(
+        self,
+        url: str,
+        host: str,
+        headers: dict[str, str] | None,
+        result: FetchResult,
+    ) -> Response:
+        async with self._get_semaphore(), self._get_host_semaphore(host):
+            bucket = self.get_host_bucket(host)
+            if bucket is not None:
+                await bucket.acquire_async()
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            start = time.perf_counter()
+            try:
+                return await self.transport.request("GET", url, headers=headers)
+            finally:
+                result.last_elapsed = time.perf_counter() - start
+                result.transport_elapsed += result.last_elapsed
+
+    async def fetch(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+    ) -> FetchResult:
+        """
+        Fetch one url, retrying on network errors and retryable status codes.
+        Never raises, failures are reported in the :class:`FetchResult`.
+        """
+        host = urlsplit(url).netloc
+        with span("fetch", host=host) as s:
+            result = await self._fetch(url, host, headers)
+            if s is not None:
+                s.attrs["status"] = result.status
+                s.attrs["n_attempt"] = result.n_attempt
+        return result
+
+    async def _fetch(
+        self,
+        url: str,
+        host: str,
+        headers: dict[str, str] | None,
+    ) -> FetchResult:
+        result = FetchResult(url=url)
+        start = time.perf_counter()
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            result.n_attempt = attempt
+            retry_after = None
+            try:
+                res = await self._send(url, host, headers, result)
+                result.status = res.status
+                result.headers = res.headers
+                result.body = res.body
+                result.error = None
+                if res.status not in self.retry_policy.retry_status_codes:
+                    break
+                retry_after = parse_retry_after(res.headers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result.status = None
+                result.error = e
+            if attempt < self.retry_policy.max_attempts:
+                await asyncio.sleep(
+                    self.retry_policy.get_delay(attempt, retry_after)
+                )
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    async def fetch_many(
+        self,
+        urls: T.Iterable[str],
+        headers: dict[str, str] | None = None,
+    ) -> list[FetchResult]:
+        """
+        Fetch all urls concurrently, results are in the same order as ``urls``.
+        """
+        return list(
+            await asyncio.gather(*[self.fetch(url, headers) for url in urls])
+        )
+
+    async def close(self):
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def download_pages(
+    urls: T.Iterable[str],
+    transport: Transport | None = None,
+    **kwargs,
+) -> list[FetchResult]:
+    """
+    Synchronous entry point for the page-download stage of the detail crawl.
+    ``kwargs`` are passed to :class:`AsyncFetcher`.
+    """
+
+    async def main():
+        async with AsyncFetcher(transport=transport, **kwargs) as fetcher:
+            return await fetcher.fetch_many(urls)
+
+    return asyncio.run(main())
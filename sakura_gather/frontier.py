@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+"""
+Persistent crawl frontier: a priority queue of pending urls on SQLite, with a
+scalable Bloom filter in front of it for seen-url checks.
+
+Layout under ``dir_frontier``::
+
+    frontier.sqlite3        pending and seen urls, WAL journal
+    bloom/bloom-000.bin     memory mapped Bloom filter slices
+    bloom/bloom-001.bin     ...
+
+- :meth:`Frontier.push_many` checks seen urls locally, never in DynamoDB. A
+  url the Bloom filter has not seen is new for sure, only the Bloom positive
+  ones (seen urls and at most ``error_rate`` false positives) are looked up
+  in the ``seen`` table, so a false positive never drops an unseen url.
+- :meth:`Frontier.pop` takes the highest priority urls through a partial
+  index on ``(priority DESC, id)`` of the not-yet-taken rows, ``O(log n)``.
+  Taken urls stay in the table until :meth:`Frontier.ack`, so a crash loses
+  nothing, :meth:`Frontier.requeue_stale` hands them out again.
+- Memory stays bounded: SQLite pages and the memory mapped Bloom slices live
+  in the OS page cache, the Bloom filter takes ~2 to 4 bytes per url at a
+  0.1% error rate.
+
+.. code-block:: python
+
+    with Frontier(dir_frontier) as frontier:
+        frontier.push_many(urls, priority=10)
+        for item in frontier.pop(100):
+            crawl(item.url)
+            frontier.ack([item.id])
+"""
+
+import typing as T
+import math
+import mmap
+import itertools
+import time
+import struct
+import sqlite3
+import hashlib
+import threading
+import dataclasses
+from pathlib import Path
+
+MAGIC = b"SKBLOOM1"
+HEADER = struct.Struct("<8sQQQQ")  # magic, n_bit, n_hash, capacity, n_item
+N_ITEM = struct.Struct("<Q")
+N_ITEM_OFFSET = HEADER.size - N_ITEM.size
+
+
+def _hash_pair(key: str) -> tuple[int, int]:
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return h1, h2
+
+
+class BloomFilter:
+    """
+    A fixed size Bloom filter in a memory mapped file. Bit positions are
+    derived from one 128 bit hash with double hashing.
+
+    :param path: the filter file, created if not exists.
+    :param capacity: number of items the filter is sized for.
+    :param error_rate: false positive rate at ``capacity`` items.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        capacity: int = 1_000_000,
+        error_rate: float = 0.001,
+    ):
+        self.path = Path(path)
+        if self.path.exists():
+            self._open()
+        else:
+            n_bit = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+            n_bit = max(8, n_bit)
+            n_hash = max(1, round(n_bit / capacity * math.log(2)))
+            self._create(n_bit, n_hash, capacity)
+
+    def _create(self, n_bit: int, n_hash: int, capacity: int):
+        n_byte = (n_bit + 7) // 8
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("wb") as f:
+            f.write(HEADER.pack(MAGIC, n_bit, n_hash, capacity, 0))
+            f.truncate(HEADER.size + n_byte)
+        self._open()
+
+    def _open(self):
+        self._file = self.path.open("r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        (
+            magic,
+            self.n_bit,
+            self.n_hash,
+            self.capacity,
+            self.n_item,
+        ) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a Bloom filter file")
+
+    def _positions(self, h1: int, h2: int) -> T.Iterator[int]:
+        n_bit = self.n_bit
+        for i in range(self.n_hash):
+            yield (h1 + i * h2) % n_bit
+
+    def contains_hash(self, h1: int, h2: int) -> bool:
+        mm = self._mm
+        offset = HEADER.size
+        for pos in self._positions(h1, h2):
+            if not mm[offset + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add_hash(self, h1: int, h2: int) -> bool:
+        """
+        :return: ``True`` if the item was not in the filter.
+        """
+        mm = self._mm
+        offset = HEADER.size
+        is_new = False
+        for pos in self._positions(h1, h2):
+            i = offset + (pos >> 3)
+            bit = 1 << (pos & 7)
+            byte = mm[i]
+            if not byte & bit:
+                mm[i] = byte | bit
+                is_new = True
+        if is_new:
+            self.n_item += 1
+            N_ITEM.pack_into(mm, N_ITEM_OFFSET, self.n_item)
+        return is_new
+
+    def __contains__(self, key: str) -> bool:
+        return self.contains_hash(*_hash_pair(key))
+
+    def add(self, key: str) -> bool:
+        return self.add_hash(*_hash_pair(key))
+
+    @property
+    def is_full(self) -> bool:
+        return self.n_item >= self.capacity
+
+    @property
+    def n_byte(self) -> int:
+        return len(self._mm) - HEADER.size
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        if not self._mm.closed:
+            self.flush()
+            self._mm.close()
+            self._file.close()
+
+
+class ScalableBloomFilter:
+    """
+    A Bloom filter that grows: when the last slice is full, a new slice
+    ``growth`` times bigger with a ``tightening`` times smaller error rate is
+    added, so the overall false positive rate stays under ``error_rate`` no
+    matter how many items are added (Almeida et al., 2007).
+
+    :param dir_bloom: directory of the slice files.
+    """
+
+    def __init__(
+        self,
+        dir_bloom: Path,
+        initial_capacity: int = 1_000_000,
+        error_rate: float = 0.001,
+        growth: int = 2,
+        tightening: float = 0.5,
+    ):
+        self.dir_bloom = Path(dir_bloom)
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.dir_bloom.mkdir(parents=True, exist_ok=True)
+        self.slices: list[BloomFilter] = [
+            BloomFilter(path) for path in sorted(self.dir_bloom.glob("bloom-*.bin"))
+        ]
+        if not self.slices:
+            self._add_slice()
+
+    def _add_slice(self):
+        i = len(self.slices)
+        self.slices.append(
+            BloomFilter(
+                self.dir_bloom / f"bloom-{i:03d}.bin",
+                capacity=self.initial_capacity * self.growth**i,
+                error_rate=(
+                    self.error_rate * (1 - self.tightening) * self.tightening**i
+                ),
+            )
+        )
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = _hash_pair(key)
+        return any(s.contains_hash(h1, h2) for s in self.slices)
+
+    def add(self, key: str) -> bool:
+        """
+        :return: ``True`` if the key was not seen before.
+        """
+        h1, h2 = _hash_pair(key)
+        if any(s.contains_hash(h1, h2) for s in self.slices):
+            return False
+        if self.slices[-1].is_full:
+            self._add_slice()
+        self.slices[-1].add_hash(h1, h2)
+        return True
+
+    def __len__(self) -> int:
+        return sum(s.n_item for s in self.slices)
+
+    @property
+    def n_byte(self) -> int:
+        return sum(s.n_byte for s in self.slices)
+
+    def flush(self):
+        for s in self.slices:
+            s.flush()
+
+    def close(self):
+        for s in self.slices:
+            s.close()
+
+
+@dataclasses.dataclass
+class FrontierItem:
+    id: int
+    url: str
+    priority: int
+
+
+class Frontier:
+    """
+    :param dir_frontier: the frontier directory, created if not exists.
+    :param initial_capacity: capacity of the first Bloom filter slice.
+    :param error_rate: Bloom filter false positive rate.
+
+    Thread safe, but must not be shared by several processes.
+    """
+
+    def __init__(
+        self,
+        dir_frontier: Path,
+        initial_capacity: int = 1_000_000,
+        error_rate: float = 0.001,
+    ):
+        self.dir_frontier = Path(dir_frontier)
+        self.dir_frontier.mkdir(parents=True, exist_ok=True)
+        self.bloom = ScalableBloomFilter(
+            self.dir_frontier / "bloom",
+            initial_capacity=initial_capacity,
+            error_rate=error_rate,
+        )
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.dir_frontier / "frontier.sqlite3"),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS frontier (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                taken_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS ix_frontier_pending
+                ON frontier (priority DESC, id) WHERE taken_at IS NULL;
+            CREATE INDEX IF NOT EXISTS ix_frontier_taken
+                ON frontier (taken_at) WHERE taken_at IS NOT NULL;
+            CREATE TABLE IF NOT EXISTS seen (
+                url TEXT PRIMARY KEY
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _is_seen(self, url: str) -> bool:
+        if url not in self.bloom:
+            return False
+        row = self._conn.execute("SELECT 1 FROM seen WHERE url = ?", (url,))
+        return row.fetchone() is not None
+
+    def is_seen(self, url: str) -> bool:
+        """
+        ``True`` if the url was pushed before.
+        """
+        with self._lock:
+            return self._is_seen(url)
+
+    def push_many(
+        self,
+        urls: T.Iterable[str],
+        priority: int = 0,
+    ) -> int:
+        """
+        Push the urls that were never seen, in one transaction. The Bloom
+        filter is updated only after the transaction is committed, a failed
+        push leaves the urls unseen.
+
+        The ``seen`` table decides, not the Bloom filter: if the filter lost
+        bits the table has, e.g. after a crash right after the commit or a
+        lost ``bloom/`` slice, those urls are still not pushed again, and
+        their bits are added back.
+
+        :return: number of pushed urls.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                new_urls = dict()
+                known_urls = list()  # seen, but not in the Bloom filter
+                for url in urls:
+                    if url in new_urls or self._is_seen(url):
+                        continue
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO seen (url) VALUES (?)", (url,)
+                    )
+                    if cursor.rowcount:
+                        new_urls[url] = None
+                    else:
+                        known_urls.append(url)
+                if new_urls:
+                    self._conn.executemany(
+                        "INSERT INTO frontier (url, priority) VALUES (?, ?)",
+                        [(url, priority) for url in new_urls],
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            for url in itertools.chain(new_urls, known_urls):
+                self.bloom.add(url)
+            return len(new_urls)
+
+    def push(self, url: str, priority: int = 0) -> bool:
+        return self.push_many([url], priority) == 1
+
+    def pop(self, n: int = 1, now: float | None = None) -> list[FrontierItem]:
+        """
+        Take up to ``n`` urls, highest priority first, then first in first
+        out. They are handed out again by :meth:`requeue_stale` unless
+        acknowledged with :meth:`ack`.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, url, priority FROM frontier "
+                    "WHERE taken_at IS NULL "
+                    "ORDER BY priority DESC, id LIMIT ?",
+                    (n,),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE frontier SET taken_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [
+            FrontierItem(id=id, url=url, priority=priority)
+            for id, url, priority in rows
+        ]
+
+    def ack(self, ids: T.Iterable[int]):
+        """
+        Remove the crawled urls for good.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "DELETE FROM frontier WHERE id = ?", [(id,) for id in ids]
+            )
+            self._conn.execute("COMMIT")
+
+    def requeue_stale(self, timeout: float, now: float | None = None) -> int:
+        """
+        Hand out again the urls taken more than ``timeout`` seconds ago and
+        never acknowledged, e.g. after a crash.
+
+        :return: number of requeued urls.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE frontier SET taken_at = NULL WHERE taken_at < ?",
+                (now - timeout,),
+            )
+            return cursor.rowcount
+
+    def n_pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM frontier WHERE taken_at IS NULL"
+            ).fetchone()[0]
+
+    def n_taken(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM frontier WHERE taken_at IS NOT NULL"
+            ).fetchone()[0]
+
+    def flush(self):
+        with self._lock:
+            self.bloom.flush()
+
+    def close(self):
+        with self._lock:
+            self.bloom.close()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
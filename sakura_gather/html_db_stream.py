@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory bounded streaming reader of an HTML database.
+
+An HTML database is a JSON lines file, one entry per line, optionally gzip
+compressed, on local disk or in S3. Loading it whole before crawling makes
+memory grow with the database and delays the first request until the last
+byte is parsed. The functions here read it as a stream instead:
+
+- local files are read through a buffered file object,
+- S3 objects through :class:`S3RangeReader`, ranged ``GetObject`` calls of
+  ``block_size`` bytes, the next block is fetched in the background while the
+  current one is parsed,
+- ``.gz`` objects are decompressed on the fly.
+
+Memory use is a few blocks plus one chunk of entries, whatever the size of
+the database, and the first chunk is yielded as soon as it is parsed.
+
+.. code-block:: python
+
+    for chunk in iter_chunks(
+        "s3://bucket/html-db/cn/0001.jsonl.gz",
+        chunk_size=100,
+        s3_client=registry.s3,
+    ):
+        crawl_video_details(chunk)
+
+The entry iterator plugs into
+:func:`~sakura_gather.checkpoint.run_micro_batches`, which consumes it one
+micro-batch at a time and skips the committed prefix on resume.
+"""
+
+import typing as T
+import io
+import gzip
+import json
+import itertools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from .checkpoint import split_s3_uri
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_s3.client import S3Client
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    A read-only, forward file object over an S3 object, fetched in ranged
+    ``GetObject`` calls of ``block_size`` bytes, one block ahead.
+
+    :param prefetch: fetch the next block in a background thread while the
+        current one is consumed.
+    """
+
+    def __init__(
+        self,
+        client: "S3Client",
+        bucket: str,
+        key: str,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        prefetch: bool = True,
+    ):
+        if block_size < 1:
+            raise ValueError("block_size has to be positive")
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        res = client.head_object(Bucket=bucket, Key=key)
+        self.size: int = res["ContentLength"]
+        # pin the version, a concurrent overwrite must not mix two objects
+        self.etag: str = res["ETag"]
+        self.n_get = 0
+        self._offset = 0  # where the next block starts
+        self._block = memoryview(b"")
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._next: Future | None = None
+
+    def readable(self) -> bool:
+        return True
+
+    def _get(self, start: int) -> bytes:
+        if start >= self.size:
+            return b""
+        end = min(start + self.block_size, self.size) - 1
+        self.n_get += 1
+        return self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={start}-{end}",
+            IfMatch=self.etag,
+        )["Body"].read()
+
+    def _fetch_block(self) -> bytes:
+        if self._next is not None:
+            data = self._next.result()
+        else:
+            data = self._get(self._offset)
+        self._offset += len(data)
+        self._next = None
+        if self._executor is not None and self._offset < self.size:
+            self._next = self._executor.submit(self._get, self._offset)
+        return data
+
+    def readinto(self, buffer) -> int:
+        if not self._block:
+            self._block = memoryview(self._fetch_block())
+            if not self._block:
+                return 0
+        n = min(len(buffer), len(self._block))
+        buffer[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._next = None
+        super().close()
+
+
+def open_html_db(
+    source: T.Union[str, Path],
+    s3_client: T.Optional["S3Client"] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> T.BinaryIO:
+    """
+    Open a local path or a ``s3://`` uri as a binary stream, decompressed if
+    the name ends with ``.gz``.
+    """
+    source = str(source)
+    if source.startswith("s3://"):
+        if s3_client is None:
+            raise ValueError("s3_client is required to read from S3")
+        bucket, key = split_s3_uri(source)
+        raw = S3RangeReader(s3_client, bucket, key, block_size=block_size)
+        f = io.BufferedReader(raw, buffer_size=64 * 1024)
+    else:
+        f = open(source, "rb")
+    if source.endswith(".gz"):
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    return f
+
+
+def iter_entries(
+    source: T.Union[str, Path],
+    s3_client: T.Optional["S3Client"] = None,
+    parse_func: T.Callable[[bytes], T.Any] = json.loads,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> T.Iterator[T.Any]:
+    """
+    Yield the entries of an HTML database one at a time, blank lines are
+    skipped.
+
+    :param parse_func: parses one line.
+    """
+    f = open_html_db(source, s3_client=s3_client, block_size=block_size)
+    # a gzip wrapper doesn't close the file object it was given
+    inner = f.fileobj if isinstance(f, gzip.GzipFile) else None
+    try:
+        for line in f:
+            if line.strip():
+                yield parse_func(line)
+    finally:
+        f.close()
+        if inner is not None:
+            inner.close()
+
+
+def iter_chunks(
+    source: T.Union[str, Path],
+    chunk_size: int = 100,
+    s3_client: T.Optional["S3Client"] = None,
+    parse_func: T.Callable[[bytes], T.Any] = json.loads,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> T.Iterator[list[T.Any]]:
+    """
+    Yield the entries of an HTML database in lists of ``chunk_size``.
+    """
+    entries = iter_entries(
+        source,
+        s3_client=s3_client,
+        parse_func=parse_func,
+        block_size=block_size,
+    )
+    while True:
+        chunk = list(itertools.islice(entries, chunk_size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+"""
+Small helpers to measure throughput and memory.
+"""
+
+import sys
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def get_peak_rss() -> int | None:
+    """
+    Peak resident set size of the current process in bytes, ``None`` if the
+    platform doesn't tell.
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":  # pragma: no cover
+        return peak
+    return peak * 1024
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    The ``p`` th percentile (0 - 100) of the values, with linear
+    interpolation between the closest ranks.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
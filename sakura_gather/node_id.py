@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Block allocated, sharded node id dispenser on DynamoDB.
+
+``RoundRobinManager.get_next_node_id`` hands out node ids from one counter
+item. When many workers start together, e.g. at the top of the hourly cron,
+they all write that one item and retry on conditional-write conflicts.
+:class:`NodeIdDispenser` removes the hot key in two ways:
+
+- **Blocks**: a worker claims ``block_size`` consecutive ids with one
+  write and hands them out locally, so the counter sees one write per block
+  instead of one per id.
+- **Shards**: the counter is split over ``n_shard`` items. Block ``b`` of
+  shard ``s`` is the global block ``b * n_shard + s``, so blocks never
+  overlap, and concurrent workers write different items.
+
+A claim is an unconditional atomic ``ADD`` on the shard item, DynamoDB
+serializes those without conflicts, so there is nothing to retry. Ids of a
+block that a worker never used are skipped, the ids are unique and roughly,
+not strictly, round-robin. A block is handed out starting at a rotating
+offset, so short-lived workers that use only the first id of their block
+don't all land on the node ids at multiples of ``block_size``.
+
+With ``n_node`` the ids are wrapped to node ids in ``[0, n_node)``:
+
+.. code-block:: python
+
+    dispenser = NodeIdDispenser(
+        registry.dynamodb,
+        table_name="sakura_status_tracking",
+        n_node=n_node,
+    )
+    daemon = CrawlDaemon(crawl_func=crawl_func, next_node_id_func=dispenser)
+"""
+
+import typing as T
+import random
+import threading
+from collections import deque
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_dynamodb.client import DynamoDBClient
+
+DEFAULT_COUNTER_NAME = "node-id-counter"
+
+
+class NodeIdDispenser:
+    """
+    :param client: boto3 DynamoDB client.
+    :param table_name: any table with a string hash key, e.g. the status
+        tracking table, the counters are ``{counter_name}#{shard}`` items.
+    :param key_name: the table's hash key.
+    :param n_node: wrap ids to ``[0, n_node)``, ``None`` for raw ids.
+    :param block_size: ids claimed per write.
+    :param n_shard: counter items, don't change it for an existing counter.
+    :param seed: picks the first shard, a random one if ``None``.
+
+    Thread safe, and the dispenser itself is a ``next_node_id_func``.
+    """
+
+    def __init__(
+        self,
+        client: "DynamoDBClient",
+        table_name: str,
+        key_name: str = "id",
+        counter_name: str = DEFAULT_COUNTER_NAME,
+        n_node: int | None = None,
+        block_size: int = 16,
+        n_shard: int = 16,
+        seed: int | None = None,
+    ):
+        if block_size < 1:
+            raise ValueError("block_size has to be at least 1")
+        if n_shard < 1:
+            raise ValueError("n_shard has to be at least 1")
+        if n_node is not None and n_node < 1:
+            raise ValueError("n_node has to be at least 1")
+        self.client = client
+        self.table_name = table_name
+        self.key_name = key_name
+        self.counter_name = counter_name
+        self.n_node = n_node
+        self.block_size = block_size
+        self.n_shard = n_shard
+        self._shard = random.Random(seed).randrange(n_shard)
+        self._ids: deque[int] = deque()
+        self._lock = threading.Lock()
+        # claim_block is public, the shard rotation has its own lock so that
+        # next_id can hold _lock while claiming
+        self._shard_lock = threading.Lock()
+        self.n_claim = 0
+
+    def get_shard_key(self, shard: int) -> str:
+        return f"{self.counter_name}#{shard}"
+
+    def claim_block(self) -> tuple[int, int]:
+        """
+        Claim the next block of a shard with one write, the shards are
+        visited in turn.
+
+        :return: the global block number and the first id of the block.
+        """
+        with self._shard_lock:
+            shard = self._shard
+            self._shard = (shard + 1) % self.n_shard
+        res = self.client.update_item(
+            TableName=self.table_name,
+            Key={self.key_name: {"S": self.get_shard_key(shard)}},
+            UpdateExpression="ADD n_block :one",
+            ExpressionAttributeValues={":one": {"N": "1"}},
+            ReturnValues="UPDATED_NEW",
+        )
+        n_block = int(res["Attributes"]["n_block"]["N"])
+        block = (n_block - 1) * self.n_shard + shard
+        with self._shard_lock:
+            self.n_claim += 1
+        return block, block * self.block_size
+
+    def next_id(self) -> int:
+        """
+        The next raw id, unique across all workers.
+        """
+        with self._lock:
+            if not self._ids:
+                block, start = self.claim_block()
+                offset = block % self.block_size
+                self._ids.extend(
+                    start + (offset + i) % self.block_size
+                    for i in range(self.block_size)
+                )
+            return self._ids.popleft()
+
+    def next_node_id(self) -> int:
+        id = self.next_id()
+        if self.n_node is None:
+            return id
+        return id % self.n_node
+
+    def __call__(self) -> int:
+        return self.next_node_id()
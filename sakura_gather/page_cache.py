@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content addressed on-disk page cache with LRU eviction.
+
+Re-crawls used to download every detail page again even if nothing changed.
+:class:`PageCache` keeps the last response body of each url, so the crawler
+can send ``If-None-Match`` / ``If-Modified-Since`` and skip unchanged pages
+entirely on ``304 Not Modified``.
+
+Layout under ``dir_cache``:
+
+- ``index.bin``: a memory mapped open addressing hash table, one fixed size
+  slot per url (url hash, body md5, size, last access time, store time). A
+  lookup is a few probes in the mapped file, no directory scan.
+- ``objects/<md5[:2]>/<md5>``: the bodies, content addressed, so identical
+  pages are stored once. The number of urls that point to each body is kept
+  in memory, built from the index on open, so a body is deleted with its
+  last url without scanning the index.
+- ``meta/<url hash>.json``: the url and its validators (``ETag``,
+  ``Last-Modified``), only read when they are needed.
+
+When the total size goes over ``max_bytes``, the least recently used entries
+are evicted until the cache is at ``low_watermark`` of the cap.
+
+The cache is thread safe, but must not be shared by several processes.
+"""
+
+import typing as T
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import threading
+import dataclasses
+from pathlib import Path
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .fetcher import AsyncFetcher, FetchResult
+
+MAGIC = b"SKPGCACH"
+HEADER = struct.Struct("<8sQQQ")  # magic, n_slot, n_used, total_size
+SLOT = struct.Struct("<Q16sQdd")  # url hash, md5, size, last access, stored at
+EMPTY = 0
+TOMBSTONE = 1
+MAX_LOAD_FACTOR = 0.7
+
+
+def hash_url(url: str) -> int:
+    h = int.from_bytes(
+        hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(),
+        "little",
+    )
+    # 0 and 1 are reserved for empty and deleted slots
+    return h if h > TOMBSTONE else h + 2
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    url: str
+    md5: str
+    size: int
+    last_access: float
+    stored_at: float
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class PageCache:
+    """
+    :param dir_cache: the cache directory, created if not exists.
+    :param max_bytes: size cap of all cached bodies.
+    :param low_watermark: eviction stops at this fraction of ``max_bytes``.
+    :param n_slot: initial number of index slots, the index doubles when it
+        is more than 70% full.
+    """
+
+    def __init__(
+        self,
+        dir_cache: Path,
+        max_bytes: int = 1024**3,
+        low_watermark: float = 0.9,
+        n_slot: int = 1024,
+    ):
+        self.dir_cache = Path(dir_cache)
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.dir_objects = self.dir_cache / "objects"
+        self.dir_meta = self.dir_cache / "meta"
+        self.path_index = self.dir_cache / "index.bin"
+        self.dir_objects.mkdir(parents=True, exist_ok=True)
+        self.dir_meta.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._file: T.BinaryIO | None = None
+        self._mm: mmap.mmap | None = None
+        if not self.path_index.exists():
+            self._create_index(self.path_index, n_slot)
+        self._open_index()
+        # body md5 -> number of urls that point to it
+        self._refcount: dict[bytes, int] = dict()
+        for _, slot in self._iter_slots():
+            self._refcount[slot[1]] = self._refcount.get(slot[1], 0) + 1
+
+    # --------------------------------------------------------------------------
+    # index file
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def _create_index(path: Path, n_slot: int):
+        with path.open("wb") as f:
+            f.write(HEADER.pack(MAGIC, n_slot, 0, 0))
+            f.truncate(HEADER.size + n_slot * SLOT.size)
+
+    def _open_index(self):
+        self._file = self.path_index.open("r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        magic, _, _, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path_index} is not a page cache index")
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm.close()
+                self._file.close()
+                self._mm = None
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _header(self) -> tuple[int, int, int]:
+        _, n_slot, n_used, total_size = HEADER.unpack_from(self._mm, 0)
+        return n_slot, n_used, total_size
+
+    def _set_header(self, n_slot: int, n_used: int, total_size: int):
+        HEADER.pack_into(self._mm, 0, MAGIC, n_slot, n_used, total_size)
+
+    def _read_slot(self, i: int) -> tuple[int, bytes, int, float, float]:
+        return SLOT.unpack_from(self._mm, HEADER.size + i * SLOT.size)
+
+    def _write_slot(self, i: int, *values):
+        SLOT.pack_into(self._mm, HEADER.size + i * SLOT.size, *values)
+
+    def _find(self, url_hash: int) -> tuple[int | None, int]:
+        """
+        :return: the slot index of the url (or ``None``) and the first slot
+            that can take it.
+        """
+        n_slot, _, _ = self._header()
+        i = url_hash % n_slot
+        first_free = None
+        for _ in range(n_slot):
+            h = self._read_slot(i)[0]
+            if h == url_hash:
+                return i, i
+            if h == EMPTY:
+                return None, i if first_free is None else first_free
+            if h == TOMBSTONE and first_free is None:
+                first_free = i
+            i = (i + 1) % n_slot
+        return None, first_free
+
+    def _iter_slots(self) -> T.Iterator[tuple[int, tuple]]:
+        n_slot, _, _ = self._header()
+        for i in range(n_slot):
+            slot = self._read_slot(i)
+            if slot[0] > TOMBSTONE:
+                yield i, slot
+
+    def _grow(self):
+        n_slot, _, total_size = self._header()
+        slots = [slot for _, slot in self._iter_slots()]
+        path_tmp = self.path_index.with_suffix(".tmp")
+        self._create_index(path_tmp, n_slot * 2)
+        self.close()
+        os.replace(path_tmp, self.path_index)
+        self._open_index()
+        for slot in slots:
+            _, i = self._find(slot[0])
+            self._write_slot(i, *slot)
+        self._set_header(n_slot * 2, len(slots), total_size)
+
+    # --------------------------------------------------------------------------
+    # files
+    # --------------------------------------------------------------------------
+    def _path_object(self, md5: str) -> Path:
+        return self.dir_objects / md5[:2] / md5
+
+    def _path_meta(self, url_hash: int) -> Path:
+        return self.dir_meta / f"{url_hash:016x}.json"
+
+    # --------------------------------------------------------------------------
+    # public API
+    # --------------------------------------------------------------------------
+    def lookup(self, url: str) -> CacheEntry | None:
+        """
+        Get the cache entry of the url without touching its access time.
+        """
+        url_hash = hash_url(url)
+        with self._lock:
+            i, _ = self._find(url_hash)
+            if i is None:
+                return None
+            _, md5, size, last_access, stored_at = self._read_slot(i)
+        try:
+            meta = json.loads(self._path_meta(url_hash).read_text())
+        except FileNotFoundError:
+            return None
+        if meta["url"] != url:  # 64 bit hash collision
+            return None
+        return CacheEntry(
+            url=url,
+            md5=md5.hex(),
+            size=size,
+            last_access=last_access,
+            stored_at=stored_at,
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+        )
+
+    def touch(self, url: str):
+        """
+        Mark the url as recently used, e.g. after a ``304 Not Modified``.
+        """
+        url_hash = hash_url(url)
+        with self._lock:
+            i, _ = self._find(url_hash)
+            if i is not None:
+                h, md5, size, _, stored_at = self._read_slot(i)
+                self._write_slot(i, h, md5, size, time.time(), stored_at)
+
+    def get(self, url: str) -> bytes | None:
+        """
+        Get the cached body and mark the url as recently used.
+        """
+        entry = self.lookup(url)
+        if entry is None:
+            return None
+        try:
+            body = self._path_object(entry.md5).read_bytes()
+        except FileNotFoundError:
+            return None
+        self.touch(url)
+        return body
+
+    def put(
+        self,
+        url: str,
+        body: bytes,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> CacheEntry | None:
+        """
+        Store the body and validators of the url, replacing the old entry.
+
+        :return: the new entry, ``None`` if it was evicted right away because
+            it is bigger than the cache.
+        """
+        md5_bytes = hashlib.md5(body).digest()
+        url_hash = hash_url(url)
+        meta = dict(url=url, etag=etag, last_modified=last_modified)
+        now = time.time()
+        with self._lock:
+            path_object = self._path_object(md5_bytes.hex())
+            if not path_object.exists():
+                path_object.parent.mkdir(exist_ok=True)
+                path_tmp = path_object.with_suffix(".tmp")
+                path_tmp.write_bytes(body)
+                os.replace(path_tmp, path_object)
+            n_slot, n_used, _ = self._header()
+            if (n_used + 1) / n_slot > MAX_LOAD_FACTOR:
+                self._grow()
+            # count the new reference first, so replacing the old entry
+            # can't delete a body it shares with the new one
+            self._refcount[md5_bytes] = self._refcount.get(md5_bytes, 0) + 1
+            i, _ = self._find(url_hash)
+            if i is not None:
+                self._remove_slot(i)
+            _, i = self._find(url_hash)
+            n_slot, n_used, total_size = self._header()
+            if self._read_slot(i)[0] == EMPTY:
+                n_used += 1
+            self._write_slot(i, url_hash, md5_bytes, len(body), now, now)
+            self._set_header(n_slot, n_used, total_size + len(body))
+            self._path_meta(url_hash).write_text(json.dumps(meta))
+            self._evict_if_needed()
+        return self.lookup(url)
+
+    def _remove_slot(self, i: int):
+        """
+        Remove the entry in slot ``i``, and its body if no other url points
+        to it.
+        """
+        h, md5, size, _, _ = self._read_slot(i)
+        n_slot, n_used, total_size = self._header()
+        self._write_slot(i, TOMBSTONE, b"\x00" * 16, 0, 0.0, 0.0)
+        self._set_header(n_slot, n_used, total_size - size)
+        self._path_meta(h).unlink(missing_ok=True)
+        n_ref = self._refcount.get(md5, 0) - 1
+        if n_ref > 0:
+            self._refcount[md5] = n_ref
+        else:
+            self._refcount.pop(md5, None)
+            self._path_object(md5.hex()).unlink(missing_ok=True)
+
+    def remove(self, url: str):
+        with self._lock:
+            i, _ = self._find(hash_url(url))
+            if i is not None:
+                self._remove_slot(i)
+
+    @property
+    def total_size(self) -> int:
+        with self._lock:
+            return self._header()[2]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(1 for _ in self._iter_slots())
+
+    def _evict_if_needed(self):
+        if self._header()[2] <= self.max_bytes:
+            return
+        target = self.max_bytes * self.low_watermark
+        slots = sorted(self._iter_slots(), key=lambda x: x[1][3])
+        for i, _ in slots:
+            if self._header()[2] <= target:
+                break
+            self._remove_slot(i)
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """
+        The ``If-None-Match`` / ``If-Modified-Since`` headers for the url,
+        empty if it's not cached.
+        """
+        entry = self.lookup(url)
+        headers = dict()
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+
+def get_header(headers: dict[str, str], name: str) -> str | None:
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+async def fetch_with_cache(
+    fetcher: "AsyncFetcher",
+    cache: PageCache,
+    url: str,
+) -> "FetchResult":
+    """
+    Fetch the url with a conditional request.
+
+    On ``304 Not Modified`` the cached body is returned and the result's
+    :attr:`~sakura_gather.fetcher.FetchResult.not_modified` is ``True``, the
+    caller can skip parsing it. On ``200`` the body is stored in the cache,
+    also when it comes from a full refetch after a ``304`` whose entry was
+    evicted in between.
+    """
+    result = await fetcher.fetch(url, headers=cache.conditional_headers(url))
+    if result.status == 304:
+        body = cache.get(url)
+        if body is not None:
+            result.body = body
+            return result
+        # evicted in between, fetch it again
+        result = await fetcher.fetch(url)
+    if result.ok:
+        cache.put(
+            url,
+            result.body,
+            etag=get_header(result.headers, "ETag"),
+            last_modified=get_header(result.headers, "Last-Modified"),
+        )
+    return result
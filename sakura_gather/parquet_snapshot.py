@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar Parquet snapshot of crawled video details.
+
+A snapshot is written as a hive partitioned Parquet dataset, partitioned by
+``lang_code`` and ``shard``::
+
+    ${dir_snapshot}/lang_code=cn/shard=0/part-0-0.parquet
+
+Strings are dictionary encoded and every row group carries min / max
+statistics, so readers push column projections and filters down to the files
+instead of parsing every record:
+
+.. code-block:: python
+
+    import pyarrow.compute as pc
+
+    table = read_snapshot(
+        dir_snapshot,
+        columns=["video_id", "title"],
+        filter=(pc.field("lang_code") == "cn") & (pc.field("duration") > 3600),
+    )
+
+:func:`convert_jsonl_snapshot` converts the existing JSON lines layout, one
+video detail per line, optionally gzip compressed.
+
+Without an explicit schema, the schema is inferred batch by batch. A batch
+with a field the schema doesn't have yet, or with a type for a column that was
+all null so far, widens the schema: the files written so far keep the old
+schema, the next ones get the wider one, and the final schema is saved in the
+``_common_metadata`` file, which :func:`open_snapshot` reads the dataset
+with. Missing columns read as null.
+
+Requires ``pyarrow``, install it with ``pip install sakura_gather[parquet]``.
+"""
+
+import typing as T
+import gzip
+import json
+import shutil
+import tempfile
+import itertools
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .records import RecordStore
+
+PARTITION_COLS = ("lang_code", "shard")
+COMMON_METADATA = "_common_metadata"
+DEFAULT_BATCH_SIZE = 10_000
+DEFAULT_ROW_GROUP_SIZE = 100_000
+
+
+def get_snapshot_dir(dir_root: Path, snapshot_md5: str) -> Path:
+    """
+    Where the Parquet dataset of a snapshot lives.
+    """
+    return Path(dir_root) / "snapshots" / snapshot_md5 / "parquet"
+
+
+def _unify(schema: pa.Schema, batch_schema: pa.Schema) -> pa.Schema:
+    # null takes the type of the other side, int64 and double become double
+    return pa.unify_schemas([schema, batch_schema], promote_options="permissive")
+
+
+def _fits(schema: pa.Schema, batch_schema: pa.Schema) -> bool:
+    """
+    Whether a batch can be written with ``schema`` without losing data.
+    """
+    return _unify(schema, batch_schema).equals(schema)
+
+
+class _BatchReader:
+    """
+    Cut records into record batches of one schema at a time.
+
+    :meth:`next_batches` yields batches as long as they fit ``schema``, with
+    missing columns filled with nulls, and stops at the first batch that
+    needs a wider schema. :attr:`schema` is then widened, the next call
+    goes on from that batch.
+    """
+
+    def __init__(
+        self,
+        records: T.Iterable[T.Mapping[str, T.Any]],
+        batch_size: int,
+    ):
+        self._iterator = iter(records)
+        self.batch_size = batch_size
+        self.schema: pa.Schema | None = None
+        self._next: tuple[list, pa.RecordBatch] | None = None
+        self._read()
+
+    def _read(self):
+        chunk = list(itertools.islice(self._iterator, self.batch_size))
+        if chunk:
+            self._next = (chunk, pa.RecordBatch.from_pylist(chunk))
+        else:
+            self._next = None
+
+    @property
+    def is_done(self) -> bool:
+        return self._next is None
+
+    def widen(self):
+        batch_schema = self._next[1].schema
+        if self.schema is None:
+            self.schema = batch_schema
+        else:
+            self.schema = _unify(self.schema, batch_schema)
+
+    def next_batches(self) -> T.Iterator[pa.RecordBatch]:
+        while self._next is not None:
+            chunk, batch = self._next
+            if batch.schema.equals(self.schema):
+                yield batch
+            elif _fits(self.schema, batch.schema):
+                yield pa.RecordBatch.from_pylist(chunk, schema=self.schema)
+            else:
+                return
+            self._read()
+
+
+def _write_batches(
+    batches: T.Iterable[pa.RecordBatch],
+    dir_snapshot: Path,
+    schema: pa.Schema,
+    partition_cols: T.Sequence[str],
+    batch_size: int,
+    row_group_size: int,
+    compression: str,
+    basename_template: str,
+    existing_data_behavior: str,
+):
+    file_format = ds.ParquetFileFormat()
+    ds.write_dataset(
+        batches,
+        base_dir=str(dir_snapshot),
+        basename_template=basename_template,
+        schema=schema,
+        format=file_format,
+        file_options=file_format.make_write_options(
+            use_dictionary=True,
+            write_statistics=True,
+            compression=compression,
+        ),
+        partitioning=ds.partitioning(
+            pa.schema([schema.field(name) for name in partition_cols]),
+            flavor="hive",
+        ),
+        max_rows_per_group=row_group_size,
+        min_rows_per_group=min(row_group_size, batch_size),
+        existing_data_behavior=existing_data_behavior,
+    )
+
+
+def _replace_partitions(dir_src: Path, dir_dst: Path):
+    """
+    Move every partition directory written under ``dir_src`` to ``dir_dst``,
+    replacing the same partition there.
+    """
+    dirs = {path.parent for path in dir_src.rglob("*.parquet")}
+    for dir_partition in sorted(dirs):
+        dir_target = dir_dst / dir_partition.relative_to(dir_src)
+        if dir_target.exists():
+            shutil.rmtree(dir_target)
+        dir_target.parent.mkdir(parents=True, exist_ok=True)
+        dir_partition.rename(dir_target)
+
+
+def write_snapshot(
+    records: T.Union[RecordStore, T.Iterable[T.Mapping[str, T.Any]]],
+    dir_snapshot: Path,
+    schema: pa.Schema | None = None,
+    partition_cols: T.Sequence[str] = PARTITION_COLS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    compression: str = "zstd",
+) -> int:
+    """
+    Write records as a partitioned Parquet dataset. Records are converted
+    ``batch_size`` at a time, so the whole snapshot is never in memory.
+
+    :param records: video detail dicts, each has the ``partition_cols`` keys,
+        or a :class:`~sakura_gather.records.RecordStore`, whose column
+        buffers are written without converting rows.
+    :param schema: the arrow schema, fields of the records that are not in
+        it are dropped. Inferred and widened batch by batch if not given.
+    :return: number of written records.
+
+    Files of an earlier snapshot in the partitions that are written are
+    deleted first.
+    """
+    n_record = 0
+
+    def counted(batches: T.Iterable[pa.RecordBatch]):
+        nonlocal n_record
+        for batch in batches:
+            n_record += batch.num_rows
+            yield batch
+
+    kwargs = dict(
+        dir_snapshot=dir_snapshot,
+        partition_cols=partition_cols,
+        batch_size=batch_size,
+        row_group_size=row_group_size,
+        compression=compression,
+    )
+    if isinstance(records, RecordStore):
+        # the columns of a record store are fixed, one schema fits all
+        if not len(records):
+            return 0
+        batches = records.iter_record_batches(batch_size)
+        if schema is None:
+            first_batch = next(batches)
+            schema = first_batch.schema
+            batches = itertools.chain([first_batch], batches)
+        else:
+            batches = (batch.cast(schema) for batch in batches)
+        _write_batches(
+            counted(batches),
+            schema=schema,
+            basename_template="part-{i}.parquet",
+            existing_data_behavior="delete_matching",
+            **kwargs,
+        )
+    elif schema is not None:
+        iterator = iter(records)
+
+        def batches():
+            while True:
+                chunk = list(itertools.islice(iterator, batch_size))
+                if not chunk:
+                    return
+                yield pa.RecordBatch.from_pylist(chunk, schema=schema)
+
+        _write_batches(
+            counted(batches()),
+            schema=schema,
+            basename_template="part-{i}.parquet",
+            existing_data_behavior="delete_matching",
+            **kwargs,
+        )
+    else:
+        # a partition may first show up in any generation, the generations
+        # are written to a hidden directory, then every written partition
+        # replaces its old files at once
+        Path(dir_snapshot).mkdir(parents=True, exist_ok=True)
+        dir_tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=dir_snapshot))
+        try:
+            kwargs["dir_snapshot"] = dir_tmp
+            reader = _BatchReader(records, batch_size)
+            generation = 0
+            while not reader.is_done:
+                reader.widen()
+                _write_batches(
+                    counted(reader.next_batches()),
+                    schema=reader.schema,
+                    basename_template=f"part-{generation}-{{i}}.parquet",
+                    existing_data_behavior="overwrite_or_ignore",
+                    **kwargs,
+                )
+                generation += 1
+            _replace_partitions(dir_tmp, Path(dir_snapshot))
+        finally:
+            shutil.rmtree(dir_tmp, ignore_errors=True)
+        schema = reader.schema
+    if schema is None:
+        return 0
+    # partition values come from the directory names, as plain values
+    for name in partition_cols:
+        index = schema.get_field_index(name)
+        field = schema.field(index)
+        if pa.types.is_dictionary(field.type):
+            schema = schema.set(index, field.with_type(field.type.value_type))
+    pq.write_metadata(schema, str(Path(dir_snapshot) / COMMON_METADATA))
+    return n_record
+
+
+def open_snapshot(dir_snapshot: Path) -> ds.Dataset:
+    """
+    Open the snapshot with the schema saved by :func:`write_snapshot`, files
+    written with an older, narrower schema read missing columns as null.
+    """
+    path_schema = Path(dir_snapshot) / COMMON_METADATA
+    schema = pq.read_schema(str(path_schema)) if path_schema.exists() else None
+    return ds.dataset(
+        str(dir_snapshot),
+        schema=schema,
+        format="parquet",
+        partitioning="hive",
+    )
+
+
+def read_snapshot(
+    dir_snapshot: Path,
+    columns: list[str] | None = None,
+    filter: T.Optional["ds.Expression"] = None,
+) -> pa.Table:
+    """
+    Read the snapshot, only the given columns and only the row groups that
+    may match the filter are read.
+    """
+    return open_snapshot(dir_snapshot).to_table(columns=columns, filter=filter)
+
+
+def iter_jsonl(path: Path) -> T.Iterator[dict[str, T.Any]]:
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def convert_jsonl_snapshot(
+    paths: T.Iterable[Path],
+    dir_snapshot: Path,
+    lang_code: str | None = None,
+    shard: int | None = None,
+    **kwargs,
+) -> int:
+    """
+    Convert JSON lines files of the existing snapshot layout to Parquet.
+
+    :param lang_code: fill the ``lang_code`` column if records don't have it.
+    :param shard: fill the ``shard`` column if records don't have it.
+    :param kwargs: passed to :func:`write_snapshot`.
+    :return: number of converted records.
+    """
+
+    def records():
+        for path in paths:
+            for record in iter_jsonl(path):
+                if lang_code is not None:
+                    record.setdefault("lang_code", lang_code)
+                if shard is not None:
+                    record.setdefault("shard", shard)
+                yield record
+
+    return write_snapshot(records(), dir_snapshot, **kwargs)
+
+
+def get_row_group_stats(path: Path, column: str) -> list[tuple[T.Any, T.Any]]:
+    """
+    The ``(min, max)`` statistics of a column in each row group of one file.
+    """
+    meta = pq.ParquetFile(str(path)).metadata
+    index = meta.schema.names.index(column)
+    stats = list()
+    for i in range(meta.num_row_groups):
+        s = meta.row_group(i).column(index).statistics
+        stats.append((s.min, s.max) if s is not None and s.has_min_max else None)
+    return stats
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pipelined crawl: network fetching and HTML parsing run in separate stages.
+
+::
+
+    fetcher thread (asyncio)  --pages-->  bounded queue  --batches-->  process pool
+    AsyncFetcher, N in flight             back-pressure                 parse_func
+
+- The fetch stage runs an :class:`~sakura_gather.fetcher.AsyncFetcher` in its
+  own thread. When the page queue is full, fetching pauses.
+- The parse stage groups pages into batches and sends each batch to a
+  ``ProcessPoolExecutor``. With ``use_shared_memory=True`` the page bodies of
+  a batch are packed into one shared memory block and only its name and the
+  offsets are pickled. At most ``max_inflight_batches`` batches are in the
+  pool, which in turn back-pressures the page queue.
+
+:class:`PipelineStats` reports the utilization of each stage and how long
+each stage waited on the other, which tells where the bottleneck is.
+
+``parse_func(url, body)`` must be a picklable top level function.
+"""
+
+import typing as T
+import os
+import sys
+import time
+import queue
+import asyncio
+import threading
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+
+from .fetcher import AsyncFetcher, FetchResult
+from .tracing import get_tracer
+
+ParseFunc = T.Callable[[str, bytes], T.Any]
+
+_END = object()
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # the parent owns the block, the worker must not register it with the
+    # resource tracker or the block is unlinked when the worker exits
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)  # pragma: no cover
+
+
+def _parse_batch(
+    parse_func: ParseFunc,
+    urls: list[str],
+    bodies: list[bytes] | None,
+    shm_name: str | None,
+    offsets: list[int] | None,
+) -> tuple[list[T.Any], float]:
+    """
+    Runs in the worker process.
+
+    :return: the parsed results and the seconds spent parsing.
+    """
+    start = time.perf_counter()
+    if shm_name is None:
+        results = [parse_func(url, body) for url, body in zip(urls, bodies)]
+    else:
+        shm = _attach_shared_memory(shm_name)
+        try:
+            buf = shm.buf
+            results = [
+                parse_func(url, bytes(buf[offsets[i] : offsets[i + 1]]))
+                for i, url in enumerate(urls)
+            ]
+            del buf
+        finally:
+            shm.close()
+    return results, time.perf_counter() - start
+
+
+@dataclasses.dataclass
+class StageStats:
+    """
+    :param busy: seconds of work done by the stage, summed over its workers.
+    :param capacity: number of workers of the stage.
+    :param blocked: seconds the stage waited on the other stage.
+    """
+
+    name: str
+    busy: float = 0.0
+    capacity: int = 1
+    blocked: float = 0.0
+    n_item: int = 0
+
+    def utilization(self, wall: float) -> float:
+        if wall <= 0:
+            return 0.0
+        return self.busy / (self.capacity * wall)
+
+
+@dataclasses.dataclass
+class PipelineStats:
+    fetch: StageStats
+    parse: StageStats
+    n_fetch_error: int = 0
+    wall: float = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        if self.wall <= 0:
+            return 0.0
+        return self.parse.n_item / self.wall
+
+    def bottleneck(self) -> str:
+        """
+        The stage with the higher utilization.
+        """
+        if self.fetch.utilization(self.wall) >= self.parse.utilization(self.wall):
+            return self.fetch.name
+        return self.parse.name
+
+    def to_message(self) -> str:
+        return (
+            f"{self.parse.n_item} pages in {self.wall:.2f}s "
+            f"({self.pages_per_second:.1f} pages/s), "
+            f"fetch utilization {self.fetch.utilization(self.wall):.0%} "
+            f"(blocked {self.fetch.blocked:.2f}s), "
+            f"parse utilization {self.parse.utilization(self.wall):.0%} "
+            f"(starved {self.parse.blocked:.2f}s), "
+            f"{self.n_fetch_error} fetch errors, bottleneck: {self.bottleneck()}"
+        )
+
+
+class CrawlPipeline:
+    """
+    :param parse_func: ``parse_func(url, body) -> parsed``.
+    :param fetcher_factory: creates the :class:`AsyncFetcher`, called inside
+        the fetch thread.
+    :param n_parser: number of parser processes, defaults to the CPU count.
+    :param batch_size: number of pages sent to a parser at once.
+    :param queue_size: max number of fetched pages waiting to be parsed.
+    :param max_inflight_batches: max number of batches in the process pool.
+    :param use_shared_memory: pass page bodies through shared memory.
+    :param batch_timeout: send a partial batch after this many seconds
+        without new pages.
+    """
+
+    def __init__(
+        self,
+        parse_func: ParseFunc,
+        fetcher_factory: T.Callable[[], AsyncFetcher] = AsyncFetcher,
+        n_parser: int | None = None,
+        batch_size: int = 32,
+        queue_size: int = 256,
+        max_inflight_batches: int | None = None,
+        use_shared_memory: bool = True,
+        batch_timeout: float = 0.1,
+    ):
+        self.parse_func = parse_func
+        self.fetcher_factory = fetcher_factory
+        self.n_parser = n_parser or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_inflight_batches = max_inflight_batches or self.n_parser * 2
+        self.use_shared_memory = use_shared_memory
+        self.batch_timeout = batch_timeout
+
+    # --------------------------------------------------------------------------
+    # fetch stage
+    # --------------------------------------------------------------------------
+    def _fetch_stage(
+        self,
+        urls: T.Iterable[str],
+        pages: queue.Queue,
+        stats: PipelineStats,
+        errors: list[FetchResult],
+        stop: threading.Event,
+        failures: list[BaseException],
+    ):
+        async def put(item):
+            start = time.perf_counter()
+            await asyncio.to_thread(pages.put, item)
+            stats.fetch.blocked += time.perf_counter() - start
+
+        async def worker(fetcher: AsyncFetcher, url_iter: T.Iterator[str]):
+            for url in url_iter:
+                if stop.is_set():
+                    return
+                res = await fetcher.fetch(url)
+                # only the time in the transport is work, waiting for a
+                # connection slot, a rate limiter or a backoff is idle
+                stats.fetch.busy += res.transport_elapsed
+                stats.fetch.n_item += 1
+                if res.ok:
+                    await put((res.url, res.body))
+                else:
+                    stats.n_fetch_error += 1
+                    errors.append(res)
+
+        async def main():
+            async with self.fetcher_factory() as fetcher:
+                stats.fetch.capacity = fetcher.max_concurrency
+                url_iter = iter(urls)
+                await asyncio.gather(
+                    *[worker(fetcher, url_iter) for _ in range(fetcher.max_concurrency)]
+                )
+
+        try:
+            asyncio.run(main())
+        except BaseException as e:
+            # re-raised by run in the calling thread
+            failures.append(e)
+        finally:
+            pages.put(_END)
+
+    # --------------------------------------------------------------------------
+    # parse stage
+    # --------------------------------------------------------------------------
+    def _submit(
+        self,
+        executor: ProcessPoolExecutor,
+        batch: list[tuple[str, bytes]],
+    ) -> tuple[Future, list[str], shared_memory.SharedMemory | None]:
+        urls = [url for url, _ in batch]
+        if not self.use_shared_memory:
+            bodies = [body for _, body in batch]
+            future = executor.submit(
+                _parse_batch, self.parse_func, urls, bodies, None, None
+            )
+            return future, urls, None
+        offsets = [0]
+        for _, body in batch:
+            offsets.append(offsets[-1] + len(body))
+        shm = shared_memory.SharedMemory(create=True, size=max(1, offsets[-1]))
+        for (_, body), offset in zip(batch, offsets):
+            shm.buf[offset : offset + len(body)] = body
+        future = executor.submit(
+            _parse_batch, self.parse_func, urls, None, shm.name, offsets
+        )
+        return future, urls, shm
+
+    def run(
+        self,
+        urls: T.Iterable[str],
+        on_result: T.Callable[[str, T.Any], T.Any],
+        on_fetch_error: T.Callable[[FetchResult], T.Any] | None = None,
+    ) -> PipelineStats:
+        """
+        Fetch and parse all urls. ``on_result(url, parsed)`` is called in the
+        calling thread, in completion order.
+
+        An exception in the fetch stage, e.g. from ``fetcher_factory`` or
+        from iterating ``urls``, is raised here once the pages fetched before
+        it are parsed.
+        """
+        stats = PipelineStats(
+            fetch=StageStats(name="fetch"),
+            parse=StageStats(name="parse", capacity=self.n_parser),
+        )
+        pages: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        errors: list[FetchResult] = list()
+        failures: list[BaseException] = list()
+        stop = threading.Event()
+        start = time.perf_counter()
+        fetch_thread = threading.Thread(
+            target=self._fetch_stage,
+            args=(urls, pages, stats, errors, stop, failures),
+            name="fetch-stage",
+        )
+        fetch_thread.start()
+        inflight: dict[Future, tuple[list[str], T.Any]] = dict()
+
+        def collect(futures):
+            for future in futures:
+                batch_urls, shm = inflight.pop(future)
+                try:
+                    results, busy = future.result()
+                finally:
+                    if shm is not None:
+                        shm.close()
+                        shm.unlink()
+                stats.parse.busy += busy
+                get_tracer().record("parse", busy, n_page=len(results))
+                stats.parse.n_item += len(results)
+                for url, parsed in zip(batch_urls, results):
+                    on_result(url, parsed)
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.n_parser) as executor:
+                batch: list[tuple[str, bytes]] = list()
+                finished = False
+                while not finished:
+                    wait_start = time.perf_counter()
+                    try:
+                        item = pages.get(timeout=self.batch_timeout)
+                    except queue.Empty:
+                        item = None
+                    if not inflight:
+                        stats.parse.blocked += time.perf_counter() - wait_start
+                    if item is _END:
+                        finished = True
+                    elif item is not None:
+                        batch.append(item)
+                    if batch and (
+                        finished or item is None or len(batch) >= self.batch_size
+                    ):
+                        if len(inflight) >= self.max_inflight_batches:
+                            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                            collect(done)
+                        future, batch_urls, shm = self._submit(executor, batch)
+                        inflight[future] = (batch_urls, shm)
+                        batch = list()
+                    collect([future for future in list(inflight) if future.done()])
+                    if errors and on_fetch_error is not None:
+                        while errors:
+                            on_fetch_error(errors.pop(0))
+                while inflight:
+                    done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                    collect(done)
+        finally:
+            stop.set()
+            # unblock the fetch stage if it waits on a full queue
+            while fetch_thread.is_alive():
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            fetch_thread.join()
+            for _, shm in inflight.values():
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+        if failures:
+            raise failures[0]
+        if on_fetch_error is not None:
+            for res in errors:
+                on_fetch_error(res)
+        stats.wall = time.perf_counter() - start
+        return stats
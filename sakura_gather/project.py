@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build the :class:`sakura_site_msav.project.define.Project` and the dev account
+boto session from environment variables, the same way ``run.py`` does.
+"""
+
+import os
+from pathlib import Path
+
+from boto_session_manager import BotoSesManager
+from sakura_site_msav.project.define import Project
+from sakura_site_msav.constants import LangCodeEnum
+
+DEFAULT_LANG_CODE_LIST = [
+    LangCodeEnum.cn.value,
+]
+
+
+def new_project(
+    lang_code_list: list[str] | None = None,
+) -> Project:
+    """
+    Create the crawl project. The Cloudflare R2 credentials are read from
+    ``CLOUDFLARE_R2_*`` environment variables.
+    """
+    if lang_code_list is None:
+        lang_code_list = list(DEFAULT_LANG_CODE_LIST)
+    return Project(
+        dir_root_str=str(Path.home().joinpath(".projects", "sakura_site_msav")),
+        snapshot_md5=None,
+        lang_code_list=lang_code_list,
+        aws_profile=None,
+        aws_region="us-east-1",
+        s3uri_root="s3://bmt-app-dev-us-east-1/projects/sakura_site_msav/",
+        cloudflare_r2_endpoint=os.environ["CLOUDFLARE_R2_ENDPOINT"],
+        cloudflare_r2_access_key=os.environ["CLOUDFLARE_R2_ACCESS_KEY"],
+        cloudflare_r2_secret_key=os.environ["CLOUDFLARE_R2_SECRET_KEY"],
+        dir_library_str=str(Path.home().joinpath("library")),
+    )
+
+
+def new_bsm_dev() -> BotoSesManager:
+    """
+    Create the boto session for the dev AWS account from ``DEV_ACC_AWS_*``
+    environment variables.
+    """
+    return BotoSesManager(
+        aws_access_key_id=os.environ["DEV_ACC_AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=os.environ["DEV_ACC_AWS_SECRET_ACCESS_KEY"],
+        region_name=os.environ["DEV_ACC_AWS_REGION"],
+    )
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Token bucket rate limiter.
+"""
+
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    A classic token bucket. ``rate`` tokens are added per second, up to
+    ``capacity`` tokens can be saved for bursts.
+
+    :meth:`reserve` never blocks, it takes the tokens (the balance may go
+    negative) and tells the caller how long to wait before using them. This
+    keeps the limiter usable from both threads and coroutines, and callers
+    are served in FIFO order.
+
+    :param rate: tokens per second.
+    :param capacity: max number of tokens, defaults to ``rate`` (one second
+        worth of burst).
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+    ):
+        if rate <= 0:
+            raise ValueError("rate has to be positive")
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._last) * self.rate,
+        )
+        self._last = now
+
+    def reserve(self, n: float = 1) -> float:
+        """
+        Take ``n`` tokens.
+
+        :return: number of seconds the caller has to wait before it may act.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= n
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_acquire(self, n: float = 1) -> bool:
+        """
+        Take ``n`` tokens only if they are available right now.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def acquire(self, n: float = 1):
+        """
+        Block the current thread until ``n`` tokens are granted.
+        """
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, n: float = 1):
+        """
+        Coroutine version of :meth:`acquire`.
+        """
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact in-memory store of video detail records.
+
+A list of per-video dicts costs several hundred bytes per record before any
+payload: the dict, a boxed object per value, a separate str object per tag.
+:class:`RecordStore` keeps the records as columns instead (struct of
+arrays):
+
+- ``int`` / ``float`` / ``bool``: one ``array`` of machine values.
+- ``str``: the utf-8 bytes of all values in one ``bytearray`` plus an
+  ``array("q")`` of offsets, for high cardinality text such as titles.
+- ``category``: interned strings, each distinct value is stored once and the
+  column is an ``array("i")`` of codes, for lang codes, uploaders and so on.
+- ``category_list``: lists of interned strings, e.g. tags.
+
+Every column has a validity bitmap, so missing values are ``None``.
+
+Iterating the store yields :class:`RecordView` objects, a read-only
+:class:`~collections.abc.Mapping` over one row that doesn't copy anything
+until a field is read, so the status tracker, the snapshot diff and the
+exporters take them where they take dicts. :meth:`RecordStore.to_arrow`
+hands the column buffers to pyarrow without converting rows, which is what
+:func:`~sakura_gather.parquet_snapshot.write_snapshot` uses.
+
+.. code-block:: python
+
+    store = RecordStore(
+        {
+            "video_id": "str",
+            "title": "str",
+            "duration": "int",
+            "tags": "category_list",
+            "lang_code": "category",
+            "shard": "int",
+        }
+    )
+    store.extend(parsed_records)
+    write_snapshot(store, dir_snapshot)
+"""
+
+import typing as T
+import sys
+from array import array
+from collections.abc import Mapping
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import pyarrow as pa
+
+
+class _Column:
+    kind: str
+
+    def __init__(self):
+        self.n = 0
+        self.null_count = 0
+        self.validity = bytearray()
+
+    def _append_valid(self, is_valid: bool):
+        i = self.n
+        if i % 8 == 0:
+            self.validity.append(0)
+        if is_valid:
+            self.validity[i >> 3] |= 1 << (i & 7)
+        else:
+            self.null_count += 1
+        self.n += 1
+
+    def is_valid(self, i: int) -> bool:
+        return bool(self.validity[i >> 3] & (1 << (i & 7)))
+
+    def convert(self, value: T.Any) -> T.Any:  # pragma: no cover
+        """
+        Check a value and convert it to what :meth:`append_converted` takes,
+        without changing the column.
+
+        :raises TypeError: if the value doesn't fit the column.
+        """
+        raise NotImplementedError
+
+    def append_converted(self, value: T.Any):  # pragma: no cover
+        raise NotImplementedError
+
+    def append(self, value: T.Any):
+        self.append_converted(self.convert(value))
+
+    def get(self, i: int) -> T.Any:  # pragma: no cover
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:  # pragma: no cover
+        raise NotImplementedError
+
+    def _validity_buffer(self, pa):
+        return None if self.null_count == 0 else pa.py_buffer(self.validity)
+
+    def to_arrow(self, pa) -> "pa.Array":  # pragma: no cover
+        raise NotImplementedError
+
+
+class _NumberColumn(_Column):
+    typecode: str
+    default: T.Any
+
+    def __init__(self):
+        super().__init__()
+        self.values = array(self.typecode)
+
+    def convert(self, value: T.Any) -> T.Any:
+        if value is None:
+            return None
+        # raises on a wrong type or an out of range value
+        return array(self.typecode, [value])
+
+    def append_converted(self, value: T.Any):
+        self._append_valid(value is not None)
+        if value is None:
+            self.values.append(self.default)
+        else:
+            self.values.extend(value)
+
+    def get(self, i: int) -> T.Any:
+        if not self.is_valid(i):
+            return None
+        return self.values[i]
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values) + len(self.validity)
+
+    def _arrow_type(self, pa):  # pragma: no cover
+        raise NotImplementedError
+
+    def to_arrow(self, pa) -> "pa.Array":
+        return pa.Array.from_buffers(
+            self._arrow_type(pa),
+            self.n,
+            [self._validity_buffer(pa), pa.py_buffer(self.values)],
+            null_count=self.null_count,
+        )
+
+
+class IntColumn(_NumberColumn):
+    kind = "int"
+    typecode = "q"
+    default = 0
+
+    def _arrow_type(self, pa):
+        return pa.int64()
+
+
+class FloatColumn(_NumberColumn):
+    kind = "float"
+    typecode = "d"
+    default = 0.0
+
+    def _arrow_type(self, pa):
+        return pa.float64()
+
+
+class BoolColumn(_NumberColumn):
+    kind = "bool"
+    typecode = "b"
+    default = False
+
+    def get(self, i: int) -> T.Any:
+        value = super().get(i)
+        return None if value is None else bool(value)
+
+    def to_arrow(self, pa) -> "pa.Array":
+        # arrow booleans are bit packed, not bytes
+        return pa.Array.from_buffers(
+            pa.int8(),
+            self.n,
+            [self._validity_buffer(pa), pa.py_buffer(self.values)],
+            null_count=self.null_count,
+        ).cast(pa.bool_())
+
+
+class StrColumn(_Column):
+    kind = "str"
+
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def convert(self, value: T.Any) -> T.Any:
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            raise TypeError(f"expect str, got {value!r}")
+        return value.encode("utf-8")
+
+    def append_converted(self, value: T.Any):
+        self._append_valid(value is not None)
+        if value is not None:
+            self.data += value
+        self.offsets.append(len(self.data))
+
+    def get(self, i: int) -> T.Any:
+        if not self.is_valid(i):
+            return None
+        return self.data[self.offsets[i] : self.offsets[i + 1]].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + 8 * len(self.offsets) + len(self.validity)
+
+    def to_arrow(self, pa) -> "pa.Array":
+        return pa.Array.from_buffers(
+            pa.large_string(),
+            self.n,
+            [
+                self._validity_buffer(pa),
+                pa.py_buffer(self.offsets),
+                pa.py_buffer(self.data),
+            ],
+            null_count=self.null_count,
+        )
+
+
+class _Dictionary:
+    """
+    Interned strings, shared by the columns of a store.
+    """
+
+    def __init__(self):
+        self.values: list[str] = list()
+        self.codes: dict[str, int] = dict()
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            value = sys.intern(value)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(value) for value in self.values)
+
+
+class CategoryColumn(_Column):
+    kind = "category"
+
+    def __init__(self, dictionary: _Dictionary):
+        super().__init__()
+        self.dictionary = dictionary
+        self.codes = array("i")
+
+    def convert(self, value: T.Any) -> T.Any:
+        if value is not None and not isinstance(value, str):
+            raise TypeError(f"expect str, got {value!r}")
+        return value
+
+    def append_converted(self, value: T.Any):
+        self._append_valid(value is not None)
+        self.codes.append(0 if value is None else self.dictionary.encode(value))
+
+    def get(self, i: int) -> T.Any:
+        if not self.is_valid(i):
+            return None
+        return self.dictionary.values[self.codes[i]]
+
+    @property
+    def nbytes(self) -> int:
+        return 4 * len(self.codes) + len(self.validity)
+
+    def to_arrow(self, pa) -> "pa.Array":
+        indices = pa.Array.from_buffers(
+            pa.int32(),
+            self.n,
+            [self._validity_buffer(pa), pa.py_buffer(self.codes)],
+            null_count=self.null_count,
+        )
+        return pa.DictionaryArray.from_arrays(
+            indices,
+            pa.array(self.dictionary.values, type=pa.string()),
+        )
+
+
+class CategoryListColumn(_Column):
+    kind = "category_list"
+
+    def __init__(self, dictionary: _Dictionary):
+        super().__init__()
+        self.dictionary = dictionary
+        self.codes = array("i")
+        self.offsets = array("q", [0])
+
+    def convert(self, value: T.Any) -> T.Any:
+        if value is None:
+            return None
+        if isinstance(value, str):
+            raise TypeError(f"expect a list of str, got {value!r}")
+        value = list(value)
+        for v in value:
+            if not isinstance(v, str):
+                raise TypeError(f"expect a list of str, got {value!r}")
+        return value
+
+    def append_converted(self, value: T.Any):
+        self._append_valid(value is not None)
+        if value is not None:
+            encode = self.dictionary.encode
+            self.codes.extend(encode(v) for v in value)
+        self.offsets.append(len(self.codes))
+
+    def get(self, i: int) -> T.Any:
+        if not self.is_valid(i):
+            return None
+        values = self.dictionary.values
+        return [
+            values[code] for code in self.codes[self.offsets[i] : self.offsets[i + 1]]
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        return 4 * len(self.codes) + 8 * len(self.offsets) + len(self.validity)
+
+    def to_arrow(self, pa) -> "pa.Array":
+        child = pa.DictionaryArray.from_arrays(
+            pa.Array.from_buffers(
+                pa.int32(),
+                len(self.codes),
+                [None, pa.py_buffer(self.codes)],
+            ),
+            pa.array(self.dictionary.values, type=pa.string()),
+        )
+        return pa.Array.from_buffers(
+            pa.large_list(child.type),
+            self.n,
+            [self._validity_buffer(pa), pa.py_buffer(self.offsets)],
+            null_count=self.null_count,
+            children=[child],
+        )
+
+
+_COLUMN_CLASSES = {
+    cls.kind: cls
+    for cls in [IntColumn, FloatColumn, BoolColumn, StrColumn]
+}
+_DICTIONARY_COLUMN_CLASSES = {
+    cls.kind: cls for cls in [CategoryColumn, CategoryListColumn]
+}
+
+
+class RecordView(Mapping):
+    """
+    Read-only view of one row of a :class:`RecordStore`.
+    """
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: "RecordStore", index: int):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key: str) -> T.Any:
+        return self._store.columns[key].get(self._index)
+
+    def __getattr__(self, key: str) -> T.Any:
+        try:
+            return self._store.columns[key].get(self._index)
+        except KeyError:
+            raise AttributeError(key)
+
+    def __iter__(self) -> T.Iterator[str]:
+        return iter(self._store.columns)
+
+    def __len__(self) -> int:
+        return len(self._store.columns)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return {
+            name: column.get(self._index)
+            for name, column in self._store.columns.items()
+        }
+
+    def __repr__(self) -> str:
+        return f"RecordView({self.to_dict()!r})"
+
+
+class RecordStore:
+    """
+    :param schema: field name -> kind, one of ``int``, ``float``, ``bool``,
+        ``str``, ``category``, ``category_list``.
+
+    Don't append while arrays returned by :meth:`to_arrow` are alive, they
+    share the column buffers and python refuses to resize an exported buffer.
+    """
+
+    def __init__(self, schema: dict[str, str]):
+        self.schema = dict(schema)
+        self.dictionary = _Dictionary()
+        self.columns: dict[str, _Column] = dict()
+        for name, kind in self.schema.items():
+            if kind in _COLUMN_CLASSES:
+                self.columns[name] = _COLUMN_CLASSES[kind]()
+            elif kind in _DICTIONARY_COLUMN_CLASSES:
+                self.columns[name] = _DICTIONARY_COLUMN_CLASSES[kind](self.dictionary)
+            else:
+                raise ValueError(f"unknown kind {kind!r} of field {name!r}")
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def append(self, record: T.Mapping[str, T.Any]):
+        """
+        Append one record, missing fields are ``None``.
+
+        :raises ValueError: if the record has a field that is not in the
+            schema.
+        :raises TypeError: if a value doesn't fit its column, the store is
+            left unchanged.
+        """
+        for key in record:
+            if key not in self.columns:
+                raise ValueError(f"field {key!r} is not in the schema")
+        # convert every value first, so a bad one leaves no column longer
+        # than the others
+        values = [
+            (column, column.convert(record.get(name)))
+            for name, column in self.columns.items()
+        ]
+        for column, value in values:
+            column.append_converted(value)
+        self._n += 1
+
+    def extend(self, records: T.Iterable[T.Mapping[str, T.Any]]):
+        for record in records:
+            self.append(record)
+
+    def __getitem__(self, index: int) -> RecordView:
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError(index)
+        return RecordView(self, index)
+
+    def __iter__(self) -> T.Iterator[RecordView]:
+        for i in range(self._n):
+            yield RecordView(self, i)
+
+    def column(self, name: str) -> list[T.Any]:
+        """
+        All values of one field.
+        """
+        column = self.columns[name]
+        return [column.get(i) for i in range(self._n)]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes used by the column buffers and the interned strings.
+        """
+        return sum(c.nbytes for c in self.columns.values()) + self.dictionary.nbytes
+
+    def to_arrow(self) -> "pa.RecordBatch":
+        """
+        The store as one arrow record batch, numeric, string and code buffers
+        are shared, not copied.
+        """
+        import pyarrow as pa
+
+        return pa.RecordBatch.from_arrays(
+            [column.to_arrow(pa) for column in self.columns.values()],
+            names=list(self.columns),
+        )
+
+    def iter_record_batches(self, batch_size: int) -> T.Iterator["pa.RecordBatch"]:
+        """
+        Zero-copy slices of :meth:`to_arrow`.
+        """
+        batch = self.to_arrow()
+        for offset in range(0, self._n, batch_size):
+            yield batch.slice(offset, batch_size)
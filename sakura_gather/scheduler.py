@@ -0,0 +1,781 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lease based work-stealing scheduler.
+
+``RoundRobinManager`` hands a whole HTML database to one node, and
+``reset_lock=True`` can clobber a run that is still alive. Here the work is
+split into fine grained :class:`Shard` (a ``[start, end)`` range of entries in
+one unit of work, e.g. one HTML database), and every shard is owned through a
+heartbeated lease that expires:
+
+- a worker takes a free or expired shard with :meth:`WorkStealingScheduler.next_shard`,
+- before processing a step it claims it with :meth:`WorkStealingScheduler.claim`.
+  ``Shard.cursor`` is the claimed-until position, nothing before it is split
+  off and given to someone else while the lease is alive,
+- after processing the step it commits it with :meth:`WorkStealingScheduler.commit`.
+  ``Shard.committed`` is the processed-until position. When a lease expires,
+  e.g. because its worker died, the next owner resumes at ``committed``, not
+  at ``cursor``, so a claimed but unprocessed range is never skipped. A range
+  may be processed twice, never zero times,
+- claims and commits renew the lease, :func:`run_worker` also renews it from
+  a heartbeat thread, so a step that runs longer than the lease ttl doesn't
+  lose it,
+- when nothing is free, an idle worker splits the leased shard with the most
+  unclaimed work in half and takes the second half. The victim learns its new,
+  smaller ``end`` on its next claim.
+
+:func:`simulate_makespan` runs the real scheduler against N simulated workers
+with a simulated clock, to measure makespan with and without stealing.
+"""
+
+import typing as T
+import time
+import heapq
+import random
+import threading
+import dataclasses
+
+from .exc import LeaseLostError
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_dynamodb.client import DynamoDBClient
+
+
+def make_shard_id(unit: str, start: int) -> str:
+    # shards of a unit never overlap, so the start position is unique
+    return f"{unit}@{start}"
+
+
+@dataclasses.dataclass
+class Shard:
+    """
+    A ``[start, end)`` range of entries in one unit of work.
+
+    :param cursor: entries before the cursor are claimed by the owner.
+    :param committed: entries before it are processed, never after
+        ``cursor``.
+    """
+
+    unit: str
+    start: int
+    end: int
+    cursor: int = -1
+    committed: int = -1
+    owner: str | None = None
+    lease_expire: float = 0.0
+    done: bool = False
+
+    def __post_init__(self):
+        if self.committed < 0:
+            self.committed = self.start
+        if self.cursor < 0:
+            self.cursor = self.committed
+
+    @property
+    def shard_id(self) -> str:
+        return make_shard_id(self.unit, self.start)
+
+    @property
+    def remaining(self) -> int:
+        """
+        Entries not claimed yet.
+        """
+        return max(0, self.end - self.cursor)
+
+    @property
+    def unprocessed(self) -> int:
+        """
+        Entries not committed yet, what a new owner has to do.
+        """
+        return max(0, self.end - self.committed)
+
+    def is_free(self, now: float) -> bool:
+        return self.owner is None or self.lease_expire < now
+
+
+def make_shards(
+    units: dict[str, int],
+    shard_size: int,
+) -> list[Shard]:
+    """
+    :param units: unit name to number of entries.
+    :param shard_size: max number of entries per shard.
+    """
+    shards = list()
+    for unit, n_entry in units.items():
+        for start in range(0, n_entry, shard_size):
+            shards.append(
+                Shard(unit=unit, start=start, end=min(start + shard_size, n_entry))
+            )
+    return shards
+
+
+class ShardStore(T.Protocol):
+    """
+    The shared state of all shards. Every method must be atomic.
+    """
+
+    def add_shards(self, shards: T.Iterable[Shard]): ...
+
+    def list_shards(self) -> list[Shard]: ...
+
+    def acquire(
+        self,
+        shard_id: str,
+        owner: str,
+        ttl: float,
+        now: float,
+    ) -> Shard | None:
+        """
+        Lease the shard, a new owner resumes at the committed position.
+        """
+        ...
+
+    def claim(
+        self,
+        shard_id: str,
+        owner: str,
+        cursor: int,
+        ttl: float,
+        now: float,
+    ) -> Shard: ...
+
+    def commit(
+        self,
+        shard_id: str,
+        owner: str,
+        committed: int,
+        ttl: float,
+        now: float,
+    ) -> Shard: ...
+
+    def heartbeat(
+        self,
+        shard_id: str,
+        owner: str,
+        ttl: float,
+        now: float,
+    ) -> Shard: ...
+
+    def split(self, shard_id: str, at: int) -> Shard | None: ...
+
+    def complete(self, shard_id: str, owner: str): ...
+
+
+class InMemoryShardStore:
+    """
+    Thread safe, in-process :class:`ShardStore`. Good for a single multi
+    threaded process and for simulations.
+    """
+
+    def __init__(self):
+        self._shards: dict[str, Shard] = dict()
+        self._lock = threading.Lock()
+
+    def add_shards(self, shards: T.Iterable[Shard]):
+        with self._lock:
+            for shard in shards:
+                self._shards[shard.shard_id] = dataclasses.replace(shard)
+
+    def list_shards(self) -> list[Shard]:
+        with self._lock:
+            return [dataclasses.replace(shard) for shard in self._shards.values()]
+
+    def acquire(self, shard_id, owner, ttl, now):
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.done or not (shard.is_free(now) or shard.owner == owner):
+                return None
+            if shard.owner != owner:
+                shard.cursor = shard.committed
+            shard.owner = owner
+            shard.lease_expire = now + ttl
+            return dataclasses.replace(shard)
+
+    def claim(self, shard_id, owner, cursor, ttl, now):
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.owner != owner or shard.done:
+                raise LeaseLostError([shard_id])
+            shard.cursor = max(shard.cursor, min(cursor, shard.end))
+            shard.lease_expire = now + ttl
+            return dataclasses.replace(shard)
+
+    def commit(self, shard_id, owner, committed, ttl, now):
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.owner != owner or shard.done:
+                raise LeaseLostError([shard_id])
+            shard.committed = max(shard.committed, min(committed, shard.cursor))
+            shard.lease_expire = now + ttl
+            return dataclasses.replace(shard)
+
+    def heartbeat(self, shard_id, owner, ttl, now):
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.owner != owner or shard.done:
+                raise LeaseLostError([shard_id])
+            shard.lease_expire = now + ttl
+            return dataclasses.replace(shard)
+
+    def split(self, shard_id, at):
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.done or not (shard.cursor < at < shard.end):
+                return None
+            new_shard = Shard(unit=shard.unit, start=at, end=shard.end)
+            shard.end = at
+            self._shards[new_shard.shard_id] = new_shard
+            return dataclasses.replace(new_shard)
+
+    def complete(self, shard_id, owner):
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.owner != owner:
+                raise LeaseLostError([shard_id])
+            shard.done = True
+            shard.owner = None
+
+
+SHARD_POOL_INDEX_NAME = "shard_pool-index"
+
+
+class DynamoDBShardStore:
+    """
+    :class:`ShardStore` backed by the status tracking table, one item per
+    shard. Every transition is a single conditional write.
+
+    Shard items carry a ``shard_pool`` attribute, the partition key of a
+    sparse global secondary index, so :meth:`list_shards` is a ``Query`` of
+    the shards of one pool instead of a ``Scan`` of the whole table. Add the
+    index to the table once:
+
+    .. code-block:: python
+
+        client.update_table(
+            TableName="sakura_status_tracking",
+            AttributeDefinitions=[{"AttributeName": "shard_pool", "AttributeType": "S"}],
+            GlobalSecondaryIndexUpdates=[
+                {
+                    "Create": {
+                        "IndexName": "shard_pool-index",
+                        "KeySchema": [{"AttributeName": "shard_pool", "KeyType": "HASH"}],
+                        "Projection": {"ProjectionType": "ALL"},
+                    }
+                }
+            ],
+        )
+
+    :param key_name: the table's hash key, the shard id is stored in it.
+    :param pool: the shard set, e.g. one per crawl run, stores of different
+        pools share the table without seeing each other's shards.
+    :param index_name: the ``shard_pool`` index.
+    """
+
+    def __init__(
+        self,
+        client: "DynamoDBClient",
+        table_name: str,
+        key_name: str = "id",
+        pool: str = "default",
+        index_name: str = SHARD_POOL_INDEX_NAME,
+    ):
+        from .status_tracking import serialize, deserialize
+
+        self.client = client
+        self.table_name = table_name
+        self.key_name = key_name
+        self.pool = pool
+        self.index_name = index_name
+        self._serialize = serialize
+        self._deserialize = deserialize
+
+    def _key(self, shard_id: str) -> dict:
+        return self._serialize({self.key_name: shard_id})
+
+    def _to_item(self, shard: Shard) -> dict:
+        item = {
+            self.key_name: shard.shard_id,
+            "shard_pool": self.pool,
+            "shard_unit": shard.unit,
+            "shard_start": shard.start,
+            "shard_end": shard.end,
+            "shard_cursor": shard.cursor,
+            "shard_committed": shard.committed,
+            "shard_done": shard.done,
+            "lease_expire": int(shard.lease_expire),
+        }
+        if shard.owner is not None:
+            item["lease_owner"] = shard.owner
+        return self._serialize(item)
+
+    def _to_shard(self, raw: dict) -> Shard:
+        item = self._deserialize(raw)
+        return Shard(
+            unit=item["shard_unit"],
+            start=int(item["shard_start"]),
+            end=int(item["shard_end"]),
+            cursor=int(item["shard_cursor"]),
+            committed=int(item["shard_committed"]),
+            owner=item.get("lease_owner"),
+            lease_expire=float(item.get("lease_expire", 0)),
+            done=item["shard_done"],
+        )
+
+    def add_shards(self, shards: T.Iterable[Shard]):
+        for shard in shards:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=self._to_item(shard),
+            )
+
+    def list_shards(self) -> list[Shard]:
+        # a GSI read is eventually consistent, that's fine, every transition
+        # is a conditional write on the item itself
+        shards = list()
+        kwargs = dict(
+            TableName=self.table_name,
+            IndexName=self.index_name,
+            KeyConditionExpression="shard_pool = :pool",
+            ExpressionAttributeValues=self._serialize({":pool": self.pool}),
+        )
+        while True:
+            res = self.client.query(**kwargs)
+            shards.extend(self._to_shard(raw) for raw in res.get("Items", []))
+            if "LastEvaluatedKey" not in res:
+                return shards
+            kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+    def _update(self, shard_id: str, **kwargs) -> Shard | None:
+        try:
+            res = self.client.update_item(
+                TableName=self.table_name,
+                Key=self._key(shard_id),
+                ReturnValues="ALL_NEW",
+                **kwargs,
+            )
+            return self._to_shard(res["Attributes"])
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return None
+
+    def acquire(self, shard_id, owner, ttl, now):
+        current = self._get(shard_id)
+        if current.owner == owner:
+            return self._update(
+                shard_id,
+                UpdateExpression="SET lease_expire = :expire",
+                ConditionExpression="shard_done = :false AND lease_owner = :owner",
+                ExpressionAttributeValues=self._serialize(
+                    {":owner": owner, ":expire": int(now + ttl), ":false": False}
+                ),
+            )
+        # a new owner rewinds the cursor to the committed position, the
+        # condition on it makes sure no commit came in between
+        return self._update(
+            shard_id,
+            UpdateExpression=(
+                "SET lease_owner = :owner, lease_expire = :expire, "
+                "shard_cursor = :committed"
+            ),
+            ConditionExpression=(
+                "shard_done = :false AND shard_committed = :committed "
+                "AND (attribute_not_exists(lease_owner) OR lease_expire < :now)"
+            ),
+            ExpressionAttributeValues=self._serialize(
+                {
+                    ":owner": owner,
+                    ":expire": int(now + ttl),
+                    ":now": int(now),
+                    ":committed": current.committed,
+                    ":false": False,
+                }
+            ),
+        )
+
+    def claim(self, shard_id, owner, cursor, ttl, now):
+        # the cursor never goes back and never goes beyond end, an update
+        # expression can't do min / max, so read the end first
+        current = self._get(shard_id)
+        cursor = max(current.cursor, min(cursor, current.end))
+        shard = self._update(
+            shard_id,
+            UpdateExpression="SET shard_cursor = :cursor, lease_expire = :expire",
+            ConditionExpression=(
+                "lease_owner = :owner AND shard_done = :false "
+                "AND shard_end = :end AND shard_cursor <= :cursor"
+            ),
+            ExpressionAttributeValues=self._serialize(
+                {
+                    ":owner": owner,
+                    ":cursor": cursor,
+                    ":end": current.end,
+                    ":expire": int(now + ttl),
+                    ":false": False,
+                }
+            ),
+        )
+        if shard is None:
+            if current.owner == owner and not current.done:
+                # the shard was split in between, try again with the new end
+                return self.claim(shard_id, owner, cursor, ttl, now)
+            raise LeaseLostError([shard_id])
+        return shard
+
+    def commit(self, shard_id, owner, committed, ttl, now):
+        # same as claim, committed never goes back and never passes cursor
+        current = self._get(shard_id)
+        committed = max(current.committed, min(committed, current.cursor))
+        shard = self._update(
+            shard_id,
+            UpdateExpression="SET shard_committed = :committed, lease_expire = :expire",
+            ConditionExpression=(
+                "lease_owner = :owner AND shard_done = :false "
+                "AND shard_committed <= :committed AND shard_cursor >= :committed"
+            ),
+            ExpressionAttributeValues=self._serialize(
+                {
+                    ":owner": owner,
+                    ":committed": committed,
+                    ":expire": int(now + ttl),
+                    ":false": False,
+                }
+            ),
+        )
+        if shard is None:
+            raise LeaseLostError([shard_id])
+        return shard
+
+    def heartbeat(self, shard_id, owner, ttl, now):
+        shard = self._update(
+            shard_id,
+            UpdateExpression="SET lease_expire = :expire",
+            ConditionExpression="lease_owner = :owner AND shard_done = :false",
+            ExpressionAttributeValues=self._serialize(
+                {":owner": owner, ":expire": int(now + ttl), ":false": False}
+            ),
+        )
+        if shard is None:
+            raise LeaseLostError([shard_id])
+        return shard
+
+    def _get(self, shard_id: str) -> Shard:
+        res = self.client.get_item(
+            TableName=self.table_name,
+            Key=self._key(shard_id),
+            ConsistentRead=True,
+        )
+        return self._to_shard(res["Item"])
+
+    def split(self, shard_id, at):
+        # cut the victim and create the new shard in one transaction, so the
+        # stolen range can never be lost in between
+        shard = self._get(shard_id)
+        if shard.done or not (shard.cursor < at < shard.end):
+            return None
+        new_shard = Shard(unit=shard.unit, start=at, end=shard.end)
+        try:
+            self.client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Update": {
+                            "TableName": self.table_name,
+                            "Key": self._key(shard_id),
+                            "UpdateExpression": "SET shard_end = :at",
+                            "ConditionExpression": (
+                                "shard_done = :false AND shard_cursor < :at "
+                                "AND shard_end = :end"
+                            ),
+                            "ExpressionAttributeValues": self._serialize(
+                                {":at": at, ":end": shard.end, ":false": False}
+                            ),
+                        }
+                    },
+                    {
+                        "Put": {
+                            "TableName": self.table_name,
+                            "Item": self._to_item(new_shard),
+                            "ConditionExpression": "attribute_not_exists(#key)",
+                            "ExpressionAttributeNames": {"#key": self.key_name},
+                        }
+                    },
+                ]
+            )
+        except self.client.exceptions.TransactionCanceledException:
+            return None
+        return new_shard
+
+    def complete(self, shard_id, owner):
+        shard = self._update(
+            shard_id,
+            UpdateExpression="SET shard_done = :true REMOVE lease_owner",
+            ConditionExpression="lease_owner = :owner",
+            ExpressionAttributeValues=self._serialize(
+                {":owner": owner, ":true": True}
+            ),
+        )
+        if shard is None:
+            raise LeaseLostError([shard_id])
+
+
+class WorkStealingScheduler:
+    """
+    The per-worker view of a :class:`ShardStore`.
+
+    :param owner: unique id of this worker.
+    :param lease_ttl: seconds a lease lives without a claim.
+    :param min_steal_size: don't split a shard if each half would get fewer
+        entries than this.
+    """
+
+    def __init__(
+        self,
+        store: ShardStore,
+        owner: str,
+        lease_ttl: float = 300.0,
+        min_steal_size: int = 1,
+        clock: T.Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.min_steal_size = min_steal_size
+        self.clock = clock
+        self.n_steal = 0
+
+    def next_shard(self, steal: bool = True) -> Shard | None:
+        """
+        Lease a free or expired shard, or steal half of the biggest leased
+        one.
+
+        :return: the leased shard, ``None`` if there is nothing left to do.
+        """
+        now = self.clock()
+        shards = [
+            shard
+            for shard in self.store.list_shards()
+            if not shard.done and shard.unprocessed > 0
+        ]
+        # prefer the biggest free shard, it needs the longest time
+        free_shards = sorted(
+            [shard for shard in shards if shard.is_free(now)],
+            key=lambda shard: shard.unprocessed,
+            reverse=True,
+        )
+        for shard in free_shards:
+            leased = self.store.acquire(shard.shard_id, self.owner, self.lease_ttl, now)
+            if leased is not None:
+                return leased
+        if not steal:
+            return None
+        victims = sorted(
+            [
+                shard
+                for shard in shards
+                if shard.owner != self.owner
+                and shard.remaining >= 2 * self.min_steal_size
+            ],
+            key=lambda shard: shard.remaining,
+            reverse=True,
+        )
+        for victim in victims:
+            at = victim.cursor + (victim.remaining + 1) // 2
+            new_shard = self.store.split(victim.shard_id, at)
+            if new_shard is None:
+                continue
+            leased = self.store.acquire(
+                new_shard.shard_id, self.owner, self.lease_ttl, now
+            )
+            if leased is not None:
+                self.n_steal += 1
+                return leased
+        return None
+
+    def claim(self, shard: Shard, n: int) -> tuple[Shard, int, int]:
+        """
+        Claim the next ``n`` entries of a leased shard and renew the lease.
+
+        :return: the refreshed shard, and the ``[start, end)`` range to
+            process, the range is empty when the shard is finished.
+        """
+        start = shard.cursor
+        shard = self.store.claim(
+            shard.shard_id,
+            self.owner,
+            shard.cursor + n,
+            self.lease_ttl,
+            self.clock(),
+        )
+        return shard, min(start, shard.cursor), shard.cursor
+
+    def commit(self, shard: Shard, end: int) -> Shard:
+        """
+        Mark the entries before ``end`` as processed and renew the lease.
+        """
+        return self.store.commit(
+            shard.shard_id,
+            self.owner,
+            end,
+            self.lease_ttl,
+            self.clock(),
+        )
+
+    def heartbeat(self, shard: Shard) -> Shard:
+        """
+        Renew the lease without moving the cursors.
+        """
+        return self.store.heartbeat(
+            shard.shard_id,
+            self.owner,
+            self.lease_ttl,
+            self.clock(),
+        )
+
+    def complete(self, shard: Shard):
+        self.store.complete(shard.shard_id, self.owner)
+
+
+class _Heartbeat:
+    """
+    Renew the lease of a shard every ``interval`` seconds in a daemon thread,
+    until the ``with`` block exits or the lease is lost.
+    """
+
+    def __init__(
+        self,
+        scheduler: WorkStealingScheduler,
+        shard: Shard,
+        interval: float,
+    ):
+        self.scheduler = scheduler
+        self.shard = shard
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.scheduler.heartbeat(self.shard)
+            except LeaseLostError:
+                return  # the next commit reports it
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(
+    scheduler: WorkStealingScheduler,
+    process_func: T.Callable[[str, int, int], T.Any],
+    step: int = 1,
+    heartbeat_interval: float | None = None,
+) -> int:
+    """
+    Process shards until there is nothing left. A shard whose lease is lost
+    is dropped, its next owner resumes at the last commit.
+
+    :param process_func: ``process_func(unit, start, end)`` processes the
+        ``[start, end)`` entries of a unit.
+    :param heartbeat_interval: seconds between lease renewals while
+        ``process_func`` runs, defaults to a third of the lease ttl.
+    :return: number of processed entries.
+    """
+    if heartbeat_interval is None:
+        heartbeat_interval = scheduler.lease_ttl / 3
+    n_processed = 0
+    while True:
+        shard = scheduler.next_shard()
+        if shard is None:
+            return n_processed
+        try:
+            while True:
+                shard, start, end = scheduler.claim(shard, step)
+                if start >= end:
+                    break
+                with _Heartbeat(scheduler, shard, heartbeat_interval):
+                    process_func(shard.unit, start, end)
+                shard = scheduler.commit(shard, end)
+                n_processed += end - start
+            scheduler.complete(shard)
+        except LeaseLostError:
+            continue
+
+
+@dataclasses.dataclass
+class SimulationResult:
+    makespan: float
+    n_steal: int
+    n_processed: list[int]
+
+
+def simulate_makespan(
+    n_worker: int,
+    units: dict[str, int],
+    shard_size: int,
+    worker_speeds: list[float] | None = None,
+    item_cost: float = 1.0,
+    step: int = 1,
+    steal: bool = True,
+    seed: int | None = None,
+) -> SimulationResult:
+    """
+    Run the scheduler against ``n_worker`` simulated workers and a simulated
+    clock. Every entry costs ``item_cost / speed`` seconds.
+
+    :param worker_speeds: relative speed of each worker, random in
+        ``[0.2, 1.0]`` if not given, to simulate stragglers.
+    """
+    rng = random.Random(seed)
+    if worker_speeds is None:
+        worker_speeds = [rng.uniform(0.2, 1.0) for _ in range(n_worker)]
+    now = [0.0]
+    store = InMemoryShardStore()
+    store.add_shards(make_shards(units, shard_size))
+    schedulers = [
+        WorkStealingScheduler(
+            store=store,
+            owner=f"worker-{i}",
+            lease_ttl=float("inf"),
+            clock=lambda: now[0],
+        )
+        for i in range(n_worker)
+    ]
+    current: list[Shard | None] = [None] * n_worker
+    # the end of the step in progress, committed when it's done
+    pending: list[int | None] = [None] * n_worker
+    n_processed = [0] * n_worker
+    events = [(0.0, i) for i in range(n_worker)]
+    heapq.heapify(events)
+    makespan = 0.0
+    while events:
+        t, i = heapq.heappop(events)
+        now[0] = t
+        scheduler = schedulers[i]
+        if pending[i] is not None:
+            current[i] = scheduler.commit(current[i], pending[i])
+            pending[i] = None
+        if current[i] is None:
+            current[i] = scheduler.next_shard(steal=steal)
+            if current[i] is None:
+                makespan = max(makespan, t)
+                continue
+        shard, start, end = scheduler.claim(current[i], step)
+        if start >= end:
+            scheduler.complete(shard)
+            current[i] = None
+            heapq.heappush(events, (t, i))
+            continue
+        current[i] = shard
+        pending[i] = end
+        n_processed[i] += end - start
+        heapq.heappush(events, (t + (end - start) * item_cost / worker_speeds[i], i))
+    return SimulationResult(
+        makespan=makespan,
+        n_steal=sum(scheduler.n_steal for scheduler in schedulers),
+        n_processed=n_processed,
+    )
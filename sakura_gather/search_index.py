@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local query index over crawled video details, one SQLite file.
+
+Finding "which videos match X in lang cn" in the snapshots under
+``s3uri_root`` is a full scan. :class:`SearchIndex` keeps the details in a
+SQLite database instead:
+
+- ``video``: one row per video, the record as JSON plus the columns used for
+  filtering and sorting, with indexes on ``(lang_code, release_date)``.
+- ``video_fts``: an FTS5 full text index of the title, tags and performers,
+  ranked with ``bm25``.
+- ``facet``: ``(kind, value, video)`` posting lists of the tags, performers
+  and release months, a facet filter is one index range scan.
+- ``facet_count``: the number of videos per ``(kind, lang_code, value)``,
+  maintained on every write, so facet counts never scan ``facet``.
+
+Writes are upserts by ``video_id``, so feeding the same micro-batch twice,
+e.g. when a batch is retried after a crash, is harmless. Index a micro-batch
+before its commit marker is written:
+
+.. code-block:: python
+
+    index = SearchIndex(dir_root / "search-index.sqlite3")
+    run_micro_batches(
+        checkpoint_store,
+        unit_id=unit_id,
+        items=video_ids,
+        micro_batch_size=100,
+        process_func=lambda batch: index.add_many(crawl_video_details(batch)),
+    )
+    index.search("school", lang_code="cn", tags=["drama"], limit=20)
+    index.get_facet_counts("tags", lang_code="cn")
+
+:meth:`SearchIndex.ship` writes a compacted copy of the index with
+``VACUUM INTO`` and uploads it to S3 and R2, readers download it and open it
+with ``SearchIndex(path, readonly=True)`` without rescanning any snapshot.
+
+The default ``unicode61`` tokenizer splits on spaces and punctuation, which
+doesn't work for Chinese or Japanese titles, use ``tokenizer="trigram"`` for
+an index of those lang codes (queries then need at least 3 characters).
+"""
+
+import typing as T
+import json
+import sqlite3
+import tempfile
+import threading
+import dataclasses
+from pathlib import Path
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .uploader import Target, FanOutUploader, UploadStats
+
+DEFAULT_TOKENIZER = "unicode61 remove_diacritics 2"
+
+# record field -> facet kind, list valued
+LIST_FACETS = ("tags", "performers")
+# facet kind of the release month, ``YYYY-MM`` of ``release_date``
+MONTH_FACET = "release_month"
+FACET_KINDS = LIST_FACETS + (MONTH_FACET,)
+
+
+def to_match_query(query: str) -> str:
+    """
+    Turn free text into a FTS5 query that matches rows containing every
+    term. Terms are quoted, so ``"``, ``*``, ``-``, ``AND`` and so on are
+    searched for literally instead of being FTS5 syntax.
+    """
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def get_facets(record: T.Mapping[str, T.Any]) -> set[tuple[str, str]]:
+    """
+    The ``(kind, value)`` facets of one record.
+    """
+    facets = set()
+    for kind in LIST_FACETS:
+        for value in record.get(kind) or ():
+            facets.add((kind, value))
+    release_date = record.get("release_date")
+    if release_date:
+        facets.add((MONTH_FACET, str(release_date)[:7]))
+    return facets
+
+
+@dataclasses.dataclass
+class SearchResult:
+    n_total: int
+    records: list[dict[str, T.Any]]
+
+
+class SearchIndex:
+    """
+    :param path: the SQLite file, created if not exists.
+    :param tokenizer: FTS5 tokenizer of a new index, an existing index keeps
+        the one it was created with.
+    :param readonly: open a shipped index for reads only.
+
+    Thread safe, but must not be written by several processes.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        tokenizer: str = DEFAULT_TOKENIZER,
+        readonly: bool = False,
+    ):
+        self.path = Path(path)
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        if readonly:
+            self._conn = sqlite3.connect(
+                f"{self.path.absolute().as_uri()}?mode=ro&immutable=1",
+                uri=True,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.path),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS video (
+                id INTEGER PRIMARY KEY,
+                video_id TEXT NOT NULL UNIQUE,
+                lang_code TEXT,
+                release_date TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_video_lang_date
+                ON video (lang_code, release_date);
+            CREATE VIRTUAL TABLE IF NOT EXISTS video_fts USING fts5 (
+                title, tags, performers, tokenize = '{tokenizer}'
+            );
+            CREATE TABLE IF NOT EXISTS facet (
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (kind, value, id)
+            ) WITHOUT ROWID;
+            -- re-adding a record looks up and deletes its facets by id
+            CREATE INDEX IF NOT EXISTS ix_facet_id ON facet (id);
+            CREATE TABLE IF NOT EXISTS facet_count (
+                kind TEXT NOT NULL,
+                lang_code TEXT NOT NULL,
+                value TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (kind, lang_code, value)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _remove(self, id: int, lang_code: str):
+        facets = self._conn.execute(
+            "SELECT kind, value FROM facet WHERE id = ?", (id,)
+        ).fetchall()
+        self._conn.executemany(
+            "UPDATE facet_count SET n = n - 1 "
+            "WHERE kind = ? AND lang_code = ? AND value = ?",
+            [(kind, lang_code, value) for kind, value in facets],
+        )
+        self._conn.execute("DELETE FROM facet WHERE id = ?", (id,))
+        self._conn.execute("DELETE FROM video_fts WHERE rowid = ?", (id,))
+
+    def _add(self, record: T.Mapping[str, T.Any]):
+        video_id = record["video_id"]
+        lang_code = record.get("lang_code") or ""
+        release_date = record.get("release_date")
+        data = json.dumps(dict(record), ensure_ascii=False, default=str)
+        row = self._conn.execute(
+            "SELECT id, lang_code FROM video WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        if row is None:
+            id = self._conn.execute(
+                "INSERT INTO video (video_id, lang_code, release_date, data) "
+                "VALUES (?, ?, ?, ?)",
+                (video_id, lang_code, release_date, data),
+            ).lastrowid
+        else:
+            id = row[0]
+            self._remove(id, row[1])
+            self._conn.execute(
+                "UPDATE video SET lang_code = ?, release_date = ?, data = ? "
+                "WHERE id = ?",
+                (lang_code, release_date, data, id),
+            )
+        self._conn.execute(
+            "INSERT INTO video_fts (rowid, title, tags, performers) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                id,
+                record.get("title") or "",
+                " ".join(record.get("tags") or ()),
+                " ".join(record.get("performers") or ()),
+            ),
+        )
+        facets = get_facets(record)
+        self._conn.executemany(
+            "INSERT INTO facet (kind, value, id) VALUES (?, ?, ?)",
+            [(kind, value, id) for kind, value in facets],
+        )
+        self._conn.executemany(
+            "INSERT INTO facet_count (kind, lang_code, value, n) "
+            "VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (kind, lang_code, value) DO UPDATE SET n = n + 1",
+            [(kind, lang_code, value) for kind, value in facets],
+        )
+
+    def add_many(self, records: T.Iterable[T.Mapping[str, T.Any]]) -> int:
+        """
+        Insert or replace the records, by ``video_id``, in one transaction.
+
+        :return: number of records written.
+        """
+        n = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    self._add(record)
+                    n += 1
+                self._conn.execute("DELETE FROM facet_count WHERE n <= 0")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return n
+
+    def add(self, record: T.Mapping[str, T.Any]):
+        self.add_many([record])
+
+    def get(self, video_id: str) -> dict[str, T.Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM video WHERE video_id = ?", (video_id,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM video").fetchone()[0]
+
+    def search(
+        self,
+        query: str | None = None,
+        lang_code: str | None = None,
+        tags: T.Iterable[str] = (),
+        performers: T.Iterable[str] = (),
+        release_month: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> SearchResult:
+        """
+        Videos matching every given condition. With a ``query`` the best
+        ``bm25`` matches come first, otherwise the newest release first.
+
+        :param query: free text, every term must appear in the title, tags
+            or performers.
+        :param tags: the video has all these tags.
+        :param performers: the video has all these performers.
+        :param release_month: ``YYYY-MM``.
+        :param date_from: ``release_date >= date_from``, ISO format.
+        :param date_to: ``release_date <= date_to``, ISO format.
+        """
+        where = list()
+        params: list[T.Any] = list()
+        if query and query.split():
+            where.append("video_fts MATCH ?")
+            params.append(to_match_query(query))
+        if lang_code is not None:
+            where.append("video.lang_code = ?")
+            params.append(lang_code)
+        facets = [("tags", value) for value in tags]
+        facets.extend(("performers", value) for value in performers)
+        if release_month is not None:
+            facets.append((MONTH_FACET, release_month))
+        for kind, value in facets:
+            where.append(
+                "video.id IN (SELECT id FROM facet WHERE kind = ? AND value = ?)"
+            )
+            params.extend((kind, value))
+        if date_from is not None:
+            where.append("video.release_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            where.append("video.release_date <= ?")
+            params.append(date_to)
+
+        if query and query.split():
+            # CROSS JOIN keeps the full text match as the outer loop, else the
+            # planner may probe the FTS index once per video of the lang code
+            from_ = "video_fts CROSS JOIN video ON video.id = video_fts.rowid"
+            order_by = "bm25(video_fts), video.id"
+        else:
+            from_ = "video"
+            order_by = "video.release_date DESC, video.id"
+        sql_where = f" WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            n_total = self._conn.execute(
+                f"SELECT COUNT(*) FROM {from_}{sql_where}", params
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT video.data FROM {from_}{sql_where} "
+                f"ORDER BY {order_by} LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return SearchResult(
+            n_total=n_total,
+            records=[json.loads(row[0]) for row in rows],
+        )
+
+    def get_facet_counts(
+        self,
+        kind: str,
+        lang_code: str | None = None,
+        limit: int = 20,
+    ) -> list[tuple[str, int]]:
+        """
+        The most frequent values of a facet, from the precomputed counts.
+
+        :param kind: one of ``tags``, ``performers``, ``release_month``.
+        """
+        if kind not in FACET_KINDS:
+            raise ValueError(f"unknown facet {kind!r}")
+        with self._lock:
+            if lang_code is None:
+                rows = self._conn.execute(
+                    "SELECT value, SUM(n) AS total FROM facet_count "
+                    "WHERE kind = ? GROUP BY value "
+                    "ORDER BY total DESC, value LIMIT ?",
+                    (kind, limit),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT value, n FROM facet_count "
+                    "WHERE kind = ? AND lang_code = ? "
+                    "ORDER BY n DESC, value LIMIT ?",
+                    (kind, lang_code, limit),
+                ).fetchall()
+        return [(value, n) for value, n in rows]
+
+    def export(self, path: Path) -> Path:
+        """
+        Write a compacted, self contained copy of the index to ``path``,
+        a consistent snapshot even while other threads write.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        with self._lock:
+            self._conn.execute("VACUUM INTO ?", (str(path),))
+        return path
+
+    def ship(
+        self,
+        targets: list["Target"],
+        uploader: T.Optional["FanOutUploader"] = None,
+    ) -> "UploadStats":
+        """
+        Export the index and upload it to every target, e.g. S3 and R2.
+        """
+        from .uploader import FanOutUploader
+
+        if uploader is None:
+            uploader = FanOutUploader()
+        with tempfile.TemporaryDirectory() as dir_tmp:
+            path = self.export(Path(dir_tmp) / self.path.name)
+            return uploader.upload(path, targets)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process wide registry of boto3 clients.
+
+Creating a boto3 client is expensive (loading the service model, building
+the endpoint resolver), and every new client opens its own connection pool,
+so each one pays a fresh TLS handshake. :class:`SessionRegistry` creates each
+client once, with a large connection pool and TCP keep-alive, and hands the
+same instance to every thread. boto3 clients are thread safe, the session
+that creates them is not, so creation happens under a lock.
+
+.. code-block:: python
+
+    registry = SessionRegistry.from_bsm(project.bsm)
+    print(registry.who_am_i(masked=True))  # one STS call per credential lifetime
+    tracker = BatchedStatusTracker(client=registry.dynamodb, table_name=...)
+    r2 = registry.get_r2_client(endpoint, access_key, secret_key)
+"""
+
+import typing as T
+import time
+import threading
+import dataclasses
+
+import boto3
+from botocore.config import Config
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
+
+DEFAULT_MAX_POOL_CONNECTIONS = 64
+DEFAULT_IDENTITY_TTL = 3600.0
+
+
+@dataclasses.dataclass(frozen=True)
+class Identity:
+    account_id: str
+    arn: str
+    user_id: str
+
+    def to_message(self, masked: bool = True) -> str:
+        account_id = self.account_id
+        arn = self.arn
+        if masked:
+            masked_account_id = mask(account_id)
+            arn = arn.replace(account_id, masked_account_id)
+            account_id = masked_account_id
+        return f"now we are on account {account_id}, using principal {arn}"
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _config_key(config: Config | None) -> tuple | None:
+    """
+    A hashable key of the options set on a botocore ``Config``, so equal
+    configs created separately share one client.
+    """
+    if config is None:
+        return None
+    return _freeze(config._user_provided_options)
+
+
+def mask(value: str, n_keep: int = 2) -> str:
+    """
+    Keep the first and last ``n_keep`` characters, e.g. ``12********89``.
+    """
+    if len(value) <= n_keep * 2:
+        return "*" * len(value)
+    return value[:n_keep] + "*" * (len(value) - n_keep * 2) + value[-n_keep:]
+
+
+class SessionRegistry:
+    """
+    :param session: the boto3 session, a default one if not given.
+    :param max_pool_connections: HTTP connection pool size of every client,
+        should be at least the number of threads that share it.
+    :param tcp_keepalive: keep idle pooled connections alive.
+    :param identity_ttl: how long to cache the caller identity when the
+        credentials don't expire.
+    """
+
+    def __init__(
+        self,
+        session: boto3.Session | None = None,
+        max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+        tcp_keepalive: bool = True,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        max_attempts: int = 5,
+        identity_ttl: float = DEFAULT_IDENTITY_TTL,
+        clock: T.Callable[[], float] = time.time,
+    ):
+        self.session = session or boto3.Session()
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=tcp_keepalive,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={"max_attempts": max_attempts, "mode": "standard"},
+        )
+        self.identity_ttl = identity_ttl
+        self.clock = clock
+        self._clients: dict[tuple, T.Any] = dict()
+        self._lock = threading.Lock()
+        self._identity: Identity | None = None
+        self._identity_expire: float = 0.0
+        self.n_client_created = 0
+
+    @classmethod
+    def from_bsm(cls, bsm: "BotoSesManager", **kwargs) -> "SessionRegistry":
+        """
+        Share the boto session of a ``BotoSesManager``, e.g. ``project.bsm``.
+        """
+        return cls(session=bsm.boto_ses, **kwargs)
+
+    def get_client(
+        self,
+        service_name: str,
+        region_name: str | None = None,
+        endpoint_url: str | None = None,
+        aws_access_key_id: str | None = None,
+        aws_secret_access_key: str | None = None,
+        config: Config | None = None,
+    ):
+        """
+        Get the client of a service, it is created on the first call and
+        reused afterwards. Clients with a different region, endpoint or
+        credentials are separate entries.
+
+        :param config: merged on top of the registry config.
+        """
+        key = (
+            service_name,
+            region_name,
+            endpoint_url,
+            aws_access_key_id,
+            aws_secret_access_key,
+            _config_key(config),
+        )
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.session.client(
+                    service_name,
+                    region_name=region_name,
+                    endpoint_url=endpoint_url,
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    config=(
+                        self.config if config is None else self.config.merge(config)
+                    ),
+                )
+                self._clients[key] = client
+                self.n_client_created += 1
+        return client
+
+    @property
+    def s3(self):
+        return self.get_client("s3")
+
+    @property
+    def dynamodb(self):
+        return self.get_client("dynamodb")
+
+    @property
+    def sts(self):
+        return self.get_client("sts")
+
+    def get_r2_client(
+        self,
+        endpoint_url: str,
+        access_key: str,
+        secret_key: str,
+    ):
+        """
+        The S3 compatible client of a Cloudflare R2 account.
+        """
+        return self.get_client(
+            "s3",
+            region_name="auto",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=_R2_CONFIG,
+        )
+
+    def _get_credential_expire(self) -> float | None:
+        credentials = self.session.get_credentials()
+        expiry_time = getattr(credentials, "_expiry_time", None)
+        if expiry_time is None:
+            return None
+        return expiry_time.timestamp()
+
+    def get_identity(self) -> Identity:
+        """
+        The caller identity, cached until the credentials expire, or for
+        ``identity_ttl`` seconds if they don't.
+        """
+        now = self.clock()
+        with self._lock:
+            if self._identity is not None and now < self._identity_expire:
+                return self._identity
+        res = self.sts.get_caller_identity()
+        identity = Identity(
+            account_id=res["Account"],
+            arn=res["Arn"],
+            user_id=res["UserId"],
+        )
+        expire = self._get_credential_expire()
+        with self._lock:
+            self._identity = identity
+            self._identity_expire = (
+                now + self.identity_ttl if expire is None else expire
+            )
+        return identity
+
+    def who_am_i(self, masked: bool = True) -> str:
+        return self.get_identity().to_message(masked=masked)
+
+    def clear(self):
+        """
+        Drop all cached clients and the cached identity, e.g. after rotating
+        credentials.
+        """
+        with self._lock:
+            self._clients.clear()
+            self._identity = None
+            self._identity_expire = 0.0
+
+
+_R2_CONFIG = Config(signature_version="s3v4")
+
+_default_registry: SessionRegistry | None = None
+_default_lock = threading.Lock()
+
+
+def get_default_registry() -> SessionRegistry:
+    """
+    The registry of the default boto3 session, created on first use.
+    """
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = SessionRegistry()
+        return _default_registry
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental snapshot diffing.
+
+A :class:`FingerprintIndex` stores, for every video record of a snapshot, a
+64 bit hash of its key and a 64 bit hash of its content, as two parallel
+``array("Q")`` sorted by key hash (16 bytes per record). Two indexes are
+diffed with a single merge walk in ``O(n + m)``:
+
+.. code-block:: python
+
+    old = FingerprintIndex.load(path_old_index)
+    new = FingerprintIndex.from_records(records)
+    delta = diff(old, new)
+    changed = list(select_changed(records, delta))  # added or modified
+    shards = to_shards([r["video_id"] for r in changed], unit="cn-delta", shard_size=100)
+
+The shards go to the :mod:`~sakura_gather.scheduler`, so a run only fetches
+and parses the delta instead of the full HTML database.
+"""
+
+import typing as T
+import json
+import struct
+import hashlib
+import dataclasses
+from array import array
+from pathlib import Path
+
+from .scheduler import Shard, make_shards
+
+MAGIC = b"SKFPIDX1"
+HEADER = struct.Struct("<8sQ")
+
+
+def hash64(data: bytes) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(data, digest_size=8).digest(),
+        "little",
+    )
+
+
+def hash_key(key: str) -> int:
+    return hash64(key.encode("utf-8"))
+
+
+def hash_record(
+    record: T.Mapping[str, T.Any],
+    exclude_fields: T.Collection[str] = (),
+) -> int:
+    """
+    Hash of the record content, independent of the key order. Volatile
+    fields, such as the crawl time, should be excluded.
+    """
+    content = {k: v for k, v in record.items() if k not in exclude_fields}
+    return hash64(
+        json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode(
+            "utf-8"
+        )
+    )
+
+
+class FingerprintIndex:
+    """
+    Sorted ``(key hash, content hash)`` pairs of one snapshot.
+    """
+
+    def __init__(self, keys: array, digests: array):
+        if len(keys) != len(digests):
+            raise ValueError("keys and digests must have the same length")
+        self.keys = keys
+        self.digests = digests
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_pairs(cls, pairs: T.Iterable[tuple[int, int]]) -> "FingerprintIndex":
+        keys = array("Q")
+        digests = array("Q")
+        last = None
+        # sort by key only, the sort is stable, so duplicated keys stay in
+        # input order
+        for key, digest in sorted(pairs, key=lambda pair: pair[0]):
+            if key == last:  # duplicated record, the last one wins
+                digests[-1] = digest
+                continue
+            keys.append(key)
+            digests.append(digest)
+            last = key
+        return cls(keys, digests)
+
+    @classmethod
+    def from_records(
+        cls,
+        records: T.Iterable[T.Mapping[str, T.Any]],
+        key_field: str = "video_id",
+        exclude_fields: T.Collection[str] = (),
+    ) -> "FingerprintIndex":
+        return cls.from_pairs(
+            (hash_key(record[key_field]), hash_record(record, exclude_fields))
+            for record in records
+        )
+
+    def save(self, path: Path):
+        with Path(path).open("wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self)))
+            self.keys.tofile(f)
+            self.digests.tofile(f)
+
+    @classmethod
+    def load(cls, path: Path) -> "FingerprintIndex":
+        with Path(path).open("rb") as f:
+            magic, n = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a fingerprint index")
+            keys = array("Q")
+            digests = array("Q")
+            keys.fromfile(f, n)
+            digests.fromfile(f, n)
+        return cls(keys, digests)
+
+
+@dataclasses.dataclass
+class SnapshotDiff:
+    """
+    Key hashes of the added, removed and modified records.
+    """
+
+    added: array
+    removed: array
+    modified: array
+
+    @property
+    def changed(self) -> set[int]:
+        """
+        Key hashes of the records to crawl again, added or modified.
+        """
+        return set(self.added) | set(self.modified)
+
+    def to_message(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.removed)} removed, "
+            f"{len(self.modified)} modified"
+        )
+
+
+def diff(old: FingerprintIndex, new: FingerprintIndex) -> SnapshotDiff:
+    """
+    Merge walk the two sorted indexes.
+    """
+    added = array("Q")
+    removed = array("Q")
+    modified = array("Q")
+    i, j = 0, 0
+    n_old, n_new = len(old), len(new)
+    old_keys, new_keys = old.keys, new.keys
+    while i < n_old and j < n_new:
+        old_key, new_key = old_keys[i], new_keys[j]
+        if old_key == new_key:
+            if old.digests[i] != new.digests[j]:
+                modified.append(new_key)
+            i += 1
+            j += 1
+        elif old_key < new_key:
+            removed.append(old_key)
+            i += 1
+        else:
+            added.append(new_key)
+            j += 1
+    removed.extend(old_keys[i:])
+    added.extend(new_keys[j:])
+    return SnapshotDiff(added=added, removed=removed, modified=modified)
+
+
+def select_changed(
+    records: T.Iterable[T.Mapping[str, T.Any]],
+    delta: SnapshotDiff,
+    key_field: str = "video_id",
+) -> T.Iterator[T.Mapping[str, T.Any]]:
+    """
+    Stream the added or modified records out of the new snapshot.
+    """
+    changed = delta.changed
+    for record in records:
+        if hash_key(record[key_field]) in changed:
+            yield record
+
+
+def select_removed(
+    records: T.Iterable[T.Mapping[str, T.Any]],
+    delta: SnapshotDiff,
+    key_field: str = "video_id",
+) -> T.Iterator[T.Mapping[str, T.Any]]:
+    """
+    Stream the removed records out of the old snapshot.
+    """
+    removed = set(delta.removed)
+    for record in records:
+        if hash_key(record[key_field]) in removed:
+            yield record
+
+
+def to_shards(
+    keys: T.Sequence[str],
+    unit: str,
+    shard_size: int,
+) -> list[Shard]:
+    """
+    Turn the keys to crawl into scheduler shards, entry ``i`` of the unit is
+    ``keys[i]``.
+    """
+    return make_shards({unit: len(keys)}, shard_size)
@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batched client for the ``sakura_*_status_tracking`` DynamoDB tables.
+
+Single item ``PutItem`` / ``UpdateItem`` / ``GetItem`` round trips dominate a
+micro batch under load. :class:`BatchedStatusTracker` buffers writes and
+flushes them when ``flush_size`` writes are pending or the oldest pending
+write is older than ``flush_interval`` seconds:
+
+- puts and deletes are sent with ``BatchWriteItem`` (25 items per request),
+- updates are sent with ``TransactWriteItems`` (100 items per request), so an
+  update guarded by a lease owner is rejected if the lease was lost or has
+  expired,
+- reads use ``BatchGetItem`` (100 keys per request).
+
+There is no background timer, the age of the buffer is only checked when a
+write comes in. A caller that can go quiet for longer than
+``flush_interval``, e.g. between two micro batches, has to call
+:meth:`BatchedStatusTracker.flush_if_due` from its loop, or
+:meth:`BatchedStatusTracker.flush`.
+
+A flush that fails, e.g. on items still unprocessed after all retries, puts
+the writes it didn't send back in the buffer, the next flush sends them
+again. A rejected guarded update is reported for its own key only: a flush
+triggered by a write collects the lost keys and the next
+:meth:`BatchedStatusTracker.update` of such a key, or the next explicit
+:meth:`BatchedStatusTracker.flush`, raises :class:`LeaseLostError`.
+
+Writes to the same key are coalesced in the buffer, so every key appears at
+most once per flush. Lease operations (:meth:`BatchedStatusTracker.acquire_lease`,
+:meth:`BatchedStatusTracker.release_lease`) are never buffered, they flush
+the pending writes of that key first and then run a conditional
+``UpdateItem``, so the lock semantics are the same as before.
+
+Puts and deletes are unconditional and replace the whole item, lease
+attributes included, so they must not be used on leased items: write those
+with :meth:`BatchedStatusTracker.update` and ``lease_owner``. A put or delete
+of a key leased through this tracker, or with a pending guarded update, is
+rejected with :class:`ValueError`. A lease held by another worker can't be
+seen without a read, it is up to the caller not to put or delete such keys.
+
+Attribute values follow the ``boto3.dynamodb`` conventions, numbers have to
+be ``int`` or ``decimal.Decimal``.
+"""
+
+import typing as T
+import time
+import random
+import threading
+import dataclasses
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+
+from .exc import LeaseLostError
+from .tracing import span
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_dynamodb.client import DynamoDBClient
+
+BATCH_WRITE_LIMIT = 25
+BATCH_GET_LIMIT = 100
+TRANSACT_WRITE_LIMIT = 100
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def serialize(item: dict[str, T.Any]) -> dict[str, dict]:
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize(item: dict[str, dict]) -> dict[str, T.Any]:
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+def chunked(items: list, size: int) -> T.Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+@dataclasses.dataclass
+class _PendingUpdate:
+    attrs: dict[str, T.Any]
+    lease_owner: str | None = None
+
+
+class BatchedStatusTracker:
+    """
+    :param client: boto3 DynamoDB client, e.g. ``bsm.dynamodb_client``.
+    :param table_name: the status tracking table name.
+    :param key_names: the primary key attribute names, hash key first.
+    :param flush_size: flush when this many writes are pending.
+    :param flush_interval: flush when the oldest pending write is older than
+        this many seconds, checked on every write and by :meth:`flush_if_due`.
+    :param lease_owner_attr: attribute that stores the lease owner.
+    :param lease_expire_attr: attribute that stores the lease expire epoch.
+    :param max_retries: retries for unprocessed items and throttling.
+    :param clock: epoch seconds, the lease expire times are compared to it.
+    """
+
+    def __init__(
+        self,
+        client: "DynamoDBClient",
+        table_name: str,
+        key_names: tuple[str, ...] = ("id",),
+        flush_size: int = BATCH_WRITE_LIMIT,
+        flush_interval: float = 1.0,
+        lease_owner_attr: str = "lease_owner",
+        lease_expire_attr: str = "lease_expire",
+        max_retries: int = 8,
+        clock: T.Callable[[], float] = time.time,
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.key_names = key_names
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.lease_owner_attr = lease_owner_attr
+        self.lease_expire_attr = lease_expire_attr
+        self.max_retries = max_retries
+        self.clock = clock
+        self._lock = threading.RLock()
+        # key -> full item to put, or None to delete
+        self._puts: dict[tuple, dict[str, T.Any] | None] = dict()
+        self._updates: dict[tuple, _PendingUpdate] = dict()
+        self._first_pending_time: float | None = None
+        # keys whose guarded update was rejected by an automatic flush
+        self._lost_keys: set[tuple] = set()
+        # keys leased through this tracker and not released yet
+        self._leased_keys: set[tuple] = set()
+        self.n_request = 0
+
+    # --------------------------------------------------------------------------
+    # helpers
+    # --------------------------------------------------------------------------
+    def get_key(self, item: dict[str, T.Any]) -> tuple:
+        return tuple(item[name] for name in self.key_names)
+
+    def _key_dict(self, key: tuple) -> dict[str, T.Any]:
+        return dict(zip(self.key_names, key))
+
+    def _sleep_backoff(self, attempt: int):
+        time.sleep(random.uniform(0, min(2.0, 0.05 * (2**attempt))))
+
+    @property
+    def n_pending(self) -> int:
+        return len(self._puts) + len(self._updates)
+
+    # --------------------------------------------------------------------------
+    # buffered writes
+    # --------------------------------------------------------------------------
+    def _after_write(self):
+        if self._first_pending_time is None:
+            self._first_pending_time = time.monotonic()
+        try:
+            if self.n_pending >= self.flush_size:
+                self._flush()
+            else:
+                self._flush_if_due()
+        except LeaseLostError as e:
+            # not the fault of the write that triggered the flush, report it
+            # on the next update of these keys
+            self._lost_keys.update(e.keys)
+
+    def _raise_if_lost(self, keys: T.Iterable[tuple]):
+        lost = [key for key in keys if key in self._lost_keys]
+        if lost:
+            self._lost_keys.difference_update(lost)
+            raise LeaseLostError(lost)
+
+    def _check_not_leased(self, key: tuple):
+        if key in self._leased_keys:
+            raise ValueError(
+                f"{key} is leased, a put or delete would drop the lease, "
+                f"use update with lease_owner"
+            )
+        pending = self._updates.get(key)
+        if pending is not None and pending.lease_owner is not None:
+            raise ValueError(
+                f"{key} has a pending guarded update, a put or delete would "
+                f"replace it without the lease check"
+            )
+
+    def put(self, item: dict[str, T.Any]):
+        """
+        Buffer a full item put, it replaces any pending write of the same key.
+
+        :raises ValueError: if the key is leased through this tracker or has
+            a pending guarded update.
+        """
+        with self._lock:
+            key = self.get_key(item)
+            self._check_not_leased(key)
+            self._updates.pop(key, None)
+            self._puts[key] = dict(item)
+            self._after_write()
+
+    def delete(self, key: tuple):
+        """
+        Buffer a delete, it replaces any pending write of the same key.
+
+        :raises ValueError: see :meth:`put`.
+        """
+        with self._lock:
+            self._check_not_leased(key)
+            self._updates.pop(key, None)
+            self._puts[key] = None
+            self._after_write()
+
+    def update(
+        self,
+        key: tuple,
+        attrs: dict[str, T.Any],
+        lease_owner: str | None = None,
+    ):
+        """
+        Buffer a ``SET`` of the given attributes.
+
+        :param lease_owner: if given, the update only succeeds if the item is
+            still leased by this owner and the lease hasn't expired,
+            otherwise :class:`LeaseLostError` is raised, by the explicit flush
+            that sends it or by the next update of this key.
+        """
+        with self._lock:
+            if lease_owner is not None:
+                self._raise_if_lost([key])
+            if key in self._puts:
+                item = self._puts[key]
+                if item is not None and lease_owner is None:
+                    item.update(attrs)
+                    self._after_write()
+                    return
+                # we cannot merge a guarded update into a plain put
+                self.flush_keys([key])
+            pending = self._updates.get(key)
+            if pending is None or pending.lease_owner != lease_owner:
+                if pending is not None:
+                    self.flush_keys([key])
+                self._updates[key] = _PendingUpdate(
+                    attrs=dict(attrs),
+                    lease_owner=lease_owner,
+                )
+            else:
+                pending.attrs.update(attrs)
+            self._after_write()
+
+    def _flush_if_due(self):
+        if (
+            self._first_pending_time is not None
+            and time.monotonic() - self._first_pending_time >= self.flush_interval
+        ):
+            self._flush()
+
+    def flush_if_due(self):
+        """
+        Flush if the oldest pending write is older than ``flush_interval``.
+
+        :raises LeaseLostError: see :meth:`flush`.
+        """
+        with self._lock:
+            self._flush_if_due()
+            self._raise_if_lost(list(self._lost_keys))
+
+    def flush(self):
+        """
+        Send all pending writes.
+
+        :raises LeaseLostError: if some guarded updates were rejected, in this
+            flush or in an automatic flush since, all the other writes are
+            still applied.
+        """
+        with self._lock:
+            try:
+                self._flush()
+            except LeaseLostError as e:
+                self._lost_keys.update(e.keys)
+            self._raise_if_lost(list(self._lost_keys))
+
+    def _flush(self):
+        puts, self._puts = self._puts, dict()
+        updates, self._updates = self._updates, dict()
+        first_pending_time = self._first_pending_time
+        self._first_pending_time = None
+        self._send(puts, updates, first_pending_time)
+
+    def flush_keys(self, keys: T.Iterable[tuple]):
+        """
+        Send the pending writes of the given keys only.
+
+        :raises LeaseLostError: if a guarded update of these keys was rejected.
+        """
+        with self._lock:
+            keys = list(keys)
+            puts = dict()
+            updates = dict()
+            for key in keys:
+                if key in self._puts:
+                    puts[key] = self._puts.pop(key)
+                if key in self._updates:
+                    updates[key] = self._updates.pop(key)
+            first_pending_time = self._first_pending_time
+            if self.n_pending == 0:
+                self._first_pending_time = None
+            self._send(puts, updates, first_pending_time)
+            self._raise_if_lost(keys)
+
+    def _send(
+        self,
+        puts: dict[tuple, dict | None],
+        updates: dict[tuple, _PendingUpdate],
+        first_pending_time: float | None,
+    ):
+        """
+        Send writes taken out of the buffer, the ones not sent go back in
+        if this fails for another reason than a lost lease.
+        """
+        try:
+            self._batch_write(puts)
+        except Exception:
+            self._restore(puts, updates, first_pending_time)
+            raise
+        try:
+            self._transact_update(updates)
+        except LeaseLostError:
+            raise
+        except Exception:
+            self._restore({}, updates, first_pending_time)
+            raise
+
+    def _restore(
+        self,
+        puts: dict[tuple, dict | None],
+        updates: dict[tuple, _PendingUpdate],
+        first_pending_time: float | None,
+    ):
+        # a write buffered since replaces the restored one of the same key,
+        # puts and deletes are idempotent so resending a sent one is harmless
+        for key, item in puts.items():
+            if key not in self._puts and key not in self._updates:
+                self._puts[key] = item
+        for key, pending in updates.items():
+            if key not in self._puts and key not in self._updates:
+                self._updates[key] = pending
+        if self.n_pending and first_pending_time is not None:
+            if self._first_pending_time is None:
+                self._first_pending_time = first_pending_time
+            else:
+                self._first_pending_time = min(
+                    self._first_pending_time, first_pending_time
+                )
+
+    def _batch_write(self, puts: dict[tuple, dict | None]):
+        if not puts:
+            return
+        with span("dynamodb.batch_write", n_item=len(puts)):
+            self._do_batch_write(puts)
+
+    def _do_batch_write(self, puts: dict[tuple, dict | None]):
+        requests = list()
+        for key, item in puts.items():
+            if item is None:
+                requests.append(
+                    {"DeleteRequest": {"Key": serialize(self._key_dict(key))}}
+                )
+            else:
+                requests.append({"PutRequest": {"Item": serialize(item)}})
+        for chunk in chunked(requests, BATCH_WRITE_LIMIT):
+            attempt = 0
+            while chunk:
+                self.n_request += 1
+                res = self.client.batch_write_item(
+                    RequestItems={self.table_name: chunk}
+                )
+                chunk = res.get("UnprocessedItems", {}).get(self.table_name, [])
+                if chunk:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise RuntimeError(
+                            f"{len(chunk)} items still unprocessed after "
+                            f"{self.max_retries} retries"
+                        )
+                    self._sleep_backoff(attempt)
+
+    def _to_transact_item(self, key: tuple, pending: _PendingUpdate) -> dict:
+        names = dict()
+        values = dict()
+        sets = list()
+        for i, (name, value) in enumerate(pending.attrs.items()):
+            names[f"#a{i}"] = name
+            values[f":v{i}"] = value
+            sets.append(f"#a{i} = :v{i}")
+        update = {
+            "TableName": self.table_name,
+            "Key": serialize(self._key_dict(key)),
+            "UpdateExpression": "SET " + ", ".join(sets),
+            "ExpressionAttributeNames": names,
+        }
+        if pending.lease_owner is not None:
+            names["#lease_owner"] = self.lease_owner_attr
+            names["#lease_expire"] = self.lease_expire_attr
+            values[":lease_owner"] = pending.lease_owner
+            values[":now"] = int(self.clock())
+            update["ConditionExpression"] = (
+                "#lease_owner = :lease_owner AND #lease_expire >= :now"
+            )
+        update["ExpressionAttributeValues"] = serialize(values)
+        return {"Update": update}
+
+    def _transact_update(self, updates: dict[tuple, _PendingUpdate]):
+        if not updates:
+            return
+        with span("dynamodb.transact_write", n_item=len(updates)):
+            self._do_transact_update(updates)
+
+    def _do_transact_update(self, updates: dict[tuple, _PendingUpdate]):
+        lost_keys = list()
+        pairs = list(updates.items())
+        for chunk in chunked(pairs, TRANSACT_WRITE_LIMIT):
+            attempt = 0
+            while chunk:
+                self.n_request += 1
+                try:
+                    self.client.transact_write_items(
+                        TransactItems=[
+                            self._to_transact_item(key, pending)
+                            for key, pending in chunk
+                        ]
+                    )
+                    chunk = []
+                except self.client.exceptions.TransactionCanceledException as e:
+                    reasons = e.response.get("CancellationReasons", [])
+                    retry_chunk = list()
+                    for (key, pending), reason in zip(chunk, reasons):
+                        code = reason.get("Code", "None")
+                        if code == "ConditionalCheckFailed":
+                            lost_keys.append(key)
+                        else:
+                            retry_chunk.append((key, pending))
+                    if len(retry_chunk) == len(chunk):
+                        # nothing was rejected for lease reasons, e.g. a
+                        # transaction conflict, back off before retrying
+                        attempt += 1
+                        if attempt > self.max_retries:
+                            raise
+                        self._sleep_backoff(attempt)
+                    chunk = retry_chunk
+        if lost_keys:
+            raise LeaseLostError(lost_keys)
+
+    # --------------------------------------------------------------------------
+    # reads
+    # --------------------------------------------------------------------------
+    def get_many(
+        self,
+        keys: T.Iterable[tuple],
+        consistent_read: bool = True,
+    ) -> dict[tuple, dict[str, T.Any]]:
+        """
+        Read many items with ``BatchGetItem``. Pending writes of these keys
+        are flushed first, so reads always see our own writes.
+
+        :return: a key to item mapping, missing items are not in the mapping.
+        """
+        keys = list(dict.fromkeys(keys))
+        self.flush_keys(keys)
+        with span("dynamodb.batch_get", n_item=len(keys)):
+            return self._batch_get(keys, consistent_read)
+
+    def _batch_get(
+        self,
+        keys: list[tuple],
+        consistent_read: bool,
+    ) -> dict[tuple, dict[str, T.Any]]:
+        results = dict()
+        for chunk in chunked(keys, BATCH_GET_LIMIT):
+            request = {
+                self.table_name: {
+                    "Keys": [serialize(self._key_dict(key)) for key in chunk],
+                    "ConsistentRead": consistent_read,
+                }
+            }
+            attempt = 0
+            while request:
+                self.n_request += 1
+                res = self.client.batch_get_item(RequestItems=request)
+                for raw in res.get("Responses", {}).get(self.table_name, []):
+                    item = deserialize(raw)
+                    results[self.get_key(item)] = item
+                request = res.get("UnprocessedKeys") or None
+                if request:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise RuntimeError("keys still unprocessed after retries")
+                    self._sleep_backoff(attempt)
+        return results
+
+    def get(self, key: tuple) -> dict[str, T.Any] | None:
+        return self.get_many([key]).get(key)
+
+    # --------------------------------------------------------------------------
+    # lease, never buffered
+    # --------------------------------------------------------------------------
+    def acquire_lease(
+        self,
+        key: tuple,
+        owner: str,
+        expire: float,
+        now: float | None = None,
+    ) -> bool:
+        """
+        Take the lease on an item if it's free, expired or already ours.
+
+        :param expire: seconds until the lease expires.
+        :return: ``True`` if the lease is now held by ``owner``.
+        """
+        if now is None:
+            now = self.clock()
+        try:
+            self.flush_keys([key])
+        except LeaseLostError:
+            pass  # taking the lease again starts over
+        with span("lease.acquire") as s:
+            acquired = self._acquire_lease(key, owner, expire, now)
+            if s is not None:
+                s.attrs["acquired"] = acquired
+        if acquired:
+            with self._lock:
+                self._leased_keys.add(key)
+        return acquired
+
+    def _acquire_lease(
+        self,
+        key: tuple,
+        owner: str,
+        expire: float,
+        now: float,
+    ) -> bool:
+        self.n_request += 1
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=serialize(self._key_dict(key)),
+                UpdateExpression="SET #owner = :owner, #expire = :expire",
+                ConditionExpression=(
+                    "attribute_not_exists(#owner) OR #expire < :now OR #owner = :owner"
+                ),
+                ExpressionAttributeNames={
+                    "#owner": self.lease_owner_attr,
+                    "#expire": self.lease_expire_attr,
+                },
+                ExpressionAttributeValues=serialize(
+                    {
+                        ":owner": owner,
+                        ":expire": int(now + expire),
+                        ":now": int(now),
+                    }
+                ),
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def release_lease(self, key: tuple, owner: str) -> bool:
+        """
+        Release the lease, only if it's held by ``owner``. Pending writes of
+        this key are flushed first, while we still hold the lease.
+
+        :return: ``True`` if the lease was released.
+        """
+        self.flush_keys([key])
+        self.n_request += 1
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=serialize(self._key_dict(key)),
+                UpdateExpression="REMOVE #owner, #expire",
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={
+                    "#owner": self.lease_owner_attr,
+                    "#expire": self.lease_expire_attr,
+                },
+                ExpressionAttributeValues=serialize({":owner": owner}),
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        finally:
+            with self._lock:
+                self._leased_keys.discard(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
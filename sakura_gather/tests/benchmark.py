@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load test helpers: measure a benchmark, save the results as a JSON baseline
+and fail when throughput regresses.
+
+- ``SAKURA_GATHER_MAX_REGRESSION``: allowed throughput drop in percent
+  against the baseline, default ``20``.
+- ``SAKURA_GATHER_UPDATE_BASELINE=1``: write this run as the baseline.
+- ``SAKURA_GATHER_BASELINE``: path of the baseline file, default
+  ``tests_load/baseline.json``.
+- ``SAKURA_GATHER_REQUIRE_BASELINE=1``: fail instead of skip when a benchmark
+  has no baseline, for the CI job that gates on it.
+
+Baselines are machine specific, so they are not in git. Create one on the
+reference machine with ``SAKURA_GATHER_UPDATE_BASELINE=1`` and keep it where
+the CI runner can restore it, e.g. the CI cache. A benchmark without a
+baseline is never silently passed: it's skipped, or fails with
+``SAKURA_GATHER_REQUIRE_BASELINE=1``.
+"""
+
+import typing as T
+import os
+import json
+import time
+import dataclasses
+from pathlib import Path
+
+import pytest
+
+from ..metrics import percentile, get_peak_rss
+from ..paths import dir_load_test
+
+path_default_baseline = dir_load_test / "baseline.json"
+path_latest = dir_load_test / "latest.json"
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    name: str
+    n_item: int
+    elapsed: float
+    latencies: list[float] = dataclasses.field(default_factory=list)
+    peak_rss: int | None = None
+
+    @property
+    def items_per_second(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.n_item / self.elapsed
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return dict(
+            n_item=self.n_item,
+            elapsed=self.elapsed,
+            items_per_second=self.items_per_second,
+            p50=percentile(self.latencies, 50),
+            p95=percentile(self.latencies, 95),
+            p99=percentile(self.latencies, 99),
+            peak_rss=self.peak_rss,
+        )
+
+    def to_message(self) -> str:
+        data = self.to_dict()
+        return (
+            f"{self.name}: {data['items_per_second']:.1f} items/s, "
+            f"p50 {data['p50'] * 1000:.2f}ms, p95 {data['p95'] * 1000:.2f}ms, "
+            f"p99 {data['p99'] * 1000:.2f}ms, "
+            f"peak rss {(self.peak_rss or 0) / 1024 / 1024:.1f}MB"
+        )
+
+
+def run_benchmark(
+    name: str,
+    func: T.Callable[[T.Any], T.Any],
+    items: T.Iterable[T.Any],
+) -> BenchmarkResult:
+    """
+    Call ``func`` on every item and record the latency of each call.
+    """
+    latencies = list()
+    start = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - t)
+    return BenchmarkResult(
+        name=name,
+        n_item=len(latencies),
+        elapsed=time.perf_counter() - start,
+        latencies=latencies,
+        peak_rss=get_peak_rss(),
+    )
+
+
+def _load(path: Path) -> dict[str, dict]:
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return dict()
+
+
+def _save(path: Path, name: str, data: dict):
+    all_data = _load(path)
+    all_data[name] = data
+    path.write_text(json.dumps(all_data, indent=4, sort_keys=True))
+
+
+def check_regression(
+    result: BenchmarkResult,
+    max_regression: float | None = None,
+    path_baseline: Path | None = None,
+    path_latest: Path = path_latest,
+) -> str | None:
+    """
+    Save the result and compare it with the baseline. The baseline is only
+    written with ``SAKURA_GATHER_UPDATE_BASELINE=1``.
+
+    :param max_regression: allowed throughput drop in percent.
+    :return: an error message if the throughput regressed or there is no
+        baseline and ``SAKURA_GATHER_REQUIRE_BASELINE=1``, otherwise ``None``.
+    :raises pytest.skip.Exception: if there is no baseline.
+    """
+    if max_regression is None:
+        max_regression = float(os.environ.get("SAKURA_GATHER_MAX_REGRESSION", "20"))
+    if path_baseline is None:
+        path_baseline = Path(
+            os.environ.get("SAKURA_GATHER_BASELINE", path_default_baseline)
+        )
+    data = result.to_dict()
+    print(result.to_message())
+    _save(path_latest, result.name, data)
+    if os.environ.get("SAKURA_GATHER_UPDATE_BASELINE") == "1":
+        _save(path_baseline, result.name, data)
+        return None
+    baseline = _load(path_baseline).get(result.name)
+    if baseline is None:
+        message = (
+            f"{result.name} has no baseline in {path_baseline}, "
+            f"create it with SAKURA_GATHER_UPDATE_BASELINE=1"
+        )
+        if os.environ.get("SAKURA_GATHER_REQUIRE_BASELINE") == "1":
+            return message
+        pytest.skip(message)
+    floor = baseline["items_per_second"] * (1 - max_regression / 100)
+    if data["items_per_second"] < floor:
+        return (
+            f"{result.name} regressed: {data['items_per_second']:.1f} items/s, "
+            f"baseline {baseline['items_per_second']:.1f} items/s, "
+            f"allowed drop {max_regression}%"
+        )
+    return None
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local ``http.server`` based fixture site that mimics video detail pages,
+used by unit tests and offline throughput benchmarks.
+
+- ``/video/<id>``: a detail page, served with ``ETag`` and ``Last-Modified``.
+- ``/status/<code>``: respond with the given status code.
+- ``/flaky/<n>/<id>``: respond ``503`` for the first ``n`` hits, then the page.
+"""
+
+import re
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import contextlib
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ..fetcher import Response
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+def render_video_page(video_id: str) -> bytes:
+    return (
+        "<html><head><title>Video {id}</title></head><body>"
+        '<div class="video" data-id="{id}">'
+        "<h1>Video {id}</h1>"
+        '<ul class="tags"><li>tag-a</li><li>tag-b</li></ul>'
+        "<p>{filler}</p>"
+        "</div></body></html>"
+    ).format(id=video_id, filler="lorem ipsum " * 200).encode("utf-8")
+
+
+NAV = "".join(
+    f'<li class="nav-item"><a href="/category/{i}">Category {i}</a></li>'
+    for i in range(80)
+)
+
+
+def render_template_page(rng: random.Random, i: int) -> bytes:
+    """
+    A detail page: a big shared template and a few per-video fields.
+    """
+    tags = "".join(f"<li>tag-{rng.randint(0, 500)}</li>" for _ in range(8))
+    return (
+        "<!DOCTYPE html><html><head>"
+        f"<title>Video {i}</title>"
+        '<link rel="stylesheet" href="/static/site.css">'
+        '<script src="/static/site.js"></script>'
+        f"</head><body><nav><ul>{NAV}</ul></nav>"
+        f'<div class="video" data-id="v-{i}">'
+        f"<h1>Video title {rng.getrandbits(64):x}</h1>"
+        f'<span class="duration">{rng.randint(60, 7200)}</span>'
+        f'<ul class="tags">{tags}</ul>'
+        f"<p>{rng.getrandbits(256):x}</p>"
+        "</div><footer>Copyright, all rights reserved.</footer></body></html>"
+    ).encode("utf-8")
+
+
+def parse_video_page(url: str, body: bytes) -> dict:
+    """
+    A parser of the fixture detail page, used by pipeline tests.
+    """
+    html = body.decode("utf-8")
+    return dict(
+        url=url,
+        video_id=re.search(r'data-id="([^"]+)"', html).group(1),
+        tags=re.findall(r"<li>([^<]+)</li>", html),
+    )
+
+
+class FixtureSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency: float = 0.0
+    hits: dict[str, int]
+    hits_lock: threading.Lock
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        with self.hits_lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            n_hit = self.hits[self.path]
+        if self.latency:
+            time.sleep(self.latency)
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "video" and len(parts) == 2:
+            body = render_video_page(parts[1])
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, headers={"ETag": etag})
+            return self._send(
+                200,
+                body,
+                {
+                    "Content-Type": "text/html; charset=utf-8",
+                    "ETag": etag,
+                    "Last-Modified": LAST_MODIFIED,
+                },
+            )
+        if parts[0] == "status" and len(parts) == 2:
+            return self._send(int(parts[1]), headers={"Retry-After": "0"})
+        if parts[0] == "flaky" and len(parts) == 3:
+            if n_hit <= int(parts[1]):
+                return self._send(503, headers={"Retry-After": "0"})
+            return self._send(200, render_video_page(parts[2]))
+        return self._send(404)
+
+
+@contextlib.contextmanager
+def run_fixture_site(latency: float = 0.0):
+    """
+    Start the fixture site in a background thread.
+
+    :param latency: seconds to sleep before answering each request.
+
+    :return: a ``(base_url, hits)`` tuple, ``hits`` maps path to hit count.
+    """
+    handler = type(
+        "Handler",
+        (FixtureSiteHandler,),
+        dict(latency=latency, hits=dict(), hits_lock=threading.Lock()),
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address
+        yield f"http://{host}:{port}", handler.hits
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class UrllibTransport:
+    """
+    A :class:`~sakura_gather.fetcher.Transport` that runs blocking urllib
+    requests in worker threads, so the fetcher can be tested without aiohttp.
+    """
+
+    def _request(self, method, url, headers):
+        req = urllib.request.Request(url, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req) as res:
+                return Response(res.status, dict(res.headers), res.read())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, dict(e.headers), e.read())
+
+    async def request(self, method, url, headers=None):
+        return await asyncio.to_thread(self._request, method, url, headers)
+
+    async def close(self):
+        pass
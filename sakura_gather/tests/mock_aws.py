@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers and pytest fixtures for tests against moto mocked AWS services.
+
+``tests/conftest.py`` and ``tests_load/conftest.py`` import the fixtures, so
+every test module can ask for them by name:
+
+- ``aws_session``: a boto3 session inside ``moto.mock_aws``, with fake
+  credentials. Skips the test if ``moto`` or ``boto3`` is not installed.
+- ``dynamodb_client``: a DynamoDB client and an empty :data:`TABLE_NAME`
+  table, with the string hash key ``id`` and the ``shard_pool-index`` global
+  secondary index of :class:`~sakura_gather.scheduler.DynamoDBShardStore`.
+- ``s3_client``: an S3 client, the tests create their own buckets.
+- ``dynamodb_local_client``: like ``dynamodb_client``, but on a real DynamoDB
+  Local at the endpoint in ``SAKURA_GATHER_DYNAMODB_ENDPOINT``, e.g.
+  ``http://localhost:8000``. Skips the test if the variable is not set. Use it
+  where moto's lack of atomic updates matters, see :class:`SerializedClient`.
+"""
+
+import os
+import threading
+
+import pytest
+
+TABLE_NAME = "sakura_test_status_tracking"
+REGION_NAME = "us-east-1"
+
+
+@pytest.fixture
+def aws_session(monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        yield boto3.session.Session(region_name=REGION_NAME)
+
+
+def create_table(client, table_name: str = TABLE_NAME):
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "id", "AttributeType": "S"},
+            {"AttributeName": "shard_pool", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "shard_pool-index",
+                "KeySchema": [{"AttributeName": "shard_pool", "KeyType": "HASH"}],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+@pytest.fixture
+def dynamodb_client(aws_session):
+    client = aws_session.client("dynamodb")
+    create_table(client)
+    return client
+
+
+@pytest.fixture
+def s3_client(aws_session):
+    return aws_session.client("s3")
+
+
+@pytest.fixture
+def dynamodb_local_client():
+    endpoint = os.environ.get("SAKURA_GATHER_DYNAMODB_ENDPOINT")
+    if endpoint is None:
+        pytest.skip("SAKURA_GATHER_DYNAMODB_ENDPOINT is not set")
+    boto3 = pytest.importorskip("boto3")
+    client = boto3.session.Session(
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        region_name=REGION_NAME,
+    ).client("dynamodb", endpoint_url=endpoint)
+    if TABLE_NAME in client.list_tables()["TableNames"]:
+        client.delete_table(TableName=TABLE_NAME)
+    create_table(client)
+    client.get_waiter("table_exists").wait(TableName=TABLE_NAME)
+    yield client
+    client.delete_table(TableName=TABLE_NAME)
+
+
+class SerializedClient:
+    """
+    Wrap a moto backed boto3 client so that ``update_item`` calls run one at
+    a time.
+
+    DynamoDB applies an update expression atomically, moto reads, changes and
+    writes the item in several steps, so concurrent ``ADD`` updates of one
+    item may lose increments. Tests that rely on the atomic update use this
+    wrapper, every other call goes to the client unchanged.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+
+    def update_item(self, **kwargs):
+        with self._lock:
+            return self._client.update_item(**kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming multipart uploader that fans one read out to S3 and Cloudflare R2.
+
+The source is read once, chunk by chunk. Every chunk is handed to one writer
+thread per target through a bounded queue, each writer streams it into a
+``smart_open`` multipart upload. Memory use is bounded by
+``n_target * queue_size * chunk_size`` plus one multipart part per target,
+no matter how big the file is. The slowest target applies back-pressure to
+the reader.
+
+``smart_open`` uploads the parts of one file sequentially, so concurrency
+comes from uploading to all targets at the same time and from
+:meth:`FanOutUploader.upload_many`, which uploads several files in parallel.
+
+.. code-block:: python
+
+    uploader = FanOutUploader(part_size=16 * 1024 * 1024)
+    stats = uploader.upload(
+        source=path,
+        targets=[
+            Target(uri=f"s3://bucket/{key}", client=bsm.s3_client),
+            Target(uri=f"s3://r2-bucket/{key}", client=r2_client),
+        ],
+    )
+    print(stats.bytes_per_second, stats.peak_rss)
+"""
+
+import typing as T
+import time
+import queue
+import threading
+import dataclasses
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import smart_open
+
+from .metrics import get_peak_rss
+from .tracing import span
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_s3.client import S3Client
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # the S3 multipart minimum
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+
+_END = object()
+_ABORT = object()
+
+
+@dataclasses.dataclass
+class Target:
+    """
+    One upload destination.
+
+    :param uri: ``s3://bucket/key``, for R2 pass a client with the R2
+        ``endpoint_url``.
+    :param client: boto3 S3 client.
+    """
+
+    uri: str
+    client: T.Optional["S3Client"] = None
+
+
+@dataclasses.dataclass
+class UploadStats:
+    n_bytes: int
+    n_target: int
+    elapsed: float
+    peak_rss: int | None
+
+    @property
+    def bytes_per_second(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.n_bytes / self.elapsed
+
+
+class _UploadAborted(Exception):
+    pass
+
+
+class FanOutUploader:
+    """
+    :param part_size: multipart part size in bytes, at least 5 MB.
+    :param chunk_size: read size of the source in bytes.
+    :param queue_size: max number of chunks buffered per target.
+    :param max_workers: number of files :meth:`upload_many` uploads at once.
+    """
+
+    def __init__(
+        self,
+        part_size: int = DEFAULT_PART_SIZE,
+        chunk_size: int = 1024 * 1024,
+        queue_size: int = 8,
+        max_workers: int = 4,
+    ):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size has to be at least {MIN_PART_SIZE}")
+        self.part_size = part_size
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.max_workers = max_workers
+
+    def _write(
+        self,
+        target: Target,
+        q: queue.Queue,
+        errors: list[Exception],
+    ):
+        transport_params = dict(min_part_size=self.part_size)
+        if target.client is not None:
+            transport_params["client"] = target.client
+        # the end sentinel was taken off the queue, e.g. before a failing
+        # close / complete, nothing more will come
+        ended = False
+        try:
+            with smart_open.open(
+                target.uri,
+                "wb",
+                compression="disable",
+                transport_params=transport_params,
+            ) as f:
+                while True:
+                    chunk = q.get()
+                    if chunk is _END:
+                        ended = True
+                        break
+                    if chunk is _ABORT:
+                        ended = True
+                        # raising inside the with block aborts the multipart
+                        # upload instead of completing a partial object
+                        raise _UploadAborted
+                    f.write(chunk)
+        except _UploadAborted:
+            pass
+        except Exception as e:
+            errors.append(e)
+            # keep draining so the reader never blocks on a dead target
+            if not ended:
+                while q.get() not in (_END, _ABORT):
+                    pass
+
+    def upload(
+        self,
+        source: T.Union[Path, str, T.BinaryIO],
+        targets: list[Target],
+    ) -> UploadStats:
+        """
+        Read ``source`` once and upload it to every target.
+
+        :param source: a file path or a binary file object.
+        :raises Exception: the first error of any target, in that case no
+            target gets a partial object.
+        """
+        with span("upload", n_target=len(targets)) as s:
+            stats = self._upload(source, targets)
+            if s is not None:
+                s.attrs["n_bytes"] = stats.n_bytes
+        return stats
+
+    def _upload(
+        self,
+        source: T.Union[Path, str, T.BinaryIO],
+        targets: list[Target],
+    ) -> UploadStats:
+        start = time.perf_counter()
+        errors: list[Exception] = list()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in targets]
+        threads = [
+            threading.Thread(target=self._write, args=(target, q, errors))
+            for target, q in zip(targets, queues)
+        ]
+        for thread in threads:
+            thread.start()
+        n_bytes = 0
+        end = _END
+        try:
+            if isinstance(source, (str, Path)):
+                f = open(source, "rb")
+            else:
+                f = source
+            try:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    n_bytes += len(chunk)
+                    for q in queues:
+                        q.put(chunk)
+                    if errors:
+                        end = _ABORT
+                        break
+            finally:
+                if f is not source:
+                    f.close()
+        except BaseException:
+            end = _ABORT
+            raise
+        finally:
+            if errors:
+                end = _ABORT
+            for q in queues:
+                q.put(end)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        return UploadStats(
+            n_bytes=n_bytes,
+            n_target=len(targets),
+            elapsed=time.perf_counter() - start,
+            peak_rss=get_peak_rss(),
+        )
+
+    def upload_many(
+        self,
+        jobs: T.Iterable[tuple[T.Union[Path, str, T.BinaryIO], list[Target]]],
+    ) -> UploadStats:
+        """
+        Upload many ``(source, targets)`` pairs, ``max_workers`` at a time.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self.upload, source, targets)
+                for source, targets in jobs
+            ]
+            stats_list = [future.result() for future in futures]
+        return UploadStats(
+            n_bytes=sum(stats.n_bytes for stats in stats_list),
+            n_target=sum(stats.n_target for stats in stats_list),
+            elapsed=time.perf_counter() - start,
+            peak_rss=get_peak_rss(),
+        )
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+from sakura_gather.tests.mock_aws import (  # noqa: F401
+    aws_session,
+    dynamodb_client,
+    s3_client,
+)
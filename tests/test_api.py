@@ -1,12 +1,101 @@
 # -*- coding: utf-8 -*-
 
+import sys
+import subprocess
+
+import pytest
+
 from sakura_gather import api
 
+HEAVY_MODULES = [
+    "boto3",
+    "botocore",
+    "aiohttp",
+    "pyarrow",
+    "smart_open",
+    "sakura_site_msav",
+]
+
+
+def get_imported_modules(code: str) -> dict[str, int]:
+    """
+    Run ``code`` in a fresh interpreter with ``-X importtime``.
+
+    :return: imported module name -> cumulative import time in microseconds.
+    """
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = dict()
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def is_imported(modules: dict[str, int], top_level: str) -> bool:
+    return any(
+        name == top_level or name.startswith(top_level + ".") for name in modules
+    )
+
 
 def test():
     _ = api
 
 
+def test_import_is_lazy():
+    modules = get_imported_modules("import sakura_gather.api")
+    # a few milliseconds in practice, the budget leaves room for slow runners
+    assert modules["sakura_gather.api"] < 100_000
+    for name in HEAVY_MODULES:
+        assert not is_imported(modules, name), name
+
+
+def test_light_attributes_stay_light():
+    # importlib.import_module() is not reported by -X importtime, look at
+    # sys.modules instead
+    res = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; import sakura_gather.api as api; "
+            "api.CrawlDaemon, api.TokenBucket, api.AsyncFetcher, api.span; "
+            "print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = dict.fromkeys(res.stdout.split(), 0)
+    assert "sakura_gather.daemon" in modules
+    for name in HEAVY_MODULES:
+        assert not is_imported(modules, name), name
+
+
+def test_getattr():
+    assert api.TokenBucket is sys.modules["sakura_gather.rate_limit"].TokenBucket
+    assert "TokenBucket" in dir(api)
+    with pytest.raises(AttributeError):
+        _ = api.not_exists
+
+
+def test_all_resolvable():
+    import importlib
+
+    for name in api.__all__:
+        module_name, attr = api._LAZY_ATTRS[name]
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:  # optional dependency not installed
+            continue
+        assert getattr(module, attr) is getattr(api, name)
+
+
 if __name__ == "__main__":
     from sakura_gather.tests import run_cov_test
 
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import pytest
+
+from sakura_gather.fetcher import Response, RetryPolicy, FetchResult, download_pages
+from sakura_gather.batch_size import AdaptiveBatchController
+
+
+class TestAdaptiveBatchController:
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            AdaptiveBatchController(decrease_factor=1)
+
+    def test_aimd(self, caplog):
+        ctrl = AdaptiveBatchController(
+            big_batch_size=10,
+            micro_batch_size=3,
+            max_micro_batch_size=5,
+            target_latency=1.0,
+        )
+        assert ctrl.update() is None  # no observation yet
+
+        # healthy, additive increase
+        caplog.set_level(logging.INFO)
+        ctrl.record(latency=0.1, status=200)
+        change = ctrl.update()
+        assert change.reason == "healthy"
+        assert (ctrl.big_batch_size, ctrl.micro_batch_size) == (12, 4)
+        assert "big_batch_size 10 -> 12" in caplog.text
+
+        # throttled, multiplicative decrease
+        ctrl.record(latency=0.1, status=200)
+        ctrl.record(latency=0.1, status=429)
+        change = ctrl.update()
+        assert "throttle" in change.reason
+        assert (ctrl.big_batch_size, ctrl.micro_batch_size) == (6, 2)
+
+        # slow
+        ctrl.record(latency=3.0, status=200)
+        assert "latency" in ctrl.update().reason
+        assert (ctrl.big_batch_size, ctrl.micro_batch_size) == (3, 1)
+
+        # errors
+        ctrl.record(latency=0.1, status=None, error=True)
+        assert "error rate" in ctrl.update().reason
+        assert (ctrl.big_batch_size, ctrl.micro_batch_size) == (1, 1)
+
+        # lower bound reached, nothing changes
+        ctrl.record_fetch_result(FetchResult(url="", status=503, elapsed=0.1))
+        assert ctrl.update() is None
+
+        # upper bound of micro batch size
+        for _ in range(10):
+            ctrl.record(latency=0.1, status=200)
+            ctrl.update()
+        assert ctrl.micro_batch_size == 5
+        assert ctrl.big_batch_size >= ctrl.micro_batch_size
+        assert len(ctrl.history) == 14
+
+    def test_retried_request_is_throttle(self):
+        class FlakyTransport:
+            def __init__(self):
+                self.n_request = 0
+
+            async def request(self, method, url, headers=None):
+                self.n_request += 1
+                if self.n_request == 1:
+                    return Response(429, {"Retry-After": "0.2"}, b"")
+                return Response(200, {}, b"")
+
+            async def close(self):
+                pass
+
+        (res,) = download_pages(
+            ["http://example.com/video/1"],
+            transport=FlakyTransport(),
+            retry_policy=RetryPolicy(max_attempts=2),
+        )
+        assert res.ok and res.n_attempt == 2
+        # the backoff sleep is not latency of the site
+        assert res.elapsed >= 0.2
+        assert res.last_elapsed < 0.1
+
+        ctrl = AdaptiveBatchController(target_latency=0.15)
+        ctrl.record_fetch_result(res)
+        change = ctrl.update()
+        assert "retried" in change.reason
+        assert (ctrl.big_batch_size, ctrl.micro_batch_size) == (5, 1)
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.batch_size",
+        preview=False,
+    )
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import zipfile
+
+import pytest
+
+from sakura_gather.cassette import (
+    CassetteMissError,
+    RecordedTransportError,
+    get_request_key,
+    RecordingTransport,
+    ReplayTransport,
+)
+from sakura_gather.fetcher import Response, RetryPolicy, download_pages
+from sakura_gather.tests.fixture_site import run_fixture_site, UrllibTransport
+
+NO_WAIT = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+
+def test_get_request_key():
+    assert get_request_key("get", "http://a/") == "GET http://a/"
+    assert get_request_key(
+        "GET", "http://a/", {"Accept": "*/*", "If-None-Match": '"x"'}
+    ) == 'GET http://a/\nif-none-match: "x"'
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    """
+    Record a crawl of the fixture site, then stop the site.
+    """
+    path = tmp_path / "cassette.zip"
+    with run_fixture_site() as (base_url, hits):
+        urls = [f"{base_url}/video/{i}" for i in range(20)]
+        urls.append(f"{base_url}/flaky/1/99")
+        urls.append(f"{base_url}/video/0")  # a duplicate body
+        transport = RecordingTransport(path, transport=UrllibTransport())
+        results = download_pages(urls, transport=transport, retry_policy=NO_WAIT)
+        assert transport.n_request == 23  # the flaky url takes 2
+    return path, urls, results
+
+
+class TestCassette:
+    def test_replay(self, cassette):
+        path, urls, recorded = cassette
+        with zipfile.ZipFile(path) as zf:
+            n_body = sum(1 for name in zf.namelist() if name.startswith("bodies/"))
+        assert n_body == 22  # 21 distinct pages and the 503 body
+
+        # the site is gone, everything comes from the cassette
+        transport = ReplayTransport(path, latency=0)
+        assert len(transport) == 21
+        assert sorted(transport.get_urls()) == sorted(set(urls))
+        results = download_pages(urls, transport=transport, retry_policy=NO_WAIT)
+        assert [r.body for r in results] == [r.body for r in recorded]
+        assert [r.status for r in results] == [200] * len(urls)
+        assert [r.headers for r in results] == [r.headers for r in recorded]
+        # the 503 and the retry are replayed in order
+        assert results[20].n_attempt == 2
+        assert transport.n_request == 23
+
+    def test_miss(self, cassette):
+        path, _, _ = cassette
+        transport = ReplayTransport(path, latency=0)
+        with pytest.raises(CassetteMissError):
+            asyncio.run(transport.request("GET", "http://127.0.0.1:1/nope"))
+        results = download_pages(
+            ["http://127.0.0.1:1/nope"], transport=transport, retry_policy=NO_WAIT
+        )
+        assert isinstance(results[0].error, CassetteMissError)
+
+    def test_latency_and_jitter(self, cassette):
+        path, urls, _ = cassette
+        with pytest.raises(ValueError):
+            ReplayTransport(path, latency="fast")
+        with pytest.raises(ValueError):
+            ReplayTransport(path, jitter=2)
+
+        def get_delays(transport: ReplayTransport) -> list[float]:
+            return [transport._next(get_request_key("GET", url))[2] for url in urls]
+
+        delays = get_delays(ReplayTransport(path, latency=0.05, jitter=0.2, seed=1))
+        assert all(0.04 <= d <= 0.06 for d in delays)
+        assert len(set(delays)) > 1
+        # the same seed gives the same delays, whatever the request order
+        transport = ReplayTransport(path, latency=0.05, jitter=0.2, seed=1)
+        reversed_delays = [
+            transport._next(get_request_key("GET", url))[2] for url in urls[::-1]
+        ]
+        assert sorted(reversed_delays) == sorted(delays)
+        transport = ReplayTransport(path, latency=0.05, jitter=0.2, seed=2)
+        assert get_delays(transport) != delays
+
+        # a fixed latency is slept for real, requests overlap
+        transport = ReplayTransport(path, latency=0.05)
+        start = time.perf_counter()
+        download_pages(urls[:20], transport=transport, retry_policy=NO_WAIT)
+        assert 0.05 <= time.perf_counter() - start < 0.5
+
+        # the recorded latencies
+        transport = ReplayTransport(path)
+        key = get_request_key("GET", urls[0])
+        assert get_delays(transport)[0] == transport._index[key][0].latency
+
+    def test_record_errors(self, tmp_path):
+        class CustomError(Exception):
+            pass
+
+        class FlakyTransport:
+            def __init__(self):
+                self.errors = [ConnectionResetError("reset"), CustomError("boom")]
+
+            async def request(self, method, url, headers=None):
+                if self.errors:
+                    raise self.errors.pop(0)
+                return Response(200, {}, b"ok")
+
+            async def close(self):
+                raise RuntimeError("close failed")
+
+        path = tmp_path / "cassette.zip"
+        transport = RecordingTransport(path, transport=FlakyTransport())
+        with pytest.raises(RuntimeError):
+            download_pages(["http://a/1"], transport=transport, retry_policy=NO_WAIT)
+        assert transport.n_request == 3
+
+        # the index is written although the transport failed to close
+        transport = ReplayTransport(path, latency=0)
+        with pytest.raises(ConnectionResetError, match="reset"):
+            asyncio.run(transport.request("GET", "http://a/1"))
+        with pytest.raises(RecordedTransportError, match="CustomError: boom"):
+            asyncio.run(transport.request("GET", "http://a/1"))
+        transport.rewind()
+        results = download_pages(
+            ["http://a/1"], transport=transport, retry_policy=NO_WAIT
+        )
+        assert results[0].body == b"ok"
+        assert results[0].n_attempt == 3
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.cassette",
+        preview=False,
+    )
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from sakura_gather.checkpoint import (
+    split_s3_uri,
+    merge_ranges,
+    parse_marker_name,
+    CheckpointStore,
+    run_micro_batches,
+)
+
+
+def test_split_s3_uri():
+    assert split_s3_uri("s3://bucket/a/b/") == ("bucket", "a/b/")
+    assert split_s3_uri("s3://bucket") == ("bucket", "")
+    with pytest.raises(ValueError):
+        split_s3_uri("/tmp/a")
+
+
+def test_merge_ranges():
+    assert merge_ranges([(5, 10), (0, 5), (20, 30), (25, 27)]) == [(0, 10), (20, 30)]
+    assert merge_ranges([]) == []
+    assert parse_marker_name("done.json") is None
+
+
+class Crash(Exception):
+    pass
+
+
+class TestCheckpointStore:
+    def test_validate(self, tmp_path):
+        with pytest.raises(ValueError):
+            CheckpointStore(tmp_path, s3uri="s3://bucket/")
+
+    def test_commit(self, tmp_path):
+        store = CheckpointStore(tmp_path)
+        assert store.get_resume_offset("cn/1") == 0
+        assert store.commit("cn/1", 0, 10, metadata={"node_id": 1}) is True
+        assert store.commit("cn/1", 0, 10) is False  # idempotent
+        store.commit("cn/1", 20, 30)
+        assert store.get_resume_offset("cn/1") == 10
+        store.commit("cn/1", 10, 20)
+        assert store.get_resume_offset("cn/1") == 30
+        marker = json.loads(
+            (tmp_path / "cn" / "1" / "batch-0000000000-0000000010.json").read_text()
+        )
+        assert marker["n_item"] == 10
+        assert marker["metadata"] == {"node_id": 1}
+        # no temp file left behind
+        assert not list((tmp_path / "cn" / "1").glob(".*"))
+
+    def test_resume(self, tmp_path):
+        store = CheckpointStore(tmp_path)
+        items = list(range(95))
+        processed = list()
+
+        def crash_at_50(batch):
+            if batch[0] == 50:
+                raise Crash
+            processed.extend(batch)
+
+        with pytest.raises(Crash):
+            run_micro_batches(store, "cn/1", items, 10, crash_at_50)
+        assert processed == list(range(50))
+
+        # restart with another micro-batch size
+        processed.clear()
+        res = run_micro_batches(store, "cn/1", items, 20, processed.extend)
+        assert processed == list(range(50, 95))
+        assert res.resume_offset == 50
+        assert res.n_batch == 3
+        assert store.is_done("cn/1")
+
+        # a finished unit is not processed again
+        processed.clear()
+        res = run_micro_batches(store, "cn/1", items, 20, processed.extend)
+        assert processed == []
+        assert res.resume_offset == 95
+
+    def test_skip_committed_after_gap(self, tmp_path):
+        store = CheckpointStore(tmp_path)
+        store.commit("cn/1", 20, 30)
+        processed = list()
+        res = run_micro_batches(store, "cn/1", list(range(40)), 10, processed.extend)
+        assert processed == list(range(20)) + list(range(30, 40))
+        assert res.n_skipped_batch == 1
+
+    def test_resume_iterator(self, tmp_path):
+        store = CheckpointStore(tmp_path)
+        processed = list()
+        pulled = list()
+
+        def stream():
+            for i in range(95):
+                pulled.append(i)
+                yield i
+
+        def crash_at_50(batch):
+            # a lazy iterator is consumed one micro-batch at a time
+            assert len(pulled) == batch[-1] + 1
+            if batch[0] == 50:
+                raise Crash
+            processed.extend(batch)
+
+        with pytest.raises(Crash):
+            run_micro_batches(store, "cn/1", stream(), 10, crash_at_50)
+        assert processed == list(range(50))
+
+        processed.clear()
+        res = run_micro_batches(store, "cn/1", stream(), 20, processed.extend)
+        assert processed == list(range(50, 95))
+        assert res.resume_offset == 50
+        assert store.get_done_n_item("cn/1") == 95
+        res = run_micro_batches(store, "cn/1", stream(), 20, processed.extend)
+        assert res.resume_offset == 95
+
+
+def test_s3_mirror(tmp_path, s3_client):
+    s3 = s3_client
+    s3.create_bucket(Bucket="bucket")
+    store = CheckpointStore(tmp_path / "a", s3_client=s3, s3uri="s3://bucket/ckpt")
+    with pytest.raises(Crash):
+
+        def crash_at_30(batch):
+            if batch[0] == 30:
+                raise Crash
+
+        run_micro_batches(store, "cn/1", list(range(100)), 10, crash_at_30)
+    assert store.n_s3_put == 3
+    keys = [
+        obj["Key"]
+        for obj in s3.list_objects_v2(Bucket="bucket", Prefix="ckpt/")["Contents"]
+    ]
+    assert "ckpt/cn/1/batch-0000000020-0000000030.json" in keys
+
+    # a fresh runner, the local disk is gone
+    store = CheckpointStore(tmp_path / "b", s3_client=s3, s3uri="s3://bucket/ckpt/")
+    assert store.get_resume_offset("cn/1") == 30
+    assert (tmp_path / "b" / "cn" / "1" / "batch-0000000000-0000000010.json").exists()
+    processed = list()
+    run_micro_batches(store, "cn/1", list(range(100)), 10, processed.extend)
+    assert processed == list(range(30, 100))
+    assert store.is_done("cn/1")
+
+
+def test_s3_mirror_after_failed_put(tmp_path, s3_client):
+    s3 = s3_client
+    s3.create_bucket(Bucket="bucket")
+    store = CheckpointStore(tmp_path / "a", s3_client=s3, s3uri="s3://bucket/ckpt")
+    put_object = s3.put_object
+
+    def fail_put(**kwargs):
+        raise ConnectionError("S3 is down")
+
+    s3.put_object = fail_put
+    with pytest.raises(ConnectionError):
+        store.commit("cn/1", 0, 10)
+    with pytest.raises(ConnectionError):
+        store.commit("cn/1", 10, 20)
+    s3.put_object = put_object
+    assert store.n_s3_put == 0
+
+    # a retried commit finds the local marker and uploads it
+    assert store.commit("cn/1", 0, 10) is False
+    assert store.n_s3_put == 1
+    assert store.commit("cn/1", 0, 10) is False
+    assert store.n_s3_put == 1
+
+    # listing the markers uploads the ones missing in S3 too
+    assert store.get_resume_offset("cn/1") == 20
+    assert store.n_s3_put == 2
+    store = CheckpointStore(tmp_path / "b", s3_client=s3, s3uri="s3://bucket/ckpt")
+    assert store.get_resume_offset("cn/1") == 20
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.checkpoint",
+        preview=False,
+    )
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import io
+import random
+
+import pytest
+
+zstandard = pytest.importorskip("zstandard")
+
+from sakura_gather.codec import DictionaryStore, PageCodec
+from sakura_gather.tests.fixture_site import render_template_page
+
+@pytest.fixture
+def pages():
+    rng = random.Random(1)
+    return [render_template_page(rng, i) for i in range(1200)]
+
+
+class TestPageCodec:
+    def test_round_trip(self, tmp_path, pages):
+        codec = PageCodec(DictionaryStore(tmp_path))
+        # no dictionary yet
+        blob = codec.compress("cn", pages[0])
+        assert codec.decompress(blob) == pages[0]
+
+        dict_id = codec.train("cn", pages[:1000], dict_size=16_384)
+        assert DictionaryStore(tmp_path).get_current_id("cn") == dict_id
+        frame = zstandard.get_frame_parameters(codec.compress("cn", pages[0]))
+        assert frame.dict_id == dict_id
+        # the old frame still decompresses
+        assert codec.decompress(blob) == pages[0]
+
+        test_pages = pages[1000:]
+        plain = zstandard.ZstdCompressor(level=9)
+        plain_size = sum(len(plain.compress(page)) for page in test_pages)
+        dict_size = sum(len(codec.compress("cn", page)) for page in test_pages)
+        raw_size = sum(len(page) for page in test_pages)
+        print(f"raw {raw_size}, zstd {plain_size}, zstd + dict {dict_size}")
+        assert dict_size * 3 < plain_size
+
+        # a new process loads the dictionary from the snapshot
+        codec = PageCodec(DictionaryStore(tmp_path))
+        for page in test_pages[:10]:
+            assert codec.decompress(codec.compress("cn", page)) == page
+        assert codec.decompress(codec.compress("en", page)) == page
+
+    def test_versions(self, tmp_path, pages):
+        store = DictionaryStore(tmp_path)
+        codec = PageCodec(store)
+        v1 = codec.train("cn", pages[:500], dict_size=8192)
+        blob_v1 = codec.compress("cn", pages[-1])
+        v2 = codec.train("cn", pages[500:1000], dict_size=8192)
+        assert v1 != v2
+        assert store.load_manifest()["history"]["cn"] == [v1, v2]
+        codec = PageCodec(store)
+        assert codec.decompress(blob_v1) == pages[-1]
+
+    def test_stream(self, tmp_path, pages):
+        codec = PageCodec(DictionaryStore(tmp_path))
+        codec.train("cn", pages[:1000], dict_size=16_384)
+        data = b"\n".join(pages)
+        fout = io.BytesIO()
+        n_read, n_written = codec.compress_stream("cn", io.BytesIO(data), fout)
+        assert n_read == len(data)
+        fout.seek(0)
+        result = io.BytesIO()
+        assert codec.decompress_stream(fout, result) == len(data)
+        assert result.getvalue() == data
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.codec",
+        preview=False,
+    )
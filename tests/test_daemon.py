@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from sakura_gather.daemon import DaemonConfig, CrawlDaemon
+
+
+class TestDaemonConfig:
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            DaemonConfig(lang_code_list=[])
+        with pytest.raises(ValueError):
+            DaemonConfig(lang_code_list=["cn"], concurrency=0)
+
+
+class TestCrawlDaemon:
+    def test_run_forever(self):
+        lock = threading.Lock()
+        node_ids = iter(range(1000))
+        calls = list()
+
+        def next_node_id_func():
+            with lock:
+                return next(node_ids)
+
+        def crawl_func(lang_code, node_id):
+            calls.append((lang_code, node_id))
+            if node_id == 1:
+                raise ValueError
+            return 10
+
+        daemon = CrawlDaemon(
+            crawl_func=crawl_func,
+            next_node_id_func=next_node_id_func,
+            config=DaemonConfig(
+                lang_code_list=["cn", "en"],
+                concurrency=2,
+                max_cycles=3,
+            ),
+        )
+        summaries = daemon.run_forever()
+        assert len(summaries) == 3
+        assert len(calls) == 12
+        assert summaries[0].n_succeeded == 3
+        assert summaries[0].n_failed == 1
+        assert summaries[0].n_item == 30
+        assert summaries[1].n_succeeded == 4
+        assert "items/s" in summaries[1].to_message()
+
+    def test_interleave_lang_codes(self):
+        calls = list()
+
+        def crawl_func(lang_code, node_id):
+            calls.append(lang_code)
+            return 1
+
+        daemon = CrawlDaemon(
+            crawl_func=crawl_func,
+            next_node_id_func=lambda: 0,
+            config=DaemonConfig(
+                lang_code_list=["cn", "en", "ja"],
+                concurrency=1,
+                max_cycles=2,
+            ),
+        )
+        summaries = daemon.run_forever()
+        # one shared worker, the lang codes take turns instead of running
+        # one after another, later turns follow the measured worker time
+        assert calls[:3] == ["cn", "en", "ja"]
+        assert len(calls) == 6
+        assert summaries[0].n_item_by_lang == {"cn": 1, "en": 1, "ja": 1}
+        assert "ja = 1" in summaries[0].to_message()
+
+    def test_lang_weights(self):
+        daemon = CrawlDaemon(
+            crawl_func=lambda lang_code, node_id: 1,
+            next_node_id_func=lambda: 0,
+            config=DaemonConfig(
+                lang_code_list=["cn", "en"],
+                concurrency=2,
+                max_cycles=3,
+                lang_weights={"cn": 3},
+            ),
+        )
+        # every work unit takes one second of worker time
+        daemon._run_one = lambda lang_code: (daemon._crawl_one(lang_code), 1.0)
+        summaries = daemon.run_forever()
+        for summary in summaries:
+            assert summary.n_item_by_lang == {"cn": 3, "en": 1}
+
+    def test_unknown_item_count(self):
+        daemon = CrawlDaemon(
+            crawl_func=lambda lang_code, node_id: None if node_id == 0 else 5,
+            next_node_id_func=iter(range(1000)).__next__,
+            config=DaemonConfig(lang_code_list=["cn"], concurrency=2, max_cycles=1),
+        )
+        summary = daemon.run_forever()[0]
+        assert summary.n_succeeded == 2
+        assert summary.n_item == 5
+        assert summary.n_unknown == 1
+        # a throughput from a partial count would be wrong, it is left out
+        assert summary.items_per_second is None
+        message = summary.to_message()
+        assert "items/s" not in message
+        assert "5 items reported" in message
+        assert "1 work units without an item count" in message
+
+    def test_request_stop(self):
+        daemon = None
+
+        def crawl_func(lang_code, node_id):
+            daemon.request_stop()
+            return 1
+
+        daemon = CrawlDaemon(
+            crawl_func=crawl_func,
+            next_node_id_func=lambda: 0,
+            config=DaemonConfig(lang_code_list=["cn"]),
+        )
+        summaries = daemon.run_forever()
+        assert len(summaries) == 1
+        assert summaries[0].n_succeeded == 1
+        assert daemon.is_stopping
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.daemon",
+        preview=False,
+    )
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import Counter
+
+import pytest
+
+from sakura_gather.distributed_rate_limit import (
+    InMemoryBucketStore,
+    DynamoDBBucketStore,
+    DistributedTokenBucket,
+)
+from sakura_gather.fetcher import Response, download_pages
+from sakura_gather.tests.mock_aws import TABLE_NAME
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_validate():
+    store = InMemoryBucketStore()
+    with pytest.raises(ValueError):
+        DistributedTokenBucket(store, "site", rate=0)
+    with pytest.raises(ValueError):
+        DistributedTokenBucket(store, "site", rate=1, hold=0)
+    with pytest.raises(ValueError):
+        DistributedTokenBucket(store, "site", rate=1, capacity=0)
+    with pytest.raises(ValueError):
+        DistributedTokenBucket(store, "site", rate=10, capacity=10).try_acquire(11)
+    assert DistributedTokenBucket(store, "site", rate=0.5).capacity == 1
+
+
+def check_bucket(store):
+    # binary fractions of a second, so the refills are exact
+    clock = FakeClock()
+    nodes = [
+        DistributedTokenBucket(
+            store, "site", rate=8, capacity=8, prefetch=3, hold=0.5, clock=clock
+        )
+        for _ in range(3)
+    ]
+    n_taken = 0
+    for _ in range(8):
+        for node in nodes:
+            n_taken += node.try_acquire()
+    assert n_taken == 8  # the full bucket, across all nodes
+    assert sum(node.n_granted for node in nodes) == 8
+    n_request = store.n_request
+    assert nodes[0].try_acquire() is False
+    assert nodes[0].get_wait() == 0.125
+
+    # 0.25 s refill 2 tokens, shared by all nodes
+    clock.now += 0.25
+    assert nodes[0].try_acquire()  # and pre-fetches the other one
+    assert nodes[1].try_acquire() is False
+    assert nodes[0].try_acquire()
+    assert store.n_request > n_request
+    assert sum(node.n_dropped for node in nodes) == 0
+
+    # unused pre-fetched tokens expire after hold seconds
+    clock.now += 0.375
+    assert nodes[0].try_acquire()
+    clock.now += 0.625
+    nodes[0].try_acquire()
+    assert nodes[0].n_dropped == 2
+
+
+def test_in_memory_store():
+    check_bucket(InMemoryBucketStore())
+
+
+def test_no_burst_across_a_boundary():
+    # a fixed window counter grants a full window on each side of a window
+    # boundary, the bucket only refills what the time between allows
+    clock = FakeClock(1000.96875)
+    limiter = DistributedTokenBucket(
+        InMemoryBucketStore(), "site", rate=64, capacity=10, prefetch=1, clock=clock
+    )
+    assert sum(limiter.try_acquire() for _ in range(20)) == 10
+    clock.now = 1001.03125
+    assert sum(limiter.try_acquire() for _ in range(20)) == 4
+
+
+def test_no_lock_during_take():
+    class SlowStore(InMemoryBucketStore):
+        def __init__(self):
+            super().__init__()
+            self.entered = threading.Event()
+            self.release = threading.Event()
+            self.slow = False
+
+        def take(self, key, n, rate, capacity, now):
+            if self.slow:
+                self.entered.set()
+                self.release.wait(5)
+            return super().take(key, n, rate, capacity, now)
+
+    clock = FakeClock()
+    store = SlowStore()
+    limiter = DistributedTokenBucket(
+        store, "site", rate=10, capacity=10, prefetch=3, clock=clock
+    )
+    assert limiter.try_acquire(2)  # 1 token left
+    store.slow = True
+    thread = threading.Thread(target=limiter.try_acquire, args=(2,))
+    thread.start()
+    assert store.entered.wait(5)
+    # the store request is in flight, the local token is still available
+    assert limiter.try_acquire(1)
+    store.release.set()
+    thread.join()
+    assert limiter.n_granted == 6
+
+    # tokens that expire while the store request is in flight are dropped
+    store.entered.clear()
+    store.release.clear()
+    result = list()
+    thread = threading.Thread(target=lambda: result.append(limiter.try_acquire(4)))
+    thread.start()
+    assert store.entered.wait(5)
+    clock.now += 1
+    store.release.set()
+    thread.join()
+    assert result == [False]
+    assert limiter.n_dropped == 1 + 3
+
+
+def test_dynamodb_store(dynamodb_client):
+    store = DynamoDBBucketStore(dynamodb_client, TABLE_NAME)
+    check_bucket(store)
+    item = dynamodb_client.get_item(
+        TableName=TABLE_NAME, Key={"id": {"S": "rate-limit#site"}}
+    )["Item"]
+    assert float(item["tokens"]["N"]) == 2
+    assert float(item["last_refill"]["N"]) == 1001.25
+    assert "expire_at" in item
+
+
+def test_dynamodb_store_conflict(dynamodb_client):
+    class RacedStore(DynamoDBBucketStore):
+        """
+        Another node takes between the read and the write of the first try.
+        """
+
+        def _get(self, key):
+            item = super()._get(key)
+            if self.n_conflict == 0 and item is not None:
+                other.take(key, 3, rate=10, capacity=10, now=1000.0)
+            return item
+
+    other = DynamoDBBucketStore(dynamodb_client, TABLE_NAME)
+    store = RacedStore(dynamodb_client, TABLE_NAME)
+    assert other.take("rate-limit#site", 5, rate=10, capacity=10, now=1000.0) == (
+        5,
+        5,
+    )
+    # the first write fails, the second read sees the take of the other node
+    assert store.take("rate-limit#site", 5, rate=10, capacity=10, now=1000.0) == (
+        2,
+        0,
+    )
+    assert store.n_conflict == 1
+
+
+def test_concurrent_nodes():
+    """
+    16 nodes ask at the same time, the grants never go above the bucket.
+
+    moto doesn't make a conditional update atomic across threads the way
+    DynamoDB does, so this runs on the in-memory store, the DynamoDB store is
+    checked sequentially above.
+    """
+    store = InMemoryBucketStore()
+    clock = FakeClock()
+    nodes = [
+        DistributedTokenBucket(
+            store, "site", rate=1000, capacity=100, prefetch=7, clock=clock
+        )
+        for _ in range(16)
+    ]
+    n_taken = Counter()
+    barrier = threading.Barrier(len(nodes))
+
+    def node_worker(i: int):
+        barrier.wait()
+        for _ in range(20):
+            n_taken[i] += nodes[i].try_acquire()
+
+    threads = [threading.Thread(target=node_worker, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # all of the bucket is granted, and tokens still held by a node are not
+    # granted again
+    assert sum(node.n_granted for node in nodes) == 100
+    assert sum(n_taken.values()) + sum(
+        node._n_local(clock()) for node in nodes
+    ) == 100
+
+
+def run_nodes(n_node: int, duration: float) -> list[float]:
+    """
+    Every node sends requests as fast as the shared limit allows, rate 200/s
+    with the default capacity of 20 and hold of 0.1 s. Returns the time of
+    every request.
+    """
+    store = InMemoryBucketStore()
+    times: list[float] = list()
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def node_worker():
+        limiter = DistributedTokenBucket(store, "site", rate=200)
+        while True:
+            limiter.acquire()
+            now = time.time()
+            if now >= deadline:
+                return
+            with lock:
+                times.append(now)
+            time.sleep(0.02)  # one node alone sends ~50 requests/s
+
+    threads = [threading.Thread(target=node_worker) for _ in range(n_node)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return times
+
+
+def max_in_span(times: list[float], span: float) -> int:
+    """
+    Max number of requests in any ``span`` seconds, not only in aligned
+    windows.
+    """
+    times = sorted(times)
+    i = 0
+    n_max = 0
+    for j, t in enumerate(times):
+        while times[i] <= t - span:
+            i += 1
+        n_max = max(n_max, j - i + 1)
+    return n_max
+
+
+def test_throughput_scales_up_to_the_rate():
+    one = len(run_nodes(1, 0.5))
+    two = len(run_nodes(2, 0.5))
+    times = run_nodes(16, 0.5)
+    assert one < 40
+    assert two > 1.5 * one  # more nodes, more throughput
+    assert len(times) > 2.5 * one
+    # but never more than capacity + rate * (span + hold) in any span,
+    # including the spans across what used to be a window boundary
+    for span in (0.05, 0.1, 0.25, 0.5):
+        assert max_in_span(times, span) <= 20 + 200 * (span + 0.1)
+
+
+def test_fetcher_waits_for_rate_limiter():
+    class Transport:
+        async def request(self, method, url, headers=None):
+            return Response(200, {}, b"")
+
+        async def close(self):
+            pass
+
+    store = InMemoryBucketStore()
+    limiter = DistributedTokenBucket(store, "site", rate=50)
+    start = time.perf_counter()
+    results = download_pages(
+        [f"http://site/{i}" for i in range(12)],
+        transport=Transport(),
+        rate_limiter=limiter,
+    )
+    assert all(res.ok for res in results)
+    assert limiter.n_granted >= 12
+    # 5 in the full bucket, the other 7 at 50 per second
+    assert time.perf_counter() - start >= 0.1
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.distributed_rate_limit",
+        preview=False,
+    )
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from sakura_gather.fair_share import FairShareScheduler
+
+
+class TestFairShareScheduler:
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            FairShareScheduler(["cn"], weights={"en": 1})
+        with pytest.raises(ValueError):
+            FairShareScheduler(["cn"], weights={"cn": 0})
+        with pytest.raises(ValueError):
+            FairShareScheduler(["cn"]).acquire([])
+
+    def test_round_robin(self):
+        fair = FairShareScheduler(["cn", "en", "ja"])
+        picks = list()
+        for _ in range(6):
+            key = fair.acquire()
+            fair.release(key, cost=1.0)
+            picks.append(key)
+        assert picks == ["cn", "en", "ja", "cn", "en", "ja"]
+
+    def test_weights(self):
+        fair = FairShareScheduler(["cn", "en"], weights={"cn": 2})
+        picks = list()
+        for _ in range(300):
+            key = fair.acquire()
+            fair.release(key, cost=1.0)
+            picks.append(key)
+        assert picks.count("cn") == 200
+
+    def test_cost(self):
+        # en work units are 3 times slower, so en gets 1/3 of the turns
+        fair = FairShareScheduler(["cn", "en"])
+        cost = {"cn": 1.0, "en": 3.0}
+        picks = list()
+        for _ in range(400):
+            key = fair.acquire()
+            fair.release(key, cost=cost[key])
+            picks.append(key)
+        assert abs(picks.count("cn") - 300) <= 3
+
+    def test_inflight(self):
+        # running work units count with their expected cost
+        fair = FairShareScheduler(["cn", "en"])
+        assert fair.acquire() == "cn"
+        assert fair.acquire() == "en"
+        assert fair.acquire(["cn"]) == "cn"
+        assert fair.acquire() == "en"
+        assert fair.n_acquire == {"cn": 2, "en": 2}
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.fair_share",
+        preview=False,
+    )
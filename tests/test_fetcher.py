@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+
+import pytest
+
+from sakura_gather.fetcher import (
+    Response,
+    RetryPolicy,
+    parse_retry_after,
+    AsyncFetcher,
+    download_pages,
+)
+from sakura_gather.tests.fixture_site import run_fixture_site, UrllibTransport
+
+
+class CountingTransport:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, url, headers=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return Response(200, {}, url.encode())
+
+    async def close(self):
+        pass
+
+
+def test_retry_policy():
+    policy = RetryPolicy(base_delay=1, max_delay=3)
+    for attempt in range(1, 6):
+        assert 0 <= policy.get_delay(attempt) <= 3
+    assert policy.get_delay(1, retry_after=2.5) >= 2.5
+    assert parse_retry_after({"retry-after": "3"}) == 3
+    assert parse_retry_after({"Retry-After": "date"}) is None
+    assert parse_retry_after({}) is None
+
+
+def test_per_host_concurrency():
+    transport = CountingTransport(delay=0.01)
+    urls = [f"http://example.com/video/{i}" for i in range(20)]
+    results = download_pages(
+        urls,
+        transport=transport,
+        max_concurrency=10,
+        max_concurrency_per_host=3,
+    )
+    assert [res.body.decode() for res in results] == urls
+    assert transport.max_in_flight == 3
+
+
+def test_fixture_site():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+    with run_fixture_site() as (base_url, hits):
+        results = download_pages(
+            [
+                f"{base_url}/video/1",
+                f"{base_url}/flaky/2/2",
+                f"{base_url}/status/503",
+                f"{base_url}/status/404",
+                "http://127.0.0.1:1/video/1",
+            ],
+            transport=UrllibTransport(),
+            retry_policy=policy,
+        )
+    assert results[0].ok and b"Video 1" in results[0].body
+    assert results[1].ok and results[1].n_attempt == 3
+    assert results[2].status == 503 and results[2].n_attempt == 3
+    assert results[3].status == 404 and results[3].n_attempt == 1
+    assert results[4].ok is False and results[4].error is not None
+
+
+def test_rate_per_host():
+    transport = CountingTransport(delay=0)
+    start = time.perf_counter()
+    download_pages(
+        [f"http://example.com/video/{i}" for i in range(6)],
+        transport=transport,
+        rate_per_host=50,
+        burst_per_host=1,
+    )
+    assert time.perf_counter() - start >= 0.09
+
+
+def test_aiohttp_transport():
+    pytest.importorskip("aiohttp")
+    with run_fixture_site() as (base_url, hits):
+        results = download_pages([f"{base_url}/video/{i}" for i in range(10)])
+    assert all(res.ok for res in results)
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.fetcher",
+        preview=False,
+    )
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import sqlite3
+
+import pytest
+
+from sakura_gather.frontier import BloomFilter, ScalableBloomFilter, Frontier
+
+
+class TestBloomFilter:
+    def test_add_contains(self, tmp_path):
+        bloom = BloomFilter(tmp_path / "bloom.bin", capacity=1000, error_rate=0.01)
+        assert bloom.add("a") is True
+        assert bloom.add("a") is False
+        assert "a" in bloom
+        assert "b" not in bloom
+        assert bloom.n_item == 1
+        bloom.close()
+
+        # reopen, parameters and bits come from the file
+        bloom = BloomFilter(tmp_path / "bloom.bin")
+        assert bloom.capacity == 1000
+        assert bloom.n_item == 1
+        assert "a" in bloom
+        bloom.close()
+
+    def test_false_positive_rate(self, tmp_path):
+        bloom = BloomFilter(tmp_path / "bloom.bin", capacity=10_000, error_rate=0.01)
+        for i in range(10_000):
+            bloom.add(f"in-{i}")
+        assert all(f"in-{i}" in bloom for i in range(10_000))
+        n_fp = sum(1 for i in range(10_000) if f"out-{i}" in bloom)
+        assert n_fp / 10_000 < 0.02
+        bloom.close()
+
+    def test_bad_file(self, tmp_path):
+        path = tmp_path / "bloom.bin"
+        path.write_bytes(b"x" * 64)
+        with pytest.raises(ValueError):
+            BloomFilter(path)
+
+
+class TestScalableBloomFilter:
+    def test_grow(self, tmp_path):
+        bloom = ScalableBloomFilter(
+            tmp_path / "bloom", initial_capacity=100, error_rate=0.01
+        )
+        n_new = sum(bloom.add(f"in-{i}") for i in range(1000))
+        assert n_new >= 990  # a few false positives are allowed
+        assert len(bloom.slices) == 4  # 100 + 200 + 400 + 800
+        assert all(f"in-{i}" in bloom for i in range(1000))
+        n_fp = sum(1 for i in range(10_000) if f"out-{i}" in bloom)
+        assert n_fp / 10_000 < 0.01
+        bloom.close()
+
+        bloom = ScalableBloomFilter(tmp_path / "bloom", initial_capacity=100)
+        assert len(bloom.slices) == 4
+        assert len(bloom) == n_new
+        assert "in-0" in bloom
+        bloom.close()
+
+
+class TestFrontier:
+    def test_priority_order(self, tmp_path):
+        with Frontier(tmp_path) as frontier:
+            assert frontier.push_many(["low-1", "low-2"], priority=0) == 2
+            assert frontier.push_many(["high-1", "high-2"], priority=10) == 2
+            assert frontier.push("low-1", priority=100) is False  # seen
+            assert frontier.is_seen("low-1")
+            assert frontier.n_pending() == 4
+            items = frontier.pop(3)
+            assert [item.url for item in items] == ["high-1", "high-2", "low-1"]
+            assert frontier.n_pending() == 1
+            assert frontier.n_taken() == 3
+            frontier.ack([item.id for item in items])
+            assert frontier.n_taken() == 0
+            assert [item.url for item in frontier.pop(10)] == ["low-2"]
+            assert frontier.pop(10) == []
+
+    def test_survive_restart(self, tmp_path):
+        with Frontier(tmp_path) as frontier:
+            frontier.push_many([f"url-{i}" for i in range(100)])
+            items = frontier.pop(10, now=1000)
+            frontier.ack([item.id for item in items[:5]])
+
+        # the 5 taken but not acknowledged urls come back after the timeout
+        with Frontier(tmp_path) as frontier:
+            assert frontier.push_many([f"url-{i}" for i in range(100)]) == 0
+            assert frontier.n_pending() == 90
+            assert frontier.requeue_stale(timeout=60, now=1030) == 0
+            assert frontier.requeue_stale(timeout=60, now=1100) == 5
+            urls = [item.url for item in frontier.pop(100)]
+            assert len(urls) == 95
+            assert urls[:5] == [f"url-{i}" for i in range(5, 10)]
+
+    def test_bloom_false_positive(self, tmp_path, monkeypatch):
+        with Frontier(tmp_path) as frontier:
+            assert frontier.push("a") is True
+            # every url looks seen to the Bloom filter, the seen table decides
+            monkeypatch.setattr(
+                ScalableBloomFilter, "__contains__", lambda self, key: True
+            )
+            assert frontier.is_seen("a")
+            assert not frontier.is_seen("b")
+            assert frontier.push_many(["a", "b", "b"]) == 1
+            assert frontier.n_pending() == 2
+
+    def test_lost_bloom_filter(self, tmp_path):
+        with Frontier(tmp_path) as frontier:
+            assert frontier.push_many(["a", "b"]) == 2
+        shutil.rmtree(tmp_path / "bloom")
+        with Frontier(tmp_path) as frontier:
+            assert len(frontier.bloom) == 0
+            assert frontier.push_many(["a", "b", "c"]) == 1
+            # the bits of the known urls are back
+            assert "a" in frontier.bloom and "b" in frontier.bloom
+            assert frontier.push_many(["a", "b", "c"]) == 0
+            assert frontier.n_pending() == 3
+
+    def test_failed_push(self, tmp_path):
+        with Frontier(tmp_path) as frontier:
+            with pytest.raises(sqlite3.IntegrityError):
+                frontier.push_many(["a", "b"], priority=None)
+            # rolled back, the urls are still unseen
+            assert not frontier.is_seen("a")
+            assert len(frontier.bloom) == 0
+            assert frontier.push_many(["a", "b"]) == 2
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.frontier",
+        preview=False,
+    )
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import tracemalloc
+
+import pytest
+
+from sakura_gather.html_db_stream import (
+    S3RangeReader,
+    open_html_db,
+    iter_entries,
+    iter_chunks,
+)
+
+
+def make_entry(i: int) -> dict:
+    return {"video_id": f"v-{i}", "url": f"https://site/video/{i}", "title": "x" * 200}
+
+
+def write_html_db(path, n: int):
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wb") as f:
+        for i in range(n):
+            f.write(json.dumps(make_entry(i)).encode("utf-8") + b"\n")
+            if i == 3:
+                f.write(b"\n")  # blank lines are skipped
+
+
+@pytest.mark.parametrize("name", ["db.jsonl", "db.jsonl.gz"])
+def test_iter_local(tmp_path, name):
+    path = tmp_path / name
+    write_html_db(path, 250)
+    assert list(iter_entries(path)) == [make_entry(i) for i in range(250)]
+    chunks = list(iter_chunks(path, chunk_size=100))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert chunks[2][-1] == make_entry(249)
+
+
+def test_memory_is_bounded(tmp_path):
+    path = tmp_path / "db.jsonl.gz"
+    write_html_db(path, 100_000)  # ~30 MB of entries
+
+    tracemalloc.start()
+    chunks = iter_chunks(path, chunk_size=100)
+    first = next(chunks)
+    _, peak_first = tracemalloc.get_traced_memory()
+    n = len(first) + sum(len(chunk) for chunk in chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert n == 100_000
+    # the first chunk doesn't wait for the rest of the file
+    assert peak_first < 2 * 1024 * 1024
+    # and memory doesn't grow with the file
+    assert peak < 2 * 1024 * 1024
+
+
+@pytest.fixture
+def s3_client(s3_client):
+    s3_client.create_bucket(Bucket="bucket")
+    return s3_client
+
+
+def test_s3_range_reader(s3_client):
+    data = bytes(range(256)) * 40  # 10240 bytes
+    s3_client.put_object(Bucket="bucket", Key="a.bin", Body=data)
+    with pytest.raises(ValueError):
+        S3RangeReader(s3_client, "bucket", "a.bin", block_size=0)
+    for prefetch in [True, False]:
+        reader = S3RangeReader(
+            s3_client, "bucket", "a.bin", block_size=1000, prefetch=prefetch
+        )
+        assert reader.read(10) == data[:10]
+        assert reader.read() == data[10:]
+        assert reader.read(10) == b""
+        assert reader.n_get == 11
+        reader.close()
+
+
+@pytest.mark.parametrize("key", ["db.jsonl", "db.jsonl.gz"])
+def test_iter_s3(tmp_path, s3_client, key):
+    path = tmp_path / key
+    write_html_db(path, 1000)
+    s3_client.upload_file(str(path), "bucket", key)
+    with pytest.raises(ValueError):
+        open_html_db(f"s3://bucket/{key}")
+    chunks = list(
+        iter_chunks(
+            f"s3://bucket/{key}",
+            chunk_size=300,
+            s3_client=s3_client,
+            block_size=16 * 1024,
+        )
+    )
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    entries = [entry for chunk in chunks for entry in chunk]
+    assert entries == [make_entry(i) for i in range(1000)]
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.html_db_stream",
+        preview=False,
+    )
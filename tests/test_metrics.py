@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from sakura_gather.metrics import get_peak_rss, percentile
+
+
+def test_get_peak_rss():
+    assert get_peak_rss() > 0
+
+
+def test_percentile():
+    assert percentile([], 50) == 0
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(101)), 99) == 99
+    assert percentile([5], 99) == 5
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.metrics",
+        preview=False,
+    )
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import Counter
+
+import pytest
+
+from sakura_gather.node_id import NodeIdDispenser
+from sakura_gather.tests.mock_aws import TABLE_NAME, SerializedClient
+
+
+@pytest.fixture
+def client(dynamodb_client):
+    return dynamodb_client
+
+
+def test_validate(client):
+    with pytest.raises(ValueError):
+        NodeIdDispenser(client, TABLE_NAME, block_size=0)
+    with pytest.raises(ValueError):
+        NodeIdDispenser(client, TABLE_NAME, n_shard=0)
+    with pytest.raises(ValueError):
+        NodeIdDispenser(client, TABLE_NAME, n_node=0)
+
+
+def test_blocks(client):
+    dispenser = NodeIdDispenser(client, TABLE_NAME, block_size=4, n_shard=2, seed=1)
+    ids = [dispenser.next_id() for _ in range(12)]
+    assert len(set(ids)) == 12
+    assert dispenser.n_claim == 3  # one write per block of 4
+    assert {id // 4 for id in ids} == {0, 1, 2}  # blocks of both shards
+    # the first id of a block rotates with the block number
+    assert ids[0] % 4 == (ids[0] // 4) % 4
+
+    other = NodeIdDispenser(client, TABLE_NAME, block_size=4, n_shard=2, seed=1)
+    assert not set(other.next_id() for _ in range(8)) & set(ids)
+
+    wrapped = NodeIdDispenser(client, TABLE_NAME, n_node=3, block_size=4, n_shard=2)
+    assert all(0 <= wrapped() < 3 for _ in range(20))
+
+
+def test_concurrent_workers(client):
+    """
+    120 workers start at once, like at the top of the hourly cron, each with
+    its own dispenser, and take 10 node ids each.
+
+    moto's ``ADD`` is not atomic, it reads, adds and writes the item in
+    separate steps, so concurrent claims could get the same block. The
+    claims go through :class:`SerializedClient`: this checks the block
+    arithmetic and the locking of the dispensers, not contention on the
+    counter items. ``tests_load/test_node_id_contention.py`` claims
+    concurrently, on DynamoDB Local when it is available.
+    """
+    n_worker, n_id, n_node = 120, 10, 50
+    client = SerializedClient(client)
+    dispensers = [
+        NodeIdDispenser(
+            client, TABLE_NAME, n_node=n_node, block_size=5, n_shard=8, seed=i
+        )
+        for i in range(n_worker)
+    ]
+    ids: list[int] = list()
+    node_ids: list[int] = list()
+    lock = threading.Lock()
+    barrier = threading.Barrier(n_worker)
+
+    def worker(dispenser: NodeIdDispenser):
+        barrier.wait()
+        got = [dispenser.next_id() for _ in range(n_id)]
+        with lock:
+            ids.extend(got)
+            node_ids.extend(id % n_node for id in got)
+
+    threads = [threading.Thread(target=worker, args=(d,)) for d in dispensers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ids) == n_worker * n_id
+    assert len(set(ids)) == len(ids)  # no id handed out twice
+    # 2 writes per worker instead of 10, and never a retry
+    assert sum(d.n_claim for d in dispensers) == n_worker * n_id // 5
+    # every node gets about the same number of work units
+    counts = Counter(node_ids)
+    assert len(counts) == n_node
+    assert max(counts.values()) <= 2 * min(counts.values())
+
+
+def test_claim_block_thread_safe(client):
+    # serialized for moto, see test_concurrent_workers
+    dispenser = NodeIdDispenser(
+        SerializedClient(client), TABLE_NAME, block_size=1, n_shard=4, seed=1
+    )
+    blocks = list()
+    lock = threading.Lock()
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        got = [dispenser.claim_block()[0] for _ in range(10)]
+        with lock:
+            blocks.extend(got)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the shards are visited in turn, the blocks are 0 to 79
+    assert sorted(blocks) == list(range(80))
+    assert dispenser.n_claim == 80
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.node_id",
+        preview=False,
+    )
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from sakura_gather.fetcher import Response, AsyncFetcher
+from sakura_gather.page_cache import PageCache, fetch_with_cache
+from sakura_gather.tests.fixture_site import run_fixture_site, UrllibTransport
+
+
+class TestPageCache:
+    def test_put_get(self, tmp_path):
+        with PageCache(tmp_path, n_slot=4) as cache:
+            assert cache.get("http://a/1") is None
+            assert cache.conditional_headers("http://a/1") == {}
+
+            cache.put("http://a/1", b"hello", etag='"e1"', last_modified="lm")
+            assert cache.get("http://a/1") == b"hello"
+            assert cache.conditional_headers("http://a/1") == {
+                "If-None-Match": '"e1"',
+                "If-Modified-Since": "lm",
+            }
+
+            # content addressed, identical bodies are stored once
+            cache.put("http://a/2", b"hello")
+            assert len(list(cache.dir_objects.glob("*/*"))) == 1
+
+            # replace, the index grows past the initial slots
+            for i in range(10):
+                cache.put(f"http://a/{i}", f"body-{i}".encode())
+            assert len(cache) == 10
+            assert cache.get("http://a/1") == b"body-1"
+            assert cache.total_size == sum(len(f"body-{i}") for i in range(10))
+
+            cache.remove("http://a/1")
+            assert cache.get("http://a/1") is None
+            assert len(cache) == 9
+
+        # the index survives reopen
+        with PageCache(tmp_path) as cache:
+            assert cache.get("http://a/2") == b"body-2"
+
+    def test_shared_body(self, tmp_path):
+        with PageCache(tmp_path) as cache:
+            cache.put("http://a/1", b"same")
+            cache.put("http://a/2", b"same")
+            # one url changes, the body is still used by the other
+            cache.put("http://a/1", b"new")
+            assert cache.get("http://a/2") == b"same"
+            # the same body again for the same url
+            cache.put("http://a/2", b"same")
+            assert cache.get("http://a/2") == b"same"
+        # the reference counts are rebuilt on open
+        with PageCache(tmp_path) as cache:
+            cache.remove("http://a/2")
+            assert len(list(cache.dir_objects.glob("*/*"))) == 1
+            cache.remove("http://a/1")
+            assert len(list(cache.dir_objects.glob("*/*"))) == 0
+
+    def test_lru_eviction(self, tmp_path):
+        with PageCache(tmp_path, max_bytes=100, low_watermark=0.5) as cache:
+            for i in range(4):
+                cache.put(f"http://a/{i}", bytes([i]) * 20)
+            cache.get("http://a/0")  # now the most recently used
+            cache.put("http://a/4", b"x" * 30)  # 110 bytes > 100
+            assert cache.total_size <= 50
+            assert cache.lookup("http://a/0") is not None
+            assert cache.lookup("http://a/1") is None
+            assert cache.lookup("http://a/4") is not None
+            assert len(list(cache.dir_objects.glob("*/*"))) == len(cache)
+
+    def test_fetch_with_cache(self, tmp_path):
+        async def main(url):
+            async with AsyncFetcher(transport=UrllibTransport()) as fetcher:
+                return await fetch_with_cache(fetcher, cache, url)
+
+        with PageCache(tmp_path) as cache:
+            with run_fixture_site() as (base_url, hits):
+                url = f"{base_url}/video/1"
+                res1 = asyncio.run(main(url))
+                res2 = asyncio.run(main(url))
+        assert res1.ok and not res1.not_modified
+        assert res2.not_modified
+        assert res2.body == res1.body
+
+    def test_refetch_after_eviction_is_cached(self, tmp_path):
+        cache = PageCache(tmp_path)
+
+        class EvictingTransport:
+            async def request(self, method, url, headers=None):
+                if headers and "If-None-Match" in headers:
+                    cache.remove(url)  # evicted while the request is in flight
+                    return Response(304, {}, b"")
+                return Response(200, {"ETag": '"e2"'}, b"fresh")
+
+            async def close(self):
+                pass
+
+        async def main(url):
+            async with AsyncFetcher(transport=EvictingTransport()) as fetcher:
+                return await fetch_with_cache(fetcher, cache, url)
+
+        with cache:
+            url = "http://a/1"
+            cache.put(url, b"old", etag='"e1"')
+            res = asyncio.run(main(url))
+            assert res.ok and res.body == b"fresh"
+            assert cache.get(url) == b"fresh"
+            assert cache.lookup(url).etag == '"e2"'
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.page_cache",
+        preview=False,
+    )
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pc = pytest.importorskip("pyarrow.compute")
+
+from sakura_gather.parquet_snapshot import (
+    get_snapshot_dir,
+    write_snapshot,
+    read_snapshot,
+    convert_jsonl_snapshot,
+    get_row_group_stats,
+)
+from sakura_gather.records import RecordStore
+
+
+def make_records(n: int, lang_code: str, shard: int):
+    for i in range(n):
+        yield dict(
+            video_id=f"{lang_code}-{shard}-{i}",
+            title=f"title {i}",
+            duration=i,
+            tags=["a", "b"],
+            lang_code=lang_code,
+            shard=shard,
+        )
+
+
+def test_write_read(tmp_path):
+    dir_snapshot = get_snapshot_dir(tmp_path, "abc")
+    records = list(make_records(100, "cn", 0)) + list(make_records(50, "en", 1))
+    n = write_snapshot(records, dir_snapshot, batch_size=30, row_group_size=30)
+    assert n == 150
+    assert (dir_snapshot / "lang_code=cn" / "shard=0").exists()
+
+    table = read_snapshot(
+        dir_snapshot,
+        columns=["video_id", "duration"],
+        filter=(pc.field("lang_code") == "en") & (pc.field("duration") >= 40),
+    )
+    assert table.column_names == ["video_id", "duration"]
+    assert sorted(table.column("video_id").to_pylist()) == [
+        f"en-1-{i}" for i in range(40, 50)
+    ]
+
+    path = next((dir_snapshot / "lang_code=cn" / "shard=0").glob("*.parquet"))
+    stats = get_row_group_stats(path, "duration")
+    assert len(stats) == 4
+    assert stats[0] == (0, 29)
+
+    assert write_snapshot([], tmp_path / "empty") == 0
+
+
+def test_schema_widens(tmp_path):
+    dir_snapshot = tmp_path / "parquet"
+    records = [
+        dict(video_id=f"v-{i}", rating=None, lang_code="cn", shard=0)
+        for i in range(10)
+    ]
+    # a column that was all null gets a type, a new field shows up
+    records += [
+        dict(video_id=f"v-{i}", rating=4.5, studio="s", lang_code="cn", shard=0)
+        for i in range(10, 20)
+    ]
+    records += [dict(video_id=f"v-{i}", lang_code="en", shard=1) for i in range(20, 30)]
+    assert write_snapshot(records, dir_snapshot, batch_size=10) == 30
+    table = read_snapshot(dir_snapshot)
+    assert table.schema.field("rating").type == pa.float64()
+    rows = {row["video_id"]: row for row in table.to_pylist()}
+    assert rows["v-0"]["rating"] is None and rows["v-0"]["studio"] is None
+    assert rows["v-15"]["rating"] == 4.5 and rows["v-15"]["studio"] == "s"
+    assert rows["v-25"]["lang_code"] == "en"
+
+    # a smaller snapshot written to the same place leaves no stale files
+    write_snapshot(list(make_records(5, "cn", 0)), dir_snapshot)
+    table = read_snapshot(dir_snapshot, filter=pc.field("lang_code") == "cn")
+    assert table.num_rows == 5
+
+
+def test_stale_files_of_a_later_generation(tmp_path):
+    dir_snapshot = tmp_path / "parquet"
+    old = [dict(video_id=f"old{i}", lang_code="en", shard=1) for i in range(3)]
+    write_snapshot(old, dir_snapshot)
+    # en/1 is first written by the second generation
+    records = [dict(video_id=f"cn{i}", lang_code="cn", shard=0) for i in range(5)]
+    records += [
+        dict(video_id=f"en{i}", studio="s", lang_code="en", shard=1) for i in range(2)
+    ]
+    assert write_snapshot(records, dir_snapshot, batch_size=5) == 7
+    table = read_snapshot(dir_snapshot)
+    assert sorted(table.column("video_id").to_pylist()) == sorted(
+        record["video_id"] for record in records
+    )
+    # the hidden write directory is gone
+    assert sorted(path.name for path in dir_snapshot.iterdir()) == [
+        "_common_metadata",
+        "lang_code=cn",
+        "lang_code=en",
+    ]
+
+
+def test_write_record_store(tmp_path):
+    store = RecordStore(
+        {
+            "video_id": "str",
+            "title": "str",
+            "duration": "int",
+            "tags": "category_list",
+            "lang_code": "category",
+            "shard": "int",
+        }
+    )
+    store.extend(make_records(100, "cn", 0))
+    store.extend(make_records(50, "en", 1))
+    dir_snapshot = tmp_path / "parquet"
+    assert write_snapshot(store, dir_snapshot, batch_size=30) == 150
+    table = read_snapshot(dir_snapshot, filter=pc.field("lang_code") == "en")
+    assert table.num_rows == 50
+    assert table.column("tags").to_pylist()[0] == ["a", "b"]
+    assert write_snapshot(RecordStore({"a": "int"}), tmp_path / "empty") == 0
+
+
+def test_convert_jsonl_snapshot(tmp_path):
+    path = tmp_path / "part-0.jsonl.gz"
+    with gzip.open(path, "wt") as f:
+        for record in make_records(10, "cn", 0):
+            record.pop("lang_code")
+            record.pop("shard")
+            f.write(json.dumps(record) + "\n")
+    dir_snapshot = tmp_path / "parquet"
+    n = convert_jsonl_snapshot([path], dir_snapshot, lang_code="cn", shard=3)
+    assert n == 10
+    table = read_snapshot(dir_snapshot)
+    assert set(table.column("lang_code").to_pylist()) == {"cn"}
+    assert set(table.column("shard").to_pylist()) == {3}
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.parquet_snapshot",
+        preview=False,
+    )
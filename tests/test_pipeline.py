@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+
+import pytest
+
+from sakura_gather.fetcher import Response, AsyncFetcher, RetryPolicy
+from sakura_gather.pipeline import CrawlPipeline
+from sakura_gather.tests.fixture_site import (
+    run_fixture_site,
+    render_video_page,
+    parse_video_page,
+    UrllibTransport,
+)
+
+
+@pytest.mark.parametrize("use_shared_memory", [True, False])
+def test_pipeline(use_shared_memory):
+    fetcher_factory = functools.partial(
+        AsyncFetcher,
+        transport=UrllibTransport(),
+        max_concurrency=4,
+        retry_policy=RetryPolicy(max_attempts=1),
+    )
+    pipeline = CrawlPipeline(
+        parse_func=parse_video_page,
+        fetcher_factory=fetcher_factory,
+        n_parser=2,
+        batch_size=4,
+        queue_size=4,
+        max_inflight_batches=1,
+        use_shared_memory=use_shared_memory,
+    )
+    results = dict()
+    errors = list()
+    with run_fixture_site() as (base_url, hits):
+        urls = [f"{base_url}/video/{i}" for i in range(30)]
+        urls.append(f"{base_url}/status/404")
+        stats = pipeline.run(
+            urls,
+            on_result=lambda url, parsed: results.__setitem__(url, parsed),
+            on_fetch_error=errors.append,
+        )
+    assert len(results) == 30
+    assert results[f"{base_url}/video/7"]["video_id"] == "7"
+    assert results[f"{base_url}/video/7"]["tags"] == ["tag-a", "tag-b"]
+    assert [res.status for res in errors] == [404]
+    assert stats.n_fetch_error == 1
+    assert stats.parse.n_item == 30
+    assert stats.fetch.n_item == 31
+    assert 0 < stats.parse.utilization(stats.wall) <= 1
+    assert stats.bottleneck() in ("fetch", "parse")
+    assert "pages/s" in stats.to_message()
+
+
+def test_fetch_busy_is_transport_time():
+    class SlowTransport:
+        async def request(self, method, url, headers=None):
+            await asyncio.sleep(0.01)
+            return Response(200, {}, render_video_page(url.rsplit("/", 1)[1]))
+
+        async def close(self):
+            pass
+
+    # the rate limit makes the fetch stage wait much longer than it works
+    fetcher_factory = functools.partial(
+        AsyncFetcher,
+        transport=SlowTransport(),
+        max_concurrency=1,
+        rate_per_host=20,
+        burst_per_host=1,
+    )
+    pipeline = CrawlPipeline(
+        parse_func=parse_video_page,
+        fetcher_factory=fetcher_factory,
+        n_parser=1,
+        use_shared_memory=False,
+    )
+    stats = pipeline.run(
+        [f"http://example.com/video/{i}" for i in range(10)],
+        on_result=lambda url, parsed: None,
+    )
+    assert stats.wall >= 0.4
+    assert 0.1 <= stats.fetch.busy < 0.3
+    assert stats.fetch.utilization(stats.wall) < 0.5
+
+
+def test_fetch_stage_error():
+    def fetcher_factory():
+        raise RuntimeError("no fetcher")
+
+    def urls():
+        yield "http://example.com/video/1"
+        raise ValueError("broken url source")
+
+    class Transport:
+        async def request(self, method, url, headers=None):
+            return Response(200, {}, render_video_page(url.rsplit("/", 1)[1]))
+
+        async def close(self):
+            pass
+
+    pipeline = CrawlPipeline(
+        parse_func=parse_video_page,
+        fetcher_factory=fetcher_factory,
+        n_parser=1,
+        use_shared_memory=False,
+    )
+    with pytest.raises(RuntimeError, match="no fetcher"):
+        pipeline.run(["http://example.com/video/1"], on_result=print)
+
+    pipeline.fetcher_factory = functools.partial(
+        AsyncFetcher, transport=Transport(), max_concurrency=1
+    )
+    results = list()
+    with pytest.raises(ValueError, match="broken url source"):
+        pipeline.run(urls(), on_result=lambda url, parsed: results.append(url))
+    # the page fetched before the error is still parsed
+    assert results == ["http://example.com/video/1"]
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.pipeline",
+        preview=False,
+    )
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from sakura_gather.rate_limit import TokenBucket
+
+
+class TestTokenBucket:
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0)
+
+    def test_reserve(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        delay = bucket.reserve()
+        assert 0.05 < delay <= 0.1
+
+    def test_try_acquire(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        assert bucket.try_acquire() is True
+        assert bucket.try_acquire() is False
+        time.sleep(0.02)
+        assert bucket.try_acquire() is True
+
+    def test_acquire(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.perf_counter()
+        for _ in range(6):
+            bucket.acquire()
+        assert time.perf_counter() - start >= 0.09
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.rate_limit",
+        preview=False,
+    )
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import tracemalloc
+
+import pytest
+
+from sakura_gather.records import RecordStore
+from sakura_gather.snapshot_diff import FingerprintIndex
+from sakura_gather.status_tracking import serialize
+
+SCHEMA = {
+    "video_id": "str",
+    "title": "str",
+    "duration": "int",
+    "score": "float",
+    "is_hd": "bool",
+    "tags": "category_list",
+    "lang_code": "category",
+    "shard": "int",
+}
+
+
+def make_record(i: int) -> dict:
+    return dict(
+        video_id=f"v-{i}",
+        title=f"video title number {i}",
+        duration=60 + i % 3600,
+        score=i / 7,
+        is_hd=i % 2 == 0,
+        tags=[f"tag-{i % 50}", f"tag-{i % 7}", "common"],
+        lang_code=["cn", "en", "ja"][i % 3],
+        shard=i % 8,
+    )
+
+
+def measure(func) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        obj = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return obj, size
+
+
+class TestRecordStore:
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            RecordStore({"a": "complex"})
+        store = RecordStore({"a": "int"})
+        with pytest.raises(ValueError):
+            store.append({"b": 1})
+
+    def test_bad_value_leaves_store_unchanged(self):
+        store = RecordStore(
+            {"video_id": "str", "duration": "int", "tags": "category_list"}
+        )
+        store.append({"video_id": "a", "duration": 3})
+        for record in [
+            {"video_id": "b", "duration": "x"},
+            {"video_id": "b", "duration": 2**63},
+            {"video_id": 1, "duration": 1},
+            {"video_id": "b", "tags": "not a list"},
+        ]:
+            with pytest.raises((TypeError, OverflowError)):
+                store.append(record)
+        assert len(store) == 1
+        assert all(column.n == 1 for column in store.columns.values())
+        store.append({"video_id": "c", "duration": 4, "tags": ["t"]})
+        assert [record.to_dict() for record in store] == [
+            {"video_id": "a", "duration": 3, "tags": None},
+            {"video_id": "c", "duration": 4, "tags": ["t"]},
+        ]
+
+    def test_round_trip(self):
+        store = RecordStore(SCHEMA)
+        records = [make_record(i) for i in range(100)]
+        records.append(dict(video_id="missing"))
+        store.extend(records)
+        assert len(store) == 101
+        for record, view in zip(records, store):
+            assert view.to_dict() == {k: record.get(k) for k in SCHEMA}
+        assert dict(store[-1])["tags"] is None
+        assert store[0].lang_code == "cn"
+        assert store[1]["is_hd"] is False
+        assert store.column("shard")[:3] == [0, 1, 2]
+        with pytest.raises(IndexError):
+            _ = store[101]
+        with pytest.raises(AttributeError):
+            _ = store[0].not_a_field
+        assert "RecordView" in repr(store[0])
+
+    def test_interned(self):
+        store = RecordStore(SCHEMA)
+        store.extend(make_record(i) for i in range(1000))
+        # 50 + 7 tags (tag-0 .. tag-6 overlap), "common" and 3 lang codes
+        assert len(store.dictionary.values) == 54
+        assert store[0]["tags"][2] is store[1]["tags"][2]
+
+    def test_accepted_as_mapping(self):
+        store = RecordStore(SCHEMA)
+        store.extend(make_record(i) for i in range(10))
+        records = [make_record(i) for i in range(10)]
+        assert list(FingerprintIndex.from_records(store).digests) == list(
+            FingerprintIndex.from_records(records).digests
+        )
+        # dynamodb doesn't take floats
+        store = RecordStore({"video_id": "str", "tags": "category_list"})
+        store.append({"video_id": "v-1", "tags": ["a"]})
+        assert serialize(store[0]) == serialize({"video_id": "v-1", "tags": ["a"]})
+
+    def test_bytes_per_record(self):
+        n = 20_000
+        records, dict_size = measure(lambda: [make_record(i) for i in range(n)])
+
+        def build():
+            store = RecordStore(SCHEMA)
+            store.extend(records)
+            return store
+
+        store, store_size = measure(build)
+        print(
+            f"dicts {dict_size / n:.0f} bytes/record, "
+            f"store {store_size / n:.0f} bytes/record "
+            f"(columns {store.nbytes / n:.0f})"
+        )
+        assert store_size * 4 < dict_size
+
+    def test_to_arrow(self):
+        pa = pytest.importorskip("pyarrow")
+        store = RecordStore(SCHEMA)
+        records = [make_record(i) for i in range(10)]
+        records.append(dict(video_id="missing"))
+        store.extend(records)
+        batch = store.to_arrow()
+        assert batch.to_pylist() == [
+            {k: record.get(k) for k in SCHEMA} for record in records
+        ]
+        assert pa.types.is_dictionary(batch.schema.field("lang_code").type)
+        assert sum(b.num_rows for b in store.iter_record_batches(4)) == 11
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.records",
+        preview=False,
+    )
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from sakura_gather.exc import LeaseLostError
+from sakura_gather.scheduler import (
+    Shard,
+    make_shards,
+    InMemoryShardStore,
+    DynamoDBShardStore,
+    WorkStealingScheduler,
+    run_worker,
+    simulate_makespan,
+)
+from sakura_gather.tests.mock_aws import TABLE_NAME
+
+
+def test_make_shards():
+    shards = make_shards({"db-1": 25, "db-2": 5}, shard_size=10)
+    assert [(s.shard_id, s.start, s.end) for s in shards] == [
+        ("db-1@0", 0, 10),
+        ("db-1@10", 10, 20),
+        ("db-1@20", 20, 25),
+        ("db-2@0", 0, 5),
+    ]
+
+
+def check_store(store):
+    store.add_shards([Shard(unit="db", start=0, end=10)])
+    a = WorkStealingScheduler(store, owner="a", lease_ttl=60, clock=lambda: 1000)
+    b = WorkStealingScheduler(store, owner="b", lease_ttl=60, clock=lambda: 1000)
+
+    shard_a = a.next_shard()
+    assert shard_a.shard_id == "db@0"
+    shard_a, start, end = a.claim(shard_a, 2)
+    assert (start, end) == (0, 2)
+
+    # nothing is free, b steals the second half of the unclaimed range
+    shard_b = b.next_shard()
+    assert (shard_b.start, shard_b.end) == (6, 10)
+    assert b.n_steal == 1
+
+    # a learns the new end on the next claim
+    shard_a, start, end = a.claim(shard_a, 10)
+    assert (start, end, shard_a.end) == (2, 6, 6)
+    shard_a, start, end = a.claim(shard_a, 10)
+    assert start == end
+    a.complete(shard_a)
+
+    with pytest.raises(LeaseLostError):
+        a.claim(shard_b, 1)
+
+    # the lease expires, a takes over b's shard
+    a.clock = lambda: 2000
+    shard = a.next_shard()
+    assert shard.shard_id == "db@6"
+    with pytest.raises(LeaseLostError):
+        b.complete(shard_b)
+
+    # a dies after claiming a step it never processed, b resumes at the last
+    # commit instead of the claimed-until position
+    shard, start, end = a.claim(shard, 2)
+    shard = a.commit(shard, end)
+    assert shard.committed == 8
+    shard, start, end = a.claim(shard, 2)
+    assert (start, end) == (8, 10)
+    b.clock = lambda: 3000
+    shard_b = b.next_shard()
+    assert (shard_b.shard_id, shard_b.cursor) == ("db@6", 8)
+    with pytest.raises(LeaseLostError):
+        a.commit(shard, end)
+    with pytest.raises(LeaseLostError):
+        a.heartbeat(shard)
+    shard_b, start, end = b.claim(shard_b, 5)
+    assert (start, end) == (8, 10)
+    shard_b = b.heartbeat(shard_b)
+    assert shard_b.lease_expire == 3060
+
+
+def test_in_memory_store():
+    check_store(InMemoryShardStore())
+
+
+def test_dynamodb_store(dynamodb_client):
+    client = dynamodb_client
+    # an unrelated item and another pool are not listed
+    client.put_item(TableName=TABLE_NAME, Item={"id": {"S": "video-1"}})
+    other = DynamoDBShardStore(client, TABLE_NAME, pool="other")
+    other.add_shards([Shard(unit="db", start=100, end=110)])
+    check_store(DynamoDBShardStore(client, TABLE_NAME))
+    assert [shard.shard_id for shard in other.list_shards()] == ["db@100"]
+
+
+def test_run_worker():
+    store = InMemoryShardStore()
+    store.add_shards(make_shards({"db-1": 100, "db-2": 37}, shard_size=20))
+    seen = list()
+    lock = threading.Lock()
+
+    def process_func(unit, start, end):
+        with lock:
+            seen.extend((unit, i) for i in range(start, end))
+
+    threads = [
+        threading.Thread(
+            target=run_worker,
+            args=(WorkStealingScheduler(store, owner=f"w-{i}"), process_func, 3),
+        )
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(seen) == sorted(
+        [("db-1", i) for i in range(100)] + [("db-2", i) for i in range(37)]
+    )
+
+
+def test_run_worker_resumes_after_crash():
+    store = InMemoryShardStore()
+    store.add_shards(make_shards({"db": 10}, shard_size=10))
+    seen = list()
+
+    def crash_func(unit, start, end):
+        if start == 4:
+            raise RuntimeError("worker died")
+        seen.extend(range(start, end))
+
+    a = WorkStealingScheduler(store, owner="a", lease_ttl=60, clock=lambda: 1000)
+    with pytest.raises(RuntimeError):
+        run_worker(a, crash_func, step=2)
+    assert seen == [0, 1, 2, 3]
+
+    # after the lease expires, b picks up the claimed but unprocessed range
+    b = WorkStealingScheduler(store, owner="b", lease_ttl=60, clock=lambda: 2000)
+    run_worker(b, lambda unit, start, end: seen.extend(range(start, end)), step=2)
+    assert seen == list(range(10))
+
+
+def test_run_worker_heartbeat():
+    store = InMemoryShardStore()
+    store.add_shards(make_shards({"db": 2}, shard_size=2))
+    other = WorkStealingScheduler(store, owner="b", lease_ttl=0.2)
+    taken = list()
+
+    def slow_func(unit, start, end):
+        # runs longer than the lease ttl, the heartbeat keeps the lease
+        time.sleep(0.5)
+        taken.append(other.next_shard(steal=False))
+
+    a = WorkStealingScheduler(store, owner="a", lease_ttl=0.2)
+    assert run_worker(a, slow_func, step=1, heartbeat_interval=0.05) == 2
+    assert taken == [None, None]
+
+
+def test_simulate_makespan():
+    units = {f"db-{i}": 200 for i in range(4)}
+    speeds = [1.0, 1.0, 1.0, 0.1]
+    no_steal = simulate_makespan(
+        4, units, shard_size=200, worker_speeds=speeds, step=5, steal=False
+    )
+    steal = simulate_makespan(
+        4, units, shard_size=200, worker_speeds=speeds, step=5, steal=True
+    )
+    assert sum(steal.n_processed) == sum(no_steal.n_processed) == 800
+    assert no_steal.n_steal == 0
+    assert steal.n_steal > 0
+    assert steal.makespan < no_steal.makespan / 3
+
+    # roughly linear scaling with equal workers
+    units = {f"db-{i}": 1000 for i in range(2)}
+    t1 = simulate_makespan(1, units, 100, worker_speeds=[1.0] * 1, step=5)
+    t8 = simulate_makespan(8, units, 100, worker_speeds=[1.0] * 8, step=5)
+    assert t1.makespan / t8.makespan > 7
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.scheduler",
+        preview=False,
+    )
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+
+import pytest
+
+from sakura_gather.search_index import SearchIndex, to_match_query, get_facets
+
+
+def make_record(i: int, lang_code: str = "cn", **kwargs) -> dict:
+    record = {
+        "video_id": f"v-{i}",
+        "lang_code": lang_code,
+        "title": f"video title {i}",
+        "tags": [f"tag-{i % 3}"],
+        "performers": [f"performer-{i % 5}"],
+        "release_date": f"2024-{i % 12 + 1:02d}-01",
+    }
+    record.update(kwargs)
+    return record
+
+
+def test_to_match_query():
+    assert to_match_query('school "girl" -x') == '"school" """girl""" "-x"'
+
+
+def test_get_facets():
+    assert get_facets(make_record(4)) == {
+        ("tags", "tag-1"),
+        ("performers", "performer-4"),
+        ("release_month", "2024-05"),
+    }
+    assert get_facets({"video_id": "v-1"}) == set()
+
+
+class TestSearchIndex:
+    def test_search(self, tmp_path):
+        index = SearchIndex(tmp_path / "index.sqlite3")
+        index.add_many(make_record(i) for i in range(30))
+        index.add(make_record(100, lang_code="en", title="school days"))
+        assert len(index) == 31
+        assert index.get("v-100")["title"] == "school days"
+        assert index.get("v-999") is None
+
+        result = index.search("school")
+        assert [r["video_id"] for r in result.records] == ["v-100"]
+        assert index.search("school", lang_code="cn").n_total == 0
+        # all terms must match, across title and tags
+        assert index.search("title tag-2").n_total == 10
+        # FTS5 syntax is searched for literally instead of raising
+        assert index.search('"AND (').n_total == 0
+
+        result = index.search(
+            lang_code="cn", tags=["tag-0"], performers=["performer-0"]
+        )
+        assert result.n_total == 2  # 0 and 15
+        assert {r["video_id"] for r in result.records} == {"v-0", "v-15"}
+
+        result = index.search(release_month="2024-03", limit=2)
+        assert result.n_total == 3
+        assert len(result.records) == 2
+        result = index.search(lang_code="cn", date_from="2024-11-01")
+        assert result.n_total == 4  # 10, 11, 22, 23
+        # no query, newest first
+        dates = [r["release_date"] for r in index.search(limit=100).records]
+        assert dates == sorted(dates, reverse=True)
+        index.close()
+
+    def test_upsert_and_facet_counts(self, tmp_path):
+        path = tmp_path / "index.sqlite3"
+        with SearchIndex(path) as index:
+            index.add_many(make_record(i) for i in range(30))
+            index.add_many(make_record(i) for i in range(30))  # a retried batch
+            assert len(index) == 30
+            assert index.get_facet_counts("tags", lang_code="cn") == [
+                ("tag-0", 10),
+                ("tag-1", 10),
+                ("tag-2", 10),
+            ]
+
+            index.add(make_record(0, tags=["new"], title="renamed"))
+            assert index.search("video title", tags=["new"]).n_total == 0
+            assert index.search("renamed", tags=["new"]).n_total == 1
+            assert index.search(tags=["tag-0"]).n_total == 9
+            counts = dict(index.get_facet_counts("tags"))
+            assert counts == {"tag-0": 9, "tag-1": 10, "tag-2": 10, "new": 1}
+
+            # moving to another lang code moves the counts too
+            index.add(make_record(0, lang_code="en", tags=["new"]))
+            assert index.get_facet_counts("tags", lang_code="en") == [("new", 1)]
+            counts = dict(index.get_facet_counts("tags", lang_code="cn"))
+            assert "new" not in counts
+            assert sum(n for _, n in index.get_facet_counts("release_month")) == 30
+
+            with pytest.raises(ValueError):
+                index.get_facet_counts("title")
+
+            # a failing batch is rolled back as a whole
+            with pytest.raises(KeyError):
+                index.add_many([make_record(100), {"title": "no id"}])
+            assert index.get("v-100") is None
+
+    def test_export_readonly(self, tmp_path):
+        with SearchIndex(tmp_path / "index.sqlite3") as index:
+            index.add_many(make_record(i) for i in range(10))
+            path = index.export(tmp_path / "shipped" / "index.sqlite3")
+        assert {p.name for p in path.parent.iterdir()} == {"index.sqlite3"}
+        with SearchIndex(path, readonly=True) as index:
+            assert len(index) == 10
+            assert index.search("title", tags=["tag-1"]).n_total == 3
+            with pytest.raises(Exception):
+                index.add(make_record(100))
+
+    def test_lookup_speed(self, tmp_path):
+        rng = random.Random(1)
+        words = [f"word{i}" for i in range(2000)]
+        with SearchIndex(tmp_path / "index.sqlite3") as index:
+            index.add_many(
+                make_record(
+                    i,
+                    lang_code=rng.choice(["cn", "en", "ja"]),
+                    title=" ".join(rng.choices(words, k=8)),
+                    tags=[f"tag-{rng.randint(0, 300)}" for _ in range(5)],
+                )
+                for i in range(20_000)
+            )
+            start = time.perf_counter()
+            for i in range(100):
+                index.search(words[i], lang_code="cn", limit=20)
+                index.search(lang_code="en", tags=[f"tag-{i}"], limit=20)
+                index.get_facet_counts("tags", lang_code="ja")
+            per_lookup = (time.perf_counter() - start) / 300
+            assert per_lookup < 0.01
+
+            # re-feeding a batch of existing records finds their facets by id
+            plan = index._conn.execute(
+                "EXPLAIN QUERY PLAN SELECT kind, value FROM facet WHERE id = ?", (1,)
+            ).fetchall()
+            assert "ix_facet_id" in str(plan)
+            start = time.perf_counter()
+            index.add_many(make_record(i, title="again") for i in range(500))
+            assert time.perf_counter() - start < 1
+
+
+def test_ship(tmp_path, s3_client):
+    pytest.importorskip("smart_open")
+    from sakura_gather.uploader import Target
+
+    client = s3_client
+    client.create_bucket(Bucket="s3-bucket")
+    client.create_bucket(Bucket="r2-bucket")
+    with SearchIndex(tmp_path / "index.sqlite3") as index:
+        index.add_many(make_record(i) for i in range(10))
+        stats = index.ship(
+            [
+                Target(uri="s3://s3-bucket/index.sqlite3", client=client),
+                Target(uri="s3://r2-bucket/index.sqlite3", client=client),
+            ]
+        )
+    assert stats.n_target == 2
+    path = tmp_path / "downloaded.sqlite3"
+    client.download_file("r2-bucket", "index.sqlite3", str(path))
+    with SearchIndex(path, readonly=True) as index:
+        assert len(index) == 10
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.search_index",
+        preview=False,
+    )
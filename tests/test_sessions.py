@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+pytest.importorskip("boto3")
+
+from botocore.config import Config
+
+from sakura_gather.sessions import (
+    SessionRegistry,
+    mask,
+    get_default_registry,
+)
+
+
+@pytest.fixture
+def registry(aws_session):
+    return SessionRegistry(session=aws_session, max_pool_connections=32)
+
+
+def count_calls(client, event_name: str) -> list:
+    calls = list()
+    client.meta.events.register(
+        f"before-call.{event_name}",
+        lambda **kwargs: calls.append(1),
+    )
+    return calls
+
+
+def test_mask():
+    assert mask("123456789012") == "12********12"
+    assert mask("1234") == "****"
+
+
+class TestSessionRegistry:
+    def test_client_reused(self, registry):
+        assert registry.s3 is registry.s3
+        assert registry.dynamodb is registry.get_client("dynamodb")
+        assert registry.s3 is not registry.dynamodb
+        assert registry.n_client_created == 2
+        config = registry.s3.meta.config
+        assert config.max_pool_connections == 32
+        assert config.tcp_keepalive is True
+
+    def test_r2_client(self, registry):
+        r2 = registry.get_r2_client("https://r2.example.com", "key", "secret")
+        assert r2 is registry.get_r2_client("https://r2.example.com", "key", "secret")
+        assert r2 is not registry.s3
+        assert r2.meta.endpoint_url == "https://r2.example.com"
+        assert r2.meta.config.max_pool_connections == 32
+
+    def test_config_key(self, registry):
+        def new_config():
+            return Config(retries={"max_attempts": 3}, signature_version="s3v4")
+
+        s3 = registry.get_client("s3", config=new_config())
+        # an equal config built separately shares the client
+        assert s3 is registry.get_client("s3", config=new_config())
+        other = registry.get_client("s3", config=Config(signature_version="s3v4"))
+        assert other is not s3
+        assert registry.n_client_created == 2
+
+    def test_thread_safe(self, registry):
+        clients = list()
+        barrier = threading.Barrier(16)
+
+        def get():
+            barrier.wait()
+            clients.append(registry.get_client("sqs"))
+
+        threads = [threading.Thread(target=get) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len({id(client) for client in clients}) == 1
+        assert registry.n_client_created == 1
+
+    def test_identity_cached(self, registry):
+        now = [1000.0]
+        registry.clock = lambda: now[0]
+        registry.identity_ttl = 60
+        calls = count_calls(registry.sts, "sts.GetCallerIdentity")
+        identity = registry.get_identity()
+        assert identity.account_id == "123456789012"
+        assert registry.get_identity() is identity
+        assert "12********12" in registry.who_am_i(masked=True)
+        assert "123456789012" in registry.who_am_i(masked=False)
+        assert len(calls) == 1
+
+        now[0] += 61  # expired
+        registry.get_identity()
+        assert len(calls) == 2
+
+        registry.clear()
+        assert registry._identity is None
+
+    def test_from_bsm(self, registry):
+        class Bsm:
+            boto_ses = registry.session
+
+        assert SessionRegistry.from_bsm(Bsm).session is registry.session
+
+
+def test_get_default_registry():
+    assert get_default_registry() is get_default_registry()
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.sessions",
+        preview=False,
+    )
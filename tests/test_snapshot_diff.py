@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from sakura_gather.snapshot_diff import (
+    hash_key,
+    hash_record,
+    FingerprintIndex,
+    diff,
+    select_changed,
+    select_removed,
+    to_shards,
+)
+
+
+def test_hash_record():
+    assert hash_record({"a": 1, "b": 2}) == hash_record({"b": 2, "a": 1})
+    assert hash_record({"a": 1, "t": 1}, ["t"]) == hash_record({"a": 1, "t": 2}, ["t"])
+
+
+def test_diff(tmp_path):
+    old_records = [
+        {"video_id": f"v-{i}", "title": f"t-{i}", "crawled_at": 1} for i in range(10)
+    ]
+    new_records = [
+        {"video_id": f"v-{i}", "title": f"t-{i}", "crawled_at": 2}
+        for i in range(3, 13)
+    ]
+    new_records[0]["title"] = "changed"  # v-3
+    old = FingerprintIndex.from_records(old_records, exclude_fields=["crawled_at"])
+    new = FingerprintIndex.from_records(new_records, exclude_fields=["crawled_at"])
+
+    path = tmp_path / "index.bin"
+    old.save(path)
+    old = FingerprintIndex.load(path)
+    assert len(old) == 10
+    assert list(old.keys) == sorted(old.keys)
+
+    delta = diff(old, new)
+    assert sorted(delta.added) == sorted(hash_key(f"v-{i}") for i in [10, 11, 12])
+    assert sorted(delta.removed) == sorted(hash_key(f"v-{i}") for i in [0, 1, 2])
+    assert list(delta.modified) == [hash_key("v-3")]
+    assert delta.to_message() == "3 added, 3 removed, 1 modified"
+
+    changed = [r["video_id"] for r in select_changed(new_records, delta)]
+    assert changed == ["v-3", "v-10", "v-11", "v-12"]
+    removed = [r["video_id"] for r in select_removed(old_records, delta)]
+    assert removed == ["v-0", "v-1", "v-2"]
+
+    shards = to_shards(changed, unit="cn-delta", shard_size=3)
+    assert [(s.start, s.end) for s in shards] == [(0, 3), (3, 4)]
+
+    assert len(diff(new, new).changed) == 0
+
+
+def test_duplicated_key():
+    # the last record of a key wins, whatever its digest
+    index = FingerprintIndex.from_pairs([(1, 9), (2, 5), (1, 3)])
+    assert list(index.keys) == [1, 2]
+    assert list(index.digests) == [3, 5]
+    index = FingerprintIndex.from_pairs([(1, 3), (1, 9)])
+    assert list(index.digests) == [9]
+
+    old = FingerprintIndex.from_records([{"video_id": "v-1", "title": "a"}])
+    new = FingerprintIndex.from_records(
+        [{"video_id": "v-1", "title": "z"}, {"video_id": "v-1", "title": "a"}]
+    )
+    assert len(diff(old, new).changed) == 0
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.snapshot_diff",
+        preview=False,
+    )
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from sakura_gather.status_tracking import (
+    BatchedStatusTracker,
+    LeaseLostError,
+)
+from sakura_gather.tests.mock_aws import TABLE_NAME
+
+
+@pytest.fixture
+def client(dynamodb_client):
+    return dynamodb_client
+
+
+class TestBatchedStatusTracker:
+    def test_coalesce_and_flush(self, client):
+        tracker = BatchedStatusTracker(client, TABLE_NAME, flush_size=50)
+        for i in range(30):
+            tracker.put({"id": f"v-{i}", "status": 0})
+        tracker.update(("v-0",), {"status": 1})
+        tracker.update(("v-100",), {"status": 2})
+        tracker.update(("v-100",), {"n": 3})
+        tracker.delete(("v-29",))
+        assert tracker.n_request == 0
+        assert tracker.n_pending == 31
+
+        tracker.flush()
+        # 30 puts / deletes in 2 batch writes + 1 transaction
+        assert tracker.n_request == 3
+
+        items = tracker.get_many([("v-0",), ("v-1",), ("v-29",), ("v-100",)])
+        assert items[("v-0",)]["status"] == 1
+        assert items[("v-1",)]["status"] == 0
+        assert ("v-29",) not in items
+        assert items[("v-100",)] == {"id": "v-100", "status": 2, "n": 3}
+
+    def test_flush_size(self, client):
+        tracker = BatchedStatusTracker(client, TABLE_NAME, flush_size=10)
+        for i in range(25):
+            tracker.put({"id": f"v-{i}", "status": 0})
+        assert tracker.n_pending == 5
+        assert tracker.n_request == 2
+
+    def test_read_your_writes(self, client):
+        with BatchedStatusTracker(client, TABLE_NAME) as tracker:
+            tracker.put({"id": "v-1", "status": 0})
+            assert tracker.get(("v-1",))["status"] == 0
+
+    def test_failed_flush_keeps_writes(self, client, monkeypatch):
+        tracker = BatchedStatusTracker(client, TABLE_NAME, flush_size=50)
+        for i in range(30):
+            tracker.put({"id": f"v-{i}", "status": 0})
+        tracker.update(("v-100",), {"status": 2})
+
+        def batch_write_item(**kwargs):
+            raise RuntimeError("unprocessed items")
+
+        with monkeypatch.context() as m:
+            m.setattr(client, "batch_write_item", batch_write_item)
+            with pytest.raises(RuntimeError):
+                tracker.flush()
+        assert tracker.n_pending == 31
+        tracker.flush()
+        items = tracker.get_many([("v-0",), ("v-29",), ("v-100",)])
+        assert len(items) == 3
+
+    def test_lease(self, client):
+        now = [1000]
+        tracker = BatchedStatusTracker(client, TABLE_NAME, clock=lambda: now[0])
+        key = ("db-1",)
+        assert tracker.acquire_lease(key, "a", expire=60) is True
+        now[0] = 1030
+        assert tracker.acquire_lease(key, "b", expire=60) is False
+        assert tracker.acquire_lease(key, "a", expire=60) is True
+
+        tracker.update(key, {"status": 1}, lease_owner="a")
+        tracker.flush()
+        assert tracker.get(key)["status"] == 1
+
+        # lease expired, a's guarded write is rejected even before anyone
+        # else takes it
+        now[0] = 2000
+        tracker.update(key, {"status": 2}, lease_owner="a")
+        with pytest.raises(LeaseLostError):
+            tracker.flush()
+        assert tracker.get(key)["status"] == 1
+
+        # stolen by b
+        assert tracker.acquire_lease(key, "b", expire=60) is True
+        tracker.update(key, {"status": 2}, lease_owner="a")
+        tracker.update(("other",), {"status": 3})
+        with pytest.raises(LeaseLostError):
+            tracker.flush()
+        assert tracker.get(key)["status"] == 1
+        assert tracker.get(("other",))["status"] == 3
+
+        assert tracker.release_lease(key, "a") is False
+        assert tracker.release_lease(key, "b") is True
+        assert "lease_owner" not in tracker.get(key)
+
+    def test_put_delete_of_leased_key(self, client):
+        tracker = BatchedStatusTracker(client, TABLE_NAME)
+        key = ("db-1",)
+        assert tracker.acquire_lease(key, "a", expire=60) is True
+        with pytest.raises(ValueError):
+            tracker.put({"id": "db-1", "status": 0})
+        with pytest.raises(ValueError):
+            tracker.delete(key)
+        assert tracker.release_lease(key, "a") is True
+        tracker.put({"id": "db-1", "status": 0})
+        tracker.flush()
+
+        # a pending guarded update is not silently replaced
+        other = BatchedStatusTracker(client, TABLE_NAME)
+        other.update(key, {"status": 1}, lease_owner="b")
+        with pytest.raises(ValueError):
+            other.put({"id": "db-1", "status": 2})
+        with pytest.raises(ValueError):
+            other.delete(key)
+        assert other.n_pending == 1
+
+    def test_lease_lost_in_automatic_flush(self, client):
+        tracker = BatchedStatusTracker(client, TABLE_NAME, flush_size=2)
+        key = ("db-1",)
+        assert tracker.acquire_lease(key, "b", expire=60) is True
+        tracker.update(key, {"status": 1}, lease_owner="a")
+        # the put fills the buffer and flushes a's rejected update, the put
+        # itself is fine
+        tracker.put({"id": "v-1", "status": 0})
+        assert tracker.n_pending == 0
+        assert tracker.get(("v-1",))["status"] == 0
+        # the loss is reported on a's next update of that key
+        with pytest.raises(LeaseLostError) as e:
+            tracker.update(key, {"status": 2}, lease_owner="a")
+        assert e.value.keys == [key]
+        tracker.update(key, {"status": 2}, lease_owner="b")
+        tracker.flush()
+        assert tracker.get(key)["status"] == 2
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.status_tracking",
+        preview=False,
+    )
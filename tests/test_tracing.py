@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import asyncio
+
+import pytest
+
+from sakura_gather.tracing import (
+    MemorySink,
+    JsonlSink,
+    OtlpFileSink,
+    Tracer,
+    get_tracer,
+    set_tracer,
+    span,
+    traced,
+    load_spans,
+    summarize,
+    format_summary,
+)
+from sakura_gather.daemon import DaemonConfig, CrawlDaemon
+
+
+@pytest.fixture
+def sink():
+    sink = MemorySink()
+    previous = set_tracer(Tracer(sink=sink))
+    yield sink
+    set_tracer(previous)
+
+
+def test_span_nesting(sink):
+    with span("root", lang_code="cn") as root:
+        with span("child") as child:
+            pass
+    assert [s.name for s in sink.spans] == ["child", "root"]
+    assert child.parent_id == root.span_id
+    assert child.trace_id == root.trace_id
+    assert root.parent_id is None
+    assert root.attrs == {"lang_code": "cn"}
+    assert root.duration >= child.duration
+
+
+def test_span_error(sink):
+    with pytest.raises(ValueError):
+        with span("boom"):
+            raise ValueError("bad")
+    assert sink.spans[0].error == "ValueError: bad"
+
+
+def test_traced(sink):
+    @traced("sync")
+    def f(x):
+        return x + 1
+
+    @traced()
+    async def g(x):
+        return x * 2
+
+    assert f(1) == 2
+    assert asyncio.run(g(2)) == 4
+    assert [s.name for s in sink.spans] == ["sync", "test_traced.<locals>.g"]
+
+
+def test_sampling():
+    sink = MemorySink()
+    tracer = Tracer(sink=sink, sample_rate=0.0)
+    with tracer.span("root") as root:
+        with tracer.span("child") as child:
+            pass
+    assert root is None and child is None
+    assert sink.spans == []
+
+    # a sampled trace is always complete
+    tracer.sample_rate = 0.5
+    for _ in range(200):
+        with tracer.span("root"):
+            with tracer.span("child"):
+                pass
+    n_root = sum(1 for s in sink.spans if s.name == "root")
+    n_child = sum(1 for s in sink.spans if s.name == "child")
+    assert n_root == n_child
+    assert 0 < n_root < 200
+
+
+def test_disabled_overhead():
+    tracer = get_tracer()
+    assert tracer.sink is None
+    n = 100_000
+    start = time.perf_counter()
+    for _ in range(n):
+        with span("noop"):
+            pass
+    per_span = (time.perf_counter() - start) / n
+    # a fetch takes milliseconds, a disabled span must cost well under 1% of it
+    assert per_span < 10e-6
+
+
+def test_record(sink):
+    with span("root"):
+        get_tracer().record("parse", 0.5, n_page=3)
+    parse = sink.spans[0]
+    assert parse.name == "parse"
+    assert parse.duration == 0.5
+    assert parse.parent_id == sink.spans[1].span_id
+
+
+def test_jsonl_sink_and_summarize(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    previous = set_tracer(Tracer(sink=JsonlSink(path, buffer_size=2)))
+    try:
+        for _ in range(3):
+            with span("work_unit"):
+                with span("fetch"):
+                    time.sleep(0.001)
+                with pytest.raises(RuntimeError):
+                    with span("upload"):
+                        raise RuntimeError
+    finally:
+        set_tracer(previous)
+    spans = load_spans(path)
+    assert len(spans) == 9
+    summaries = {s.name: s for s in summarize(spans)}
+    assert summaries["work_unit"].count == 3
+    assert summaries["work_unit"].share == pytest.approx(1.0)
+    assert 0 < summaries["fetch"].share < 1
+    assert summaries["upload"].n_error == 3
+    assert "work_unit" in format_summary(list(summaries.values()))
+
+
+def test_otlp_file_sink(tmp_path):
+    path = tmp_path / "trace.otlp.jsonl"
+    tracer = Tracer(sink=OtlpFileSink(path))
+    with tracer.span("root", n=1, ok=True):
+        with tracer.span("child", host="example.com"):
+            pass
+    tracer.close()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    spans = [line["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for line in lines]
+    child, root = spans
+    assert child["parentSpanId"] == root["spanId"]
+    assert len(root["traceId"]) == 32
+    assert root["attributes"] == [
+        {"key": "n", "value": {"intValue": "1"}},
+        {"key": "ok", "value": {"boolValue": True}},
+    ]
+    assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+
+
+def test_daemon_spans(sink):
+    daemon = CrawlDaemon(
+        crawl_func=lambda lang_code, node_id: 1,
+        next_node_id_func=lambda: 7,
+        config=DaemonConfig(lang_code_list=["cn"], max_cycles=1),
+    )
+    daemon.run_forever()
+    names = sorted(s.name for s in sink.spans)
+    assert names == ["crawl", "node_selection", "work_unit"]
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.tracing",
+        preview=False,
+    )
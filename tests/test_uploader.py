@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import io
+import threading
+
+import pytest
+
+from sakura_gather.uploader import Target, FanOutUploader
+
+
+class FailingClient:
+    """
+    Delegate to a real client, but fail the call that completes the object.
+    """
+
+    def __init__(self, client, fail_on: str):
+        self._client = client
+        self._fail_on = fail_on
+
+    def __getattr__(self, name):
+        if name == self._fail_on:
+
+            def fail(**kwargs):
+                raise RuntimeError(f"{name} failed")
+
+            return fail
+        return getattr(self._client, name)
+
+
+class CountingReader(io.BytesIO):
+    n_read_bytes = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.n_read_bytes += len(data)
+        return data
+
+
+@pytest.fixture
+def s3_client(s3_client):
+    s3_client.create_bucket(Bucket="s3-bucket")
+    s3_client.create_bucket(Bucket="r2-bucket")
+    return s3_client
+
+
+class TestFanOutUploader:
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            FanOutUploader(part_size=1024)
+
+    def test_upload(self, s3_client):
+        data = b"0123456789" * 1_200_000  # 12 MB, 3 parts of 5 MB
+        source = CountingReader(data)
+        uploader = FanOutUploader(part_size=5 * 1024 * 1024, chunk_size=256 * 1024)
+        stats = uploader.upload(
+            source,
+            targets=[
+                Target(uri="s3://s3-bucket/a.bin", client=s3_client),
+                Target(uri="s3://r2-bucket/a.bin", client=s3_client),
+            ],
+        )
+        assert source.n_read_bytes == len(data)  # read once
+        assert stats.n_bytes == len(data)
+        assert stats.bytes_per_second > 0
+        assert stats.peak_rss > 0
+        for bucket in ["s3-bucket", "r2-bucket"]:
+            body = s3_client.get_object(Bucket=bucket, Key="a.bin")["Body"].read()
+            assert body == data
+
+    def test_upload_error(self, s3_client):
+        uploader = FanOutUploader(part_size=5 * 1024 * 1024, chunk_size=1024 * 1024)
+        with pytest.raises(Exception):
+            uploader.upload(
+                io.BytesIO(b"x" * 12 * 1024 * 1024),
+                targets=[
+                    Target(uri="s3://s3-bucket/b.bin", client=s3_client),
+                    Target(uri="s3://not-exists/b.bin", client=s3_client),
+                ],
+            )
+        res = s3_client.list_objects_v2(Bucket="s3-bucket")
+        assert res["KeyCount"] == 0
+
+    @pytest.mark.parametrize(
+        "fail_on, size",
+        [
+            ("upload_part", 5),  # smaller than a part, sent on close
+            ("complete_multipart_upload", 6 * 1024 * 1024),
+        ],
+    )
+    def test_upload_error_on_close(self, s3_client, fail_on, size):
+        uploader = FanOutUploader(part_size=5 * 1024 * 1024, chunk_size=1024 * 1024)
+        errors = list()
+
+        def upload():
+            try:
+                uploader.upload(
+                    io.BytesIO(b"x" * size),
+                    targets=[
+                        Target(uri="s3://s3-bucket/c.bin", client=s3_client),
+                        Target(
+                            uri="s3://r2-bucket/c.bin",
+                            client=FailingClient(s3_client, fail_on),
+                        ),
+                    ],
+                )
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=upload, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive()  # used to wait forever for the end
+        assert len(errors) == 1
+        res = s3_client.list_objects_v2(Bucket="r2-bucket")
+        assert res["KeyCount"] == 0
+
+    def test_upload_many(self, s3_client, tmp_path):
+        jobs = list()
+        for i in range(5):
+            path = tmp_path / f"{i}.txt"
+            path.write_bytes(f"file-{i}".encode())
+            jobs.append(
+                (path, [Target(uri=f"s3://s3-bucket/{i}.txt", client=s3_client)])
+            )
+        stats = FanOutUploader(max_workers=3).upload_many(jobs)
+        assert stats.n_target == 5
+        body = s3_client.get_object(Bucket="s3-bucket", Key="3.txt")["Body"].read()
+        assert body == b"file-3"
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "sakura_gather.uploader",
+        preview=False,
+    )
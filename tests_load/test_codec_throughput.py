@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Size and decompression speed of stored detail pages: raw, gzip (what generic
+compression gives today) and zstd with a trained dictionary.
+"""
+
+import gzip
+import time
+import random
+
+import pytest
+
+from sakura_gather.tests.benchmark import run_benchmark, check_regression
+
+N_PAGE = 5000
+
+
+def test_codec_throughput(tmp_path):
+    pytest.importorskip("zstandard")
+    from sakura_gather.codec import DictionaryStore, PageCodec
+
+    from sakura_gather.tests.fixture_site import render_template_page
+
+    rng = random.Random(1)
+    pages = [render_template_page(rng, i) for i in range(N_PAGE)]
+    codec = PageCodec(DictionaryStore(tmp_path))
+    codec.train("cn", pages[:1000])
+
+    gzip_blobs = [gzip.compress(page) for page in pages]
+    zstd_blobs = [codec.compress("cn", page) for page in pages]
+    raw_size = sum(map(len, pages))
+    gzip_size = sum(map(len, gzip_blobs))
+    zstd_size = sum(map(len, zstd_blobs))
+
+    start = time.perf_counter()
+    for blob in gzip_blobs:
+        gzip.decompress(blob)
+    gzip_elapsed = time.perf_counter() - start
+
+    result = run_benchmark("codec_decompress", codec.decompress, zstd_blobs)
+    print(
+        f"raw {raw_size / N_PAGE:.0f} B/page, gzip {gzip_size / N_PAGE:.0f} B/page, "
+        f"zstd + dict {zstd_size / N_PAGE:.0f} B/page; "
+        f"gzip {N_PAGE / gzip_elapsed:,.0f} pages/s, "
+        f"zstd + dict {result.items_per_second:,.0f} pages/s"
+    )
+    assert zstd_size * 3 < gzip_size
+    assert result.elapsed < gzip_elapsed
+    error = check_regression(result)
+    assert error is None, error
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
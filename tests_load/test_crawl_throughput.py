@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Crawl throughput benchmark suite: fetch, parse, status write and upload,
+against the local fixture site and moto backed S3 / DynamoDB.
+
+Every benchmark reports pages/s, p50 / p95 / p99 latency and peak RSS, writes
+``tests_load/latest.json`` and fails if throughput dropped more than
+``SAKURA_GATHER_MAX_REGRESSION`` percent (default 20) below
+``tests_load/baseline.json``. Baselines are machine specific and not in git,
+see :mod:`sakura_gather.tests.benchmark` for how to create and restore one.
+"""
+
+import io
+import time
+
+from sakura_gather.fetcher import AsyncFetcher, download_pages
+from sakura_gather.metrics import get_peak_rss
+from sakura_gather.tests.fixture_site import (
+    run_fixture_site,
+    render_video_page,
+    parse_video_page,
+    UrllibTransport,
+)
+from sakura_gather.tests.benchmark import (
+    BenchmarkResult,
+    run_benchmark,
+    check_regression,
+)
+from sakura_gather.tests.mock_aws import TABLE_NAME
+
+N_PAGE = 500
+
+
+def assert_no_regression(result: BenchmarkResult):
+    message = check_regression(result)
+    assert message is None, message
+
+
+def test_fetch_throughput():
+    try:
+        import aiohttp  # noqa: F401
+
+        transport = None
+    except ImportError:  # pragma: no cover
+        transport = UrllibTransport()
+    with run_fixture_site(latency=0.005) as (base_url, hits):
+        urls = [f"{base_url}/video/{i}" for i in range(N_PAGE)]
+        start = time.perf_counter()
+        results = download_pages(urls, transport=transport, max_concurrency=32)
+        elapsed = time.perf_counter() - start
+    assert all(res.ok for res in results)
+    assert_no_regression(
+        BenchmarkResult(
+            name="fetch",
+            n_item=len(results),
+            elapsed=elapsed,
+            latencies=[res.elapsed for res in results],
+            peak_rss=get_peak_rss(),
+        )
+    )
+
+
+def test_parse_throughput():
+    pages = [(f"/video/{i}", render_video_page(str(i))) for i in range(N_PAGE)]
+    result = run_benchmark(
+        "parse",
+        lambda page: parse_video_page(*page),
+        pages,
+    )
+    assert_no_regression(result)
+
+
+def test_status_write_throughput(dynamodb_client):
+    from sakura_gather.status_tracking import BatchedStatusTracker
+
+    tracker = BatchedStatusTracker(dynamodb_client, TABLE_NAME)
+    result = run_benchmark(
+        "status_write",
+        lambda i: tracker.put({"id": f"v-{i}", "status": 1}),
+        range(N_PAGE),
+    )
+    tracker.flush()
+    assert_no_regression(result)
+
+
+def test_upload_throughput(s3_client):
+    from sakura_gather.uploader import Target, FanOutUploader
+
+    client = s3_client
+    client.create_bucket(Bucket="bucket")
+    uploader = FanOutUploader()
+    page = render_video_page("1")
+    result = run_benchmark(
+        "upload",
+        lambda i: uploader.upload(
+            io.BytesIO(page),
+            [Target(uri=f"s3://bucket/{i}.html", client=client)],
+        ),
+        range(N_PAGE // 5),
+    )
+    assert_no_regression(result)
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare sequential downloads with :class:`~sakura_gather.fetcher.AsyncFetcher`
+against the local fixture site, no network needed.
+"""
+
+import time
+import urllib.request
+
+import pytest
+
+from sakura_gather.fetcher import download_pages
+from sakura_gather.tests.fixture_site import run_fixture_site
+
+N_PAGE = 200
+LATENCY = 0.05
+
+
+def fetch_sequential(urls: list[str]):
+    for url in urls:
+        with urllib.request.urlopen(url) as res:
+            res.read()
+
+
+def test_fetcher_throughput():
+    pytest.importorskip("aiohttp")
+    with run_fixture_site(latency=LATENCY) as (base_url, hits):
+        urls = [f"{base_url}/video/{i}" for i in range(N_PAGE)]
+
+        start = time.perf_counter()
+        fetch_sequential(urls[:20])
+        seq_pages_per_sec = 20 / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results = download_pages(
+            urls,
+            max_concurrency=32,
+            max_concurrency_per_host=16,
+        )
+        async_pages_per_sec = N_PAGE / (time.perf_counter() - start)
+
+    assert all(res.ok for res in results)
+    print(
+        f"sequential: {seq_pages_per_sec:.1f} pages/s, "
+        f"async: {async_pages_per_sec:.1f} pages/s"
+    )
+    assert async_pages_per_sec > seq_pages_per_sec * 3
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
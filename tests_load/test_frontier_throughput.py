@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Push / pop throughput of the persistent frontier with one million urls, and
+how much memory it takes.
+"""
+
+import time
+
+from sakura_gather.metrics import get_peak_rss
+from sakura_gather.frontier import Frontier
+
+N_URL = 1_000_000
+BATCH_SIZE = 10_000
+
+
+def test_frontier_throughput(tmp_path):
+    rss_before = get_peak_rss()
+    with Frontier(tmp_path, initial_capacity=N_URL // 4) as frontier:
+        start = time.perf_counter()
+        for i in range(0, N_URL, BATCH_SIZE):
+            urls = [f"https://example.com/video/{j}" for j in range(i, i + BATCH_SIZE)]
+            frontier.push_many(urls, priority=i % 7)
+        push_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_dup = sum(
+            frontier.push_many(
+                [f"https://example.com/video/{j}" for j in range(i, i + BATCH_SIZE)]
+            )
+            for i in range(0, N_URL, BATCH_SIZE * 10)
+        )
+        dedup_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_pop = 0
+        while True:
+            items = frontier.pop(BATCH_SIZE)
+            if not items:
+                break
+            frontier.ack([item.id for item in items])
+            n_pop += len(items)
+        pop_elapsed = time.perf_counter() - start
+        n_bloom_byte = frontier.bloom.n_byte
+    rss_growth = get_peak_rss() - rss_before
+
+    print(
+        f"push {N_URL / push_elapsed:,.0f} urls/s, "
+        f"dedup {N_URL // 10 / dedup_elapsed:,.0f} urls/s, "
+        f"pop + ack {n_pop / pop_elapsed:,.0f} urls/s, "
+        f"bloom {n_bloom_byte / N_URL:.1f} bytes/url, "
+        f"peak rss growth {rss_growth / 1024 / 1024:.1f} MB"
+    )
+    assert n_dup == 0
+    # false positives of the Bloom filter are checked in the seen table
+    assert n_pop == N_URL
+    assert n_bloom_byte / N_URL < 5
+    # only one batch of urls is in python memory at a time
+    assert rss_growth < 200 * 1024 * 1024
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Node id allocation under contention: 200 workers start at the same time and
+take node ids from moto backed DynamoDB, once through a single counter item
+with conditional writes (what ``RoundRobinManager`` does) and once through
+:class:`~sakura_gather.node_id.NodeIdDispenser`. Reports writes, conflicts
+and ids/s of both.
+
+moto's ``ADD`` is not atomic, it reads, adds and writes the item in separate
+steps, so concurrent claims may get the same block. The uniqueness check on
+moto goes through :class:`~sakura_gather.tests.mock_aws.SerializedClient`,
+which makes the claims take turns. A second run claims concurrently, without
+the wrapper, and reports the claim latency; its ids are not checked. With
+``SAKURA_GATHER_DYNAMODB_ENDPOINT`` pointing to a DynamoDB Local, a third run
+claims concurrently on it and checks both.
+"""
+
+import time
+import threading
+
+from sakura_gather.node_id import NodeIdDispenser
+from sakura_gather.tests.mock_aws import TABLE_NAME, SerializedClient
+
+N_WORKER = 200
+N_ID = 5
+
+
+class SingleCounter:
+    """
+    Read the counter, then write it back only if nobody else did.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.n_write = 0
+        self.n_conflict = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        key = {"id": {"S": "single-counter"}}
+        while True:
+            res = self.client.get_item(
+                TableName=TABLE_NAME, Key=key, ConsistentRead=True
+            )
+            current = int(res.get("Item", {}).get("n", {}).get("N", "0"))
+            try:
+                self.client.put_item(
+                    TableName=TABLE_NAME,
+                    Item={**key, "n": {"N": str(current + 1)}},
+                    ConditionExpression="attribute_not_exists(n) OR n = :n",
+                    ExpressionAttributeValues={":n": {"N": str(current)}},
+                )
+                with self._lock:
+                    self.n_write += 1
+                return current
+            except self.client.exceptions.ConditionalCheckFailedException:
+                with self._lock:
+                    self.n_write += 1
+                    self.n_conflict += 1
+
+
+class TimedClient:
+    """
+    Record the seconds of every ``update_item`` call, i.e. of every claim.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self.latencies: list[float] = list()
+
+    def update_item(self, **kwargs):
+        start = time.perf_counter()
+        res = self._client.update_item(**kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.append(elapsed)
+        return res
+
+    def get_percentile(self, p: float) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    def to_message(self) -> str:
+        return (
+            f"claim latency p50 {self.get_percentile(0.5) * 1000:.1f} ms, "
+            f"p99 {self.get_percentile(0.99) * 1000:.1f} ms"
+        )
+
+
+def run_workers(funcs: list) -> tuple[list[int], float]:
+    ids = list()
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(funcs))
+
+    def worker(func):
+        barrier.wait()
+        got = [func() for _ in range(N_ID)]
+        with lock:
+            ids.extend(got)
+
+    threads = [threading.Thread(target=worker, args=(func,)) for func in funcs]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return ids, time.perf_counter() - start
+
+
+def run_dispensers(client, counter_name: str) -> tuple[list[int], float, int]:
+    dispensers = [
+        NodeIdDispenser(
+            client,
+            TABLE_NAME,
+            counter_name=counter_name,
+            block_size=N_ID,
+            seed=i,
+        )
+        for i in range(N_WORKER)
+    ]
+    ids, elapsed = run_workers(dispensers)
+    return ids, elapsed, sum(d.n_claim for d in dispensers)
+
+
+def test_node_id_contention(dynamodb_client):
+    client = dynamodb_client
+    single = SingleCounter(client)
+    # moto doesn't make the read-check-write of a conditional put atomic
+    # across threads, so unlike DynamoDB this may hand out duplicates, only
+    # the writes and conflicts are compared
+    _, single_elapsed = run_workers([single] * N_WORKER)
+
+    # the atomic ADD of DynamoDB, serialized for moto
+    ids, elapsed, n_claim = run_dispensers(SerializedClient(client), "serialized")
+    assert len(set(ids)) == len(ids)
+
+    # the claims at the same time, moto may hand out a block twice here
+    timed_client = TimedClient(client)
+    _, concurrent_elapsed, _ = run_dispensers(timed_client, "concurrent")
+
+    n = N_WORKER * N_ID
+    print(
+        f"single counter: {single.n_write} writes, {single.n_conflict} conflicts, "
+        f"{n / single_elapsed:,.0f} ids/s; "
+        f"dispenser: {n_claim} writes, 0 conflicts, {n / elapsed:,.0f} ids/s "
+        f"serialized, {n / concurrent_elapsed:,.0f} ids/s concurrent, "
+        f"{timed_client.to_message()}"
+    )
+    assert n_claim == N_WORKER
+    assert n_claim < single.n_write
+    assert len(timed_client.latencies) == N_WORKER
+
+
+def test_node_id_contention_dynamodb_local(dynamodb_local_client):
+    """
+    All claims at the same time on a real DynamoDB Local, whose ``ADD`` is
+    atomic, no id is handed out twice.
+    """
+    timed_client = TimedClient(dynamodb_local_client)
+    ids, elapsed, n_claim = run_dispensers(timed_client, "dynamodb-local")
+    assert len(set(ids)) == len(ids)
+    assert n_claim == N_WORKER
+    n = N_WORKER * N_ID
+    print(
+        f"dispenser on DynamoDB Local: {n_claim} writes, "
+        f"{n / elapsed:,.0f} ids/s, {timed_client.to_message()}"
+    )
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scan time and file size of the Parquet snapshot against the JSON lines
+snapshot, for a "long videos in one language" query.
+"""
+
+import gzip
+import json
+import time
+import random
+
+import pytest
+
+from sakura_gather.parquet_snapshot import (
+    iter_jsonl,
+    convert_jsonl_snapshot,
+    read_snapshot,
+)
+
+N_RECORD = 200_000
+LANG_CODES = ["cn", "en", "ja", "tw"]
+
+
+def dir_size(path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def test_parquet_snapshot_scan(tmp_path):
+    pc = pytest.importorskip("pyarrow.compute")
+    rng = random.Random(1)
+    tags = [f"tag-{i}" for i in range(200)]
+    path_jsonl = tmp_path / "snapshot.jsonl.gz"
+    with gzip.open(path_jsonl, "wt") as f:
+        for i in range(N_RECORD):
+            record = dict(
+                video_id=f"v-{i}",
+                title=f"video title number {i}",
+                duration=rng.randint(60, 7200),
+                tags=rng.sample(tags, 5),
+                lang_code=rng.choice(LANG_CODES),
+                shard=i % 8,
+            )
+            f.write(json.dumps(record) + "\n")
+    dir_snapshot = tmp_path / "parquet"
+    convert_jsonl_snapshot([path_jsonl], dir_snapshot)
+
+    start = time.perf_counter()
+    expected = sorted(
+        r["video_id"]
+        for r in iter_jsonl(path_jsonl)
+        if r["lang_code"] == "cn" and r["duration"] > 3600
+    )
+    jsonl_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = read_snapshot(
+        dir_snapshot,
+        columns=["video_id"],
+        filter=(pc.field("lang_code") == "cn") & (pc.field("duration") > 3600),
+    )
+    parquet_elapsed = time.perf_counter() - start
+
+    assert sorted(table.column("video_id").to_pylist()) == expected
+    print(
+        f"jsonl.gz: {path_jsonl.stat().st_size / 1024 / 1024:.1f} MB, "
+        f"scan {jsonl_elapsed:.3f}s; "
+        f"parquet: {dir_size(dir_snapshot) / 1024 / 1024:.1f} MB, "
+        f"scan {parquet_elapsed:.3f}s"
+    )
+    assert parquet_elapsed < jsonl_elapsed
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
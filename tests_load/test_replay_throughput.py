@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fetch and parse throughput replayed from a cassette, with no network: the
+benchmark to A/B fetch and parse changes on the same bytes. The cassette is
+recorded from the local fixture site here, point ``SAKURA_GATHER_CASSETTE``
+at a cassette recorded from the real site to replay that one instead.
+"""
+
+import os
+from pathlib import Path
+
+from sakura_gather.cassette import RecordingTransport, ReplayTransport
+from sakura_gather.fetcher import download_pages
+from sakura_gather.tests.fixture_site import (
+    run_fixture_site,
+    parse_video_page,
+    UrllibTransport,
+)
+from sakura_gather.tests.benchmark import run_benchmark, check_regression
+
+N_PAGE = 500
+
+
+def test_replay_throughput(tmp_path):
+    path = os.environ.get("SAKURA_GATHER_CASSETTE")
+    if path is None:
+        path = tmp_path / "cassette.zip"
+        with run_fixture_site() as (base_url, _):
+            urls = [f"{base_url}/video/{i}" for i in range(N_PAGE)]
+            download_pages(
+                urls,
+                transport=RecordingTransport(path, transport=UrllibTransport()),
+            )
+    transport = ReplayTransport(Path(path), latency=0)
+    urls = transport.get_urls()
+    results = download_pages(urls, transport=transport)
+    assert all(res.ok for res in results)
+
+    result = run_benchmark(
+        "replay_parse",
+        lambda res: parse_video_page(res.url, res.body),
+        results,
+    )
+    print(result.to_message())
+    error = check_regression(result)
+    assert error is None, error
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+Makespan of the work-stealing scheduler with N simulated workers, compared
+with the ideal makespan (total work divided by total worker speed).
+"""
+
+import random
+
+from sakura_gather.scheduler import simulate_makespan
+
+UNITS = {f"db-{i}": 2000 for i in range(16)}
+
+
+def test_scheduler_makespan():
+    rng = random.Random(1)
+    n_item = sum(UNITS.values())
+    for n_worker in [1, 2, 4, 8, 16, 32]:
+        speeds = [rng.uniform(0.2, 1.0) for _ in range(n_worker)]
+        ideal = n_item / sum(speeds)
+        res = simulate_makespan(
+            n_worker, UNITS, shard_size=500, worker_speeds=speeds, step=10
+        )
+        no_steal = simulate_makespan(
+            n_worker,
+            UNITS,
+            shard_size=500,
+            worker_speeds=speeds,
+            step=10,
+            steal=False,
+        )
+        print(
+            f"{n_worker:>3} workers: makespan {res.makespan:>9.1f}, "
+            f"no steal {no_steal.makespan:>9.1f}, ideal {ideal:>9.1f}, "
+            f"efficiency {ideal / res.makespan:.0%}, {res.n_steal} steals"
+        )
+        assert res.makespan <= no_steal.makespan
+        assert ideal / res.makespan > 0.8
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fan-out upload to two local S3 compatible servers (one stands in for
+Cloudflare R2, like a MinIO endpoint would), compared with uploading the file
+twice, one target after another.
+
+The servers are two moto servers on free ports picked by the OS. Both serve
+the one in-process moto backend, so they are two endpoints with their own
+sockets and request threads but shared storage: each target gets its own
+bucket, and the numbers measure the client side fan-out, not two independent
+storage services.
+"""
+
+import os
+
+import pytest
+
+from sakura_gather.uploader import Target, FanOutUploader
+
+FILE_SIZE = 64 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    moto_server = pytest.importorskip("moto.server")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    clients = list()
+    started = list()
+    for bucket in ["s3-bucket", "r2-bucket"]:
+        # port 0, the OS picks a free one
+        server = moto_server.ThreadedMotoServer(
+            ip_address="127.0.0.1", port=0, verbose=False
+        )
+        server.start()
+        started.append(server)
+        host, port = server.get_host_and_port()
+        client = boto3.client(
+            "s3",
+            region_name="us-east-1",
+            endpoint_url=f"http://{host}:{port}",
+        )
+        client.create_bucket(Bucket=bucket)
+        clients.append((client, bucket))
+    yield clients
+    for server in started:
+        server.stop()
+
+
+def test_uploader_throughput(servers, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(FILE_SIZE))
+    s3_client, r2_client = servers
+    uploader = FanOutUploader(part_size=PART_SIZE)
+
+    sequential_elapsed = 0.0
+    for client, bucket in [s3_client, r2_client]:
+        stats = uploader.upload(path, [Target(f"s3://{bucket}/seq.bin", client)])
+        sequential_elapsed += stats.elapsed
+
+    stats = uploader.upload(
+        path,
+        [
+            Target(f"s3://{bucket}/fan.bin", client)
+            for client, bucket in [s3_client, r2_client]
+        ],
+    )
+    print(
+        f"sequential: {2 * FILE_SIZE / sequential_elapsed / 1024 / 1024:.1f} MB/s, "
+        f"fan-out: {2 * FILE_SIZE / stats.elapsed / 1024 / 1024:.1f} MB/s, "
+        f"peak rss: {stats.peak_rss / 1024 / 1024:.1f} MB"
+    )
+    for client, bucket in [s3_client, r2_client]:
+        head = client.head_object(Bucket=bucket, Key="fan.bin")
+        assert head["ContentLength"] == FILE_SIZE
+
+
+if __name__ == "__main__":
+    from sakura_gather.tests import run_unit_test
+
+    run_unit_test(__file__)